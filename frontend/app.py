@@ -10,8 +10,11 @@ sys.path.append(root_dir)
 
 import streamlit as st
 import time
+import uuid
+import itertools
 from src.data_loader import DataIntegrator
-from src.agent import AgenteAnaliticoLLM
+from src.agente_async import AgenteAnaliticoAsync, NucleoAnaliticoAsync
+from src.logic import AnalizadorProgramasSociales
 from src.config import get_api_key
 
 # Configuración de Página
@@ -33,6 +36,16 @@ def iniciar_sistema():
         st.error(f"Error iniciando sistema: {e}")
         return None
 
+@st.cache_resource
+def iniciar_motor(_df):
+    """Motor analítico compartido por todas las sesiones (índices y caché de filtros)"""
+    return AnalizadorProgramasSociales(_df)
+
+@st.cache_resource
+def iniciar_nucleo(_df, api_key):
+    """Cliente del LLM (pool de conexiones), cola de turnos, cachés e intérprete compartidos por las sesiones con esa API Key"""
+    return NucleoAnaliticoAsync(_df, api_key, motor=iniciar_motor(_df))
+
 # --- 2. Sidebar de Configuración ---
 with st.sidebar:
     st.header("⚙️ Configuración")
@@ -54,6 +67,9 @@ with st.sidebar:
     st.markdown("- **D:** Vulnerabilidad (0-3)")
     st.markdown("- **E:** Tablas Cruzadas")
 
+    # Las narrativas se reutilizan si el resultado es idéntico a uno ya narrado
+    regenerar = st.checkbox("🔁 Regenerar narrativa (ignorar caché)", value=False)
+
 # --- 3. Lógica Principal ---
 if not api_key:
     st.info("👈 Por favor configura tu API Key en el menú lateral.")
@@ -67,7 +83,8 @@ if df is None:
 
 # Inicializar agente en sesión
 if "agente" not in st.session_state:
-    st.session_state.agente = AgenteAnaliticoLLM(df, api_key)
+    # Sin login: cada sesión del navegador tiene su propia fila en la cola del LLM
+    st.session_state.agente = AgenteAnaliticoAsync(iniciar_nucleo(df, api_key), usuario=uuid.uuid4().hex)
 
 # Historial de chat
 if "messages" not in st.session_state:
@@ -85,17 +102,19 @@ if prompt := st.chat_input("Escribe tu consulta (ej: 'Jefas de familia con caren
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # Procesar respuesta
+    # Procesar respuesta: la tabla aparece al terminar el motor y la narrativa se va escribiendo
     with st.chat_message("assistant"):
-        with st.spinner("🧠 Analizando datos con Arquitectura V3..."):
-            try:
-                inicio = time.time()
-                respuesta = st.session_state.agente.procesar(prompt)
-                tiempo = time.time() - inicio
-                
-                st.markdown(respuesta)
-                st.caption(f"⏱️ Procesado en {tiempo:.2f}s")
-                
-                st.session_state.messages.append({"role": "assistant", "content": respuesta})
-            except Exception as e:
-                st.error(f"Ocurrió un error: {e}")
\ No newline at end of file
+        try:
+            inicio = time.time()
+            flujo = st.session_state.agente.procesar_stream(prompt, regenerar_narrativa=regenerar)
+            with st.spinner("🧠 Analizando datos con Arquitectura V3..."):
+                primero = next(flujo, "")
+            primera_salida = time.time() - inicio
+            respuesta = st.write_stream(itertools.chain([primero], flujo))
+            tiempo = time.time() - inicio
+
+            st.caption(f"⏱️ Primera salida en {primera_salida:.2f}s · completo en {tiempo:.2f}s")
+
+            st.session_state.messages.append({"role": "assistant", "content": respuesta})
+        except Exception as e:
+            st.error(f"Ocurrió un error: {e}")
\ No newline at end of file
@@ -1,15 +1,85 @@
 import json
 import re
+import hashlib
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import Iterator, List, Tuple
 from openai import OpenAI
-from .logic import AnalizadorProgramasSociales
-from .config import CONSTANTES_MAPEO
+from .logic import AnalizadorProgramasSociales, expandir_grupo_especial
+from .indices import normalizar_consulta
+from .cache_persistente import CachePersistente
+from .interprete_local import InterpreteLocal
+from .contexto import TOKENS, compactar_resultado, json_compacto, resumen_turno
+from .config import (CONSTANTES_MAPEO, RUTA_CACHE_LLM, CACHE_INTENCIONES_TTL_H, CACHE_INTENCIONES_MAX,
+                     CACHE_NARRATIVAS_TTL_H, CACHE_NARRATIVAS_MAX, MAX_ANALISIS_POR_CONSULTA, HILOS_ANALISIS,
+                     LLM_BASE_URL, PRESUPUESTO_TOKENS_HISTORIAL, MAX_TURNOS_RESUMIDOS)
 
-class AgenteAnaliticoLLM:
-    def __init__(self, df_completo, api_key):
-        self.client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com/v1")
-        self.motor = AnalizadorProgramasSociales(df_completo)
-        
-        self.system_prompt = """Eres un Asistente de Política Social.
+# Preguntas ya interpretadas por el LLM, compartidas entre sesiones y procesos
+CACHE_INTENCIONES = CachePersistente(RUTA_CACHE_LLM, "intenciones", CACHE_INTENCIONES_TTL_H * 3600, CACHE_INTENCIONES_MAX)
+# Narrativas por huella del resultado: frases distintas que llevan al mismo análisis reutilizan el texto
+CACHE_NARRATIVAS = CachePersistente(RUTA_CACHE_LLM, "narrativas", CACHE_NARRATIVAS_TTL_H * 3600, CACHE_NARRATIVAS_MAX)
+# Hilos para los análisis de una pregunta comparativa (el motor es de solo lectura entre actualizaciones)
+EJECUTOR_ANALISIS = ThreadPoolExecutor(max_workers=HILOS_ANALISIS, thread_name_prefix="analisis")
+
+# FASE 4: prompt del narrador (cambiar su texto, modelo o temperatura invalida las narrativas cacheadas)
+NARRADOR_SISTEMA = "Eres un Estratega Senior de Política Social, tu tarea es interpretar datos numéricos de manera profunda y estratégica para guiar decisiones de política pública en la Alcaldía Álvaro Obregón, enfocándote en vulnerabilidad social, brechas de género y edad, y patrones atípicos. Además, eres capaz de proponer estrategias breves y efectivas de comunicación digital para llegar a la población objetivo vía SMS y correo electrónico. Tu análisis debe ser empático, profesional y orientado a decisiones prácticas."
+RESUMEN_HISTORIAL = "Turnos anteriores de esta conversación (resumidos):"
+
+# Sin sangría: cada espacio del prompt es un token que se paga en cada narrativa
+NARRADOR_INSTRUCCIONES = textwrap.dedent("""
+                        Analiza los siguientes datos JSON resultantes de una consulta sobre los datos del CENSO del Bienestar de la Alcaldía Álvaro Obregón:
+                        {datos}
+
+                        INSTRUCCIONES DE ANÁLISIS:
+                        1. Las tablas vienen por filas ('columnas' + 'filas'); las largas traen sus filas principales, el resto sumado ('otras_N_filas') y el TOTAL.
+                        2. Realiza una interpretación PROFUNDA y NARRATIVA de los datos numéricos.
+                        3. Busca activamente:
+                        - Brechas de género (¿Las mujeres están más afectadas?).
+                        - Vulnerabilidad por edad (¿Niños o ancianos en riesgo?).
+                        - Patrones atípicos o alarmantes.
+                        4. Usa un tono profesional, empático y orientado a la toma de decisiones.
+                        5. NO repitas los números fila por fila (eso aburre), explica QUÉ SIGNIFICAN esos números para la política social.
+                        6. Estructura tu respuesta con subtítulos claros (Markdown).
+                        7. Si los datos traen varios análisis ('comparacion'), contrástalos entre sí en una sola narrativa.
+                        """).strip()
+
+class NucleoAnalitico:
+    """Parte compartida del agente: cliente del LLM (un pool de conexiones), motor, cachés e intérprete.
+
+    Se construye una vez por proceso y no guarda estado de ninguna conversación:
+    sus atributos no cambian tras __init__ y todos sus métodos pueden llamarse
+    desde varias sesiones a la vez. El historial vive en cada AgenteAnaliticoLLM.
+    """
+    INTENCIONES = ["conteo_general", "elegibilidad", "brechas", "vulnerabilidad", "tabla_cruzada",
+                   "ranking_brechas", "ranking_vulnerabilidad", "hogares", "vulnerabilidad_hogares"]
+    # Recorren filas de personas: no se ofrecen cuando el motor corre sobre el censo particionado
+    INTENCIONES_POR_PERSONA = ("ranking_brechas", "ranking_vulnerabilidad", "hogares", "vulnerabilidad_hogares")
+    MODELO_NARRADOR = "deepseek-chat"
+    TEMPERATURA_NARRADOR = 0.4  # Subimos temperatura para recuperar creatividad y elocuencia
+
+    def __init__(self, df_completo, api_key, motor: AnalizadorProgramasSociales = None,
+                 cache_intenciones: CachePersistente = None, cache_narrativas: CachePersistente = None):
+        self._api_key = api_key
+        # El motor (con sus índices y caché) puede compartirse entre procesos de la app
+        self.motor = motor if motor is not None else AnalizadorProgramasSociales(df_completo)
+        self.cache_intenciones = cache_intenciones if cache_intenciones is not None else CACHE_INTENCIONES
+        self.cache_narrativas = cache_narrativas if cache_narrativas is not None else CACHE_NARRATIVAS
+        # Preguntas de fórmula ('¿cuántas mujeres hay en X?') se interpretan sin llamar al LLM
+        self.interprete = InterpreteLocal(self.motor)
+        self.intenciones = [i for i in self.INTENCIONES
+                            if self.motor.filas_disponibles or i not in self.INTENCIONES_POR_PERSONA]
+
+        mapeo_por_persona = textwrap.dedent("""\
+        - "Qué colonias/AGEBs", "Ranking", "Priorizar" + brechas o programa -> intencion="ranking_brechas"
+        - "Qué colonias/AGEBs", "Ranking", "Priorizar" + vulnerabilidad o carencias -> intencion="ranking_vulnerabilidad"
+          (nivel_territorial="colonia" o "ageb"; top_k = cuántas zonas mostrar)
+        - "Hogares con al menos un...", "Hogares donde todos..." -> intencion="hogares"
+          (los filtros describen al miembro; sin_apoyo=true si no recibe apoyo; cuantificador="todos" o min_miembros=N)
+        - "Hogares con N carencias", "Vulnerabilidad de los hogares" -> intencion="vulnerabilidad_hogares"
+        """) if self.motor.filas_disponibles else ""
+        self.system_prompt = textwrap.dedent("""\
+        Eres un Asistente de Política Social.
         TU MISIÓN: Traducir preguntas a JSON para la herramienta 'ejecutar_analisis'.
         
         MAPEO DE INTENCIONES:
@@ -18,9 +88,20 @@ class AgenteAnaliticoLLM:
         - "Brechas", "No reciben" -> intencion="brechas"
         - "Vulnerabilidad", "Intensidad" -> intencion="vulnerabilidad" (Es el análisis global 0-3 carencias. NO pidas especificar tipo).
         - "Cruzar", "Tabla", "Relación" -> intencion="tabla_cruzada"
-        """
-        
-        self.messages = [{"role": "system", "content": self.system_prompt}]
+        {mapeo_por_persona}
+        COMPARACIONES: si la pregunta compara zonas, sexos, programas o grupos, llama a 'ejecutar_analisis'
+        una vez por cada combinación, todas en la misma respuesta (ej. brechas de un programa para
+        Mujer/Hombre en dos colonias = 4 llamadas).
+        """).format(mapeo_por_persona=mapeo_por_persona).strip()
+        self.herramientas = self._definir_master_tool()
+
+        # Si cambian el prompt o el esquema de la herramienta, las intenciones cacheadas dejan de aplicar
+        self._huella_parser = hashlib.sha256(
+            json.dumps([self.system_prompt, self.herramientas], sort_keys=True).encode()
+        ).hexdigest()[:16]
+        self._huella_narrador = hashlib.sha256(
+            json.dumps([NARRADOR_SISTEMA, NARRADOR_INSTRUCCIONES, self.MODELO_NARRADOR, self.TEMPERATURA_NARRADOR]).encode()
+        ).hexdigest()[:16]
 
     def _definir_master_tool(self):
         return [{
@@ -33,7 +114,7 @@ class AgenteAnaliticoLLM:
                     "properties": {
                         "intencion": {
                             "type": "string",
-                            "enum": ["conteo_general", "elegibilidad", "brechas", "vulnerabilidad", "tabla_cruzada"]
+                            "enum": self.intenciones
                         },
                         "filtros": {
                             "type": "object",
@@ -45,7 +126,14 @@ class AgenteAnaliticoLLM:
                                 "carencia_tipo": {"type": "string", "enum": ["salud", "educacion", "seguridad_social"]},
                                 "grupo_especial": {"type": "string", "enum": ["ninguno", "jefas_familia"]},
                                 "variable_fila": {"type": "string", "enum": list(CONSTANTES_MAPEO["VARIABLES_CRUCE"].keys())},
-                                "variable_columna": {"type": "string", "enum": list(CONSTANTES_MAPEO["VARIABLES_CRUCE"].keys())}
+                                "variable_columna": {"type": "string", "enum": list(CONSTANTES_MAPEO["VARIABLES_CRUCE"].keys())},
+                                "nivel_territorial": {"type": "string", "enum": list(AnalizadorProgramasSociales.NIVELES_TERRITORIALES)},
+                                "top_k": {"type": "integer", "minimum": 1, "maximum": AnalizadorProgramasSociales.TOP_K_MAXIMO},
+                                "ordenar_por": {"type": "string", "enum": ["personas_sin_apoyo", "porcentaje_brecha",
+                                                                           "intensidad_promedio", "personas_con_carencias"]},
+                                "sin_apoyo": {"type": "boolean"},
+                                "cuantificador": {"type": "string", "enum": list(AnalizadorProgramasSociales.CUANTIFICADORES_HOGAR)},
+                                "min_miembros": {"type": "integer", "minimum": 1}
                             }
                         }
                     },
@@ -56,26 +144,43 @@ class AgenteAnaliticoLLM:
 
     def _router_maestro(self, args):
         intencion = args.get('intencion')
-        filtros = args.get('filtros', {})
-        if filtros.get('grupo_especial') == 'jefas_familia':
-            filtros['sexo'] = 'Mujer'
-            filtros['parentesco'] = 'jefe'
+        filtros = expandir_grupo_especial(args.get('filtros', {}))
 
         try:
-            if intencion == 'conteo_general': return self.motor.analisis_general(filtros)
-            elif intencion == 'elegibilidad': return self.motor.analizar_elegibilidad(filtros)
-            elif intencion == 'brechas': return self.motor.analizar_brechas(filtros)
-            elif intencion == 'vulnerabilidad': return self.motor.analizar_vulnerabilidad(filtros)
-            elif intencion == 'tabla_cruzada': return self.motor.tabla_cruzada(filtros)
-            return {"error": "Intención no reconocida"}
+            if intencion == 'conteo_general': resultado = self.motor.analisis_general(filtros)
+            elif intencion == 'elegibilidad': resultado = self.motor.analizar_elegibilidad(filtros)
+            elif intencion == 'brechas': resultado = self.motor.analizar_brechas(filtros)
+            elif intencion == 'vulnerabilidad': resultado = self.motor.analizar_vulnerabilidad(filtros)
+            elif intencion == 'tabla_cruzada': resultado = self.motor.tabla_cruzada(filtros)
+            elif intencion == 'ranking_brechas': resultado = self.motor.ranking_brechas(filtros)
+            elif intencion == 'ranking_vulnerabilidad': resultado = self.motor.ranking_vulnerabilidad(filtros)
+            elif intencion == 'hogares': resultado = self.motor.analizar_hogares(filtros)
+            elif intencion == 'vulnerabilidad_hogares': resultado = self.motor.analizar_vulnerabilidad_hogares(filtros)
+            else: return {"error": "Intención no reconocida"}
+
+            return self._agregar_ubicaciones(resultado, filtros)
         except Exception as e:
             return {"error_interno": str(e)}
 
-    def _normalizar_salida_llm(self, msg):
-        if msg.tool_calls:
-            try: return json.loads(msg.tool_calls[0].function.arguments)
+    def _agregar_ubicaciones(self, resultado: dict, filtros: dict) -> dict:
+        # Explicamos qué colonias/AGEBs cubrió el filtro geográfico
+        if filtros.get('ubicacion'):
+            resultado['ubicaciones_coincidentes'] = self.motor.resolver_ubicacion(filtros['ubicacion'], limite=10)
+        return resultado
+
+    def _normalizar_salida_llm(self, msg) -> List[Tuple[str, dict]]:
+        """[(id de la llamada, args)] de todas las llamadas a la herramienta (o del JSON en el texto)."""
+        llamadas = []
+        for llamada in msg.tool_calls or []:
+            try: llamadas.append((llamada.id, json.loads(llamada.function.arguments)))
             except: pass
-        content = msg.content or ""
+        if llamadas:
+            return llamadas
+        args = self._args_en_texto(msg.content or "")
+        return [("call_fallback", args)] if args else []
+
+    @staticmethod
+    def _args_en_texto(content: str):
         if "<|tool" in content:
             try:
                 match = re.search(r"<\|tool sep\|>(.*?)<\|tool call end\|>", content, re.DOTALL)
@@ -87,79 +192,316 @@ class AgenteAnaliticoLLM:
         except: pass
         return None
 
-    def procesar(self, consulta: str):
-            # Limpieza periódica de memoria
-            if len(self.messages) > 6:
-                self.messages = [{"role": "system", "content": self.system_prompt}]
-                
-            self.messages.append({"role": "user", "content": consulta})
+    def _clave_intencion(self, consulta: str) -> str:
+        return f"{self._huella_parser}:{normalizar_consulta(consulta)}"
+
+    @staticmethod
+    def mensaje_asistente(llamadas: List[Tuple[str, dict]]) -> dict:
+        """Mensaje del asistente equivalente a las llamadas del LLM, para mantener el historial coherente."""
+        return {"role": "assistant", "content": None, "tool_calls": [{
+            "id": id_llamada, "type": "function",
+            "function": {"name": "ejecutar_analisis", "arguments": json.dumps(args, ensure_ascii=False)}
+        } for id_llamada, args in llamadas]}
+
+    def _llamada_sintetica(self, planes: List[dict], prefijo: str):
+        llamadas = [(f"{prefijo}_{i}", args) for i, args in enumerate(planes)]
+        return self.mensaje_asistente(llamadas), llamadas
+
+    def interpretar(self, messages: list, contexto_nuevo: bool):
+        """(mensaje del asistente, [(id de la llamada, args)]) para la última pregunta de la conversación:
+        del intérprete local, la caché de intenciones o el LLM (con el historial de esa sesión)."""
+        previo = self.interpretar_sin_llm(messages[-1]["content"], contexto_nuevo)
+        if previo is not None:
+            return previo
+        resp = self.client.chat.completions.create(**self.peticion_parser(messages))
+        self.calibrar_tokens(messages, resp)
+        msg = resp.choices[0].message
+        return msg, self.resolver_parser(messages[-1]["content"], contexto_nuevo, msg)
+
+    @cached_property
+    def client(self) -> OpenAI:
+        """Cliente síncrono, creado al primer uso (el núcleo asíncrono no lo necesita).
+
+        Es thread-safe: todas las sesiones reutilizan sus conexiones HTTP.
+        """
+        return OpenAI(api_key=self._api_key, base_url=LLM_BASE_URL)
+
+    def interpretar_sin_llm(self, consulta: str, contexto_nuevo: bool):
+        """Interpretación del intérprete local o de la caché de intenciones; None si hace falta el LLM."""
+        args, confianza = self.interprete.interpretar(consulta, contexto_nuevo)
+        local = args is not None and confianza >= self.interprete.UMBRAL and args["intencion"] in self.intenciones
+        self.interprete.registrar(local)
+        if local:
+            return self._llamada_sintetica([args], "call_local")
+
+        # Mismo criterio que al guardar: a mitad de conversación la pregunta depende de los turnos anteriores
+        if not contexto_nuevo:
+            return None
+        planes = self.cache_intenciones.obtener(self._clave_intencion(consulta))
+        if planes is not None:
+            return self._llamada_sintetica(planes, "call_cache")
+        return None
+
+    def peticion_parser(self, messages: list) -> dict:
+        return dict(
+            model="deepseek-chat",
+            messages=messages,
+            tools=self.herramientas,
+            tool_choice="auto", 
+            temperature=0.0 
+        )
+
+    def calibrar_tokens(self, messages: list, resp):
+        """Ajusta la estimación de tokens con lo que la API reporta haber leído."""
+        usage = getattr(resp, "usage", None)
+        if usage is not None and getattr(usage, "prompt_tokens", None):
+            estimado = TOKENS.mensajes(messages) + TOKENS.texto(json_compacto(self.herramientas))
+            TOKENS.calibrar(estimado, usage.prompt_tokens)
+
+    def resolver_parser(self, consulta: str, contexto_nuevo: bool, msg) -> List[Tuple[str, dict]]:
+        llamadas = self._normalizar_salida_llm(msg)
+
+        # Solo se guardan interpretaciones hechas sin historial: no dependen de turnos anteriores
+        if contexto_nuevo and llamadas and all(args.get('intencion') in self.intenciones for _, args in llamadas):
+            self.cache_intenciones.guardar(self._clave_intencion(consulta), [args for _, args in llamadas])
+        return llamadas
+
+    def ejecutar_plan(self, planes: List[dict]) -> List[dict]:
+        """Resultados de varios análisis, en el orden del plan.
+
+        Los análisis corren en paralelo. En los modos del motor donde conviene, las
+        elegibilidades/brechas de una misma intención van juntas a analizar_lote
+        (una sola pasada sobre el censo).
+        """
+        if len(planes) == 1:
+            return [self._router_maestro(planes[0])]
+
+        lotes = {}
+        for i, args in enumerate(planes):
+            if self.motor.modo in self.motor.MODOS_LOTE and args.get('intencion') in self.motor.INTENCIONES_LOTE:
+                lotes.setdefault(args['intencion'], []).append(i)
+        lotes = {intencion: indices for intencion, indices in lotes.items() if len(indices) > 1}
+        en_lote = {i for indices in lotes.values() for i in indices}
+
+        def lote(intencion, indices):
+            try:
+                resultados = self.motor.analizar_lote([planes[i].get('filtros', {}) for i in indices], intencion)
+            except Exception as e:
+                return [{"error_interno": str(e)} for _ in indices]
+            for i, resultado in zip(indices, resultados):
+                self._agregar_ubicaciones(resultado, expandir_grupo_especial(planes[i].get('filtros', {})))
+            return resultados
+
+        tareas = [(indices, EJECUTOR_ANALISIS.submit(lote, intencion, indices)) for intencion, indices in lotes.items()]
+        tareas += [([i], EJECUTOR_ANALISIS.submit(lambda args: [self._router_maestro(args)], args))
+                   for i, args in enumerate(planes) if i not in en_lote]
+
+        resultados = [None] * len(planes)
+        for indices, tarea in tareas:
+            for i, resultado in zip(indices, tarea.result()):
+                resultados[i] = resultado
+        return resultados
+
+    @staticmethod
+    def etiqueta_plan(args: dict) -> str:
+        filtros = {k: v for k, v in args.get('filtros', {}).items() if v not in (None, "", [], "ninguno")}
+        detalle = " · ".join(f"{v[0]}-{v[1]} años" if k == 'rango_edad' and len(v) == 2 else str(v)
+                             for k, v in filtros.items())
+        return f"{args.get('intencion')}" + (f" — {detalle}" if detalle else "")
+
+    def _mensajes_narrador(self, resultado: dict) -> list:
+        return [
+            {"role": "system", "content": NARRADOR_SISTEMA},
+            {"role": "user", "content": NARRADOR_INSTRUCCIONES.format(datos=json_compacto(compactar_resultado(resultado)))}
+        ]
+
+    def _huella_resultado(self, resultado: dict) -> str:
+        """Huella de lo que ve el narrador (resultado compacto, claves ordenadas) + versión del narrador."""
+        canonico = json.dumps(compactar_resultado(resultado), sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(f"{self._huella_narrador}:{canonico}".encode()).hexdigest()
+
+    def narrar(self, resultado: dict, regenerar: bool = False) -> Iterator[str]:
+        """Fragmentos de la narrativa del resultado, según los genera el LLM (stream=True).
+
+        Si ya se narró un resultado idéntico se entrega el texto cacheado de una vez
+        (salvo regenerar=True); el texto completo se guarda al terminar el stream.
+        """
+        clave, texto = self.narrativa_cacheada(resultado, regenerar)
+        if texto is not None:
+            yield texto
+            return
+
+        stream = self.client.chat.completions.create(**self.peticion_narrador(resultado))
+        partes = []
+        for evento in stream:
+            fragmento = self.fragmento(evento)
+            if fragmento:
+                partes.append(fragmento)
+                yield fragmento
+        if partes:
+            self.cache_narrativas.guardar(clave, "".join(partes))
+
+    def narrativa_cacheada(self, resultado: dict, regenerar: bool):
+        """(clave de la narrativa, texto cacheado o None)."""
+        clave = self._huella_resultado(resultado)
+        return clave, (None if regenerar else self.cache_narrativas.obtener(clave))
+
+    def peticion_narrador(self, resultado: dict) -> dict:
+        return dict(
+            model=self.MODELO_NARRADOR, 
+            messages=self._mensajes_narrador(resultado), 
+            temperature=self.TEMPERATURA_NARRADOR,
+            stream=True
+        )
+
+    @staticmethod
+    def fragmento(evento):
+        return evento.choices[0].delta.content if evento.choices else None
+
+    def estadisticas_cache(self) -> dict:
+        return {"interprete_local": self.interprete.estadisticas(),
+                "intenciones": self.cache_intenciones.estadisticas(), "narrativas": self.cache_narrativas.estadisticas(),
+                "filtros": self.motor.estadisticas_cache()}
+
+
+class AgenteAnaliticoLLM:
+    """Conversación de una sesión: solo su historial; el resto lo comparte el NucleoAnalitico.
+
+    AgenteAnaliticoLLM(nucleo=nucleo) es lo barato (una por usuario); con df y api_key
+    se construye además un núcleo propio, como antes.
+    """
+
+    def __init__(self, df_completo=None, api_key=None, motor: AnalizadorProgramasSociales = None,
+                 cache_intenciones: CachePersistente = None, cache_narrativas: CachePersistente = None,
+                 nucleo: NucleoAnalitico = None):
+        self.nucleo = nucleo if nucleo is not None else NucleoAnalitico(
+            df_completo, api_key, motor=motor, cache_intenciones=cache_intenciones, cache_narrativas=cache_narrativas)
+        self.messages = self._mensajes_iniciales()
+
+    @property
+    def motor(self) -> AnalizadorProgramasSociales:
+        return self.nucleo.motor
+
+    def _mensajes_iniciales(self) -> list:
+        return [{"role": "system", "content": self.nucleo.system_prompt}]
+
+    def estadisticas_cache(self) -> dict:
+        return self.nucleo.estadisticas_cache()
+
+    def procesar(self, consulta: str, regenerar_narrativa: bool = False) -> str:
+        """Respuesta completa (tabla + narrativa) como un solo texto."""
+        return "".join(self.procesar_stream(consulta, regenerar_narrativa))
+
+    def procesar_stream(self, consulta: str, regenerar_narrativa: bool = False) -> Iterator[str]:
+            """Genera la respuesta por partes: la tabla en cuanto corre el motor y luego la narrativa token a token."""
+            contexto_nuevo = self._nuevo_turno(consulta)
             
             try:
-                # FASE 1: OBTENER INTENCIÓN (LLM)
-                resp = self.client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=self.messages,
-                    tools=self._definir_master_tool(),
-                    tool_choice="auto", 
-                    temperature=0.0 
-                )
-                msg = resp.choices[0].message
-                args = self._normalizar_salida_llm(msg)
-
-                if args:
-                    # FASE 2: EJECUCIÓN PYTHON
-                    resultado = self._router_maestro(args)
-                    
-                    # Guardar historial técnico
-                    self.messages.append(msg)
-                    self.messages.append({
-                        "role": "tool",
-                        "tool_call_id": msg.tool_calls[0].id if msg.tool_calls else "call_fallback",
-                        "name": "ejecutar_analisis",
-                        "content": json.dumps(resultado, default=str)
-                    })
-                    
-                    # FASE 3: EXTRACCIÓN HÍBRIDA
-                    tabla_visual = resultado.get('tabla_visual', None)
-                    
-                    # FASE 4: EL ANALISTA ESTRATÉGICO (Creatividad Activada 🧠)
-                    mensajes_narrador = [
-                        {"role": "system", "content": 
-                        "Eres un Estratega Senior de Política Social, tu tarea es interpretar datos numéricos de manera profunda y estratégica para guiar decisiones de política pública en la Alcaldía Álvaro Obregón, enfocándote en vulnerabilidad social, brechas de género y edad, y patrones atípicos. Además, eres capaz de proponer estrategias breves y efectivas de comunicación digital para llegar a la población objetivo vía SMS y correo electrónico. Tu análisis debe ser empático, profesional y orientado a decisiones prácticas."
-                        },
-                        {"role": "user", "content": f"""
-                        Analiza los siguientes datos JSON resultantes de una consulta sobre los datos del CENSO del Bienestar de la Alcaldía Álvaro Obregón:
-                        {json.dumps(resultado, default=str)}
+                # FASE 1: OBTENER INTENCIÓN (intérprete local, caché de intenciones o LLM); puede ser un plan de varias
+                msg, llamadas = self.nucleo.interpretar(self.messages, contexto_nuevo)
 
-                        INSTRUCCIONES DE ANÁLISIS:
-                        1. IGNORA el campo 'tabla_visual' (yo ya lo mostraré aparte).
-                        2. Realiza una interpretación PROFUNDA y NARRATIVA de los datos numéricos.
-                        3. Busca activamente:
-                        - Brechas de género (¿Las mujeres están más afectadas?).
-                        - Vulnerabilidad por edad (¿Niños o ancianos en riesgo?).
-                        - Patrones atípicos o alarmantes.
-                        4. Usa un tono profesional, empático y orientado a la toma de decisiones.
-                        5. NO repitas los números fila por fila (eso aburre), explica QUÉ SIGNIFICAN esos números para la política social.
-                        6. Estructura tu respuesta con subtítulos claros (Markdown).
-                        """}
-                    ]
-                    
-                    final = self.client.chat.completions.create(
-                        model="deepseek-chat", 
-                        messages=mensajes_narrador, 
-                        temperature=0.4 # Subimos temperatura para recuperar creatividad y elocuencia
-                    )
+                if llamadas:
+                    llamadas, aviso = self._acotar_plan(llamadas)
+                    if aviso:
+                        yield aviso
+
+                    # FASE 2: EJECUCIÓN PYTHON (en paralelo si hay varios análisis)
+                    planes = [args for _, args in llamadas]
+                    resultados = self.nucleo.ejecutar_plan(planes)
+                    self._registrar_turno(llamadas, resultados)
                     
-                    texto_analisis = final.choices[0].message.content
+                    # FASE 3: EXTRACCIÓN HÍBRIDA
+                    # Las tablas van primero (Dato duro), sin esperar a la narrativa
+                    yield from self._tablas(planes, resultados)
                     
-                    # FASE 5: ENSAMBLAJE FINAL
-                    # La tabla va primero (Dato duro) + Análisis profundo después (Interpretación)
-                    if tabla_visual:
-                        return f"{tabla_visual}\n\n{texto_analisis}"
-                    else:
-                        return texto_analisis
+                    # FASE 4: EL ANALISTA ESTRATÉGICO (Creatividad Activada 🧠), una sola narrativa para todo el plan
+                    yield from self.nucleo.narrar(self._datos_narrador(planes, resultados), regenerar=regenerar_narrativa)
+                    return
 
-                return msg.content
+                if msg.content:
+                    yield msg.content
 
             except Exception as e:
-                return f"❌ Error técnico: {e}"
\ No newline at end of file
+                yield f"❌ Error técnico: {e}"
+
+    # --------------------------------------------------
+    # Pasos de un turno (compartidos con AgenteAnaliticoAsync)
+    # --------------------------------------------------
+
+    def _nuevo_turno(self, consulta: str) -> bool:
+        """Agrega la pregunta al historial; True si la conversación empieza de cero."""
+        self.messages.append({"role": "user", "content": consulta})
+        contexto_nuevo = len(self.messages) == 2
+        self._acotar_historial()
+        return contexto_nuevo
+
+    def _acotar_historial(self):
+        """Resume los turnos más antiguos hasta que el historial quepa en PRESUPUESTO_TOKENS_HISTORIAL.
+
+        Cada turno recortado (pregunta, llamadas y resultados) queda como una línea en
+        un mensaje de sistema tras el prompt, así el LLM conserva a qué se refería la
+        conversación sin pagar sus resultados. La pregunta actual nunca se recorta.
+        """
+        costos = [TOKENS.mensaje(m) for m in self.messages]
+        costos[0] = 0  # el prompt de sistema se envía siempre; no cuenta contra el presupuesto
+        preguntas = [i for i, m in enumerate(self.messages) if m["role"] == "user"]
+        exceso = sum(costos) - PRESUPUESTO_TOKENS_HISTORIAL
+        recortados = 0
+        while exceso > 0 and recortados < len(preguntas) - 1:
+            inicio, fin = preguntas[recortados], preguntas[recortados + 1]
+            exceso -= sum(costos[inicio:fin])
+            recortados += 1
+        if not recortados:
+            return
+
+        lineas = []
+        inicio = 1
+        if self._es_resumen(self.messages[1]):
+            lineas = self.messages[1]["content"].splitlines()[1:]
+            inicio = 2
+        for a, b in zip(preguntas[:recortados], preguntas[1:recortados + 1]):
+            lineas.append(resumen_turno(self.messages[a]["content"], self._llamadas_registradas(self.messages[a + 1:b])))
+        resumen = {"role": "system", "content": "\n".join([RESUMEN_HISTORIAL] + lineas[-MAX_TURNOS_RESUMIDOS:])}
+        self.messages = [self.messages[0], resumen] + self.messages[preguntas[recortados]:]
+
+    @staticmethod
+    def _es_resumen(mensaje: dict) -> bool:
+        return mensaje["role"] == "system" and mensaje["content"].startswith(RESUMEN_HISTORIAL)
+
+    @staticmethod
+    def _llamadas_registradas(mensajes: list) -> List[Tuple[str, dict]]:
+        return [(c["id"], json.loads(c["function"]["arguments"]))
+                for m in mensajes if m["role"] == "assistant" for c in m.get("tool_calls") or []]
+
+    def _acotar_plan(self, llamadas: List[Tuple[str, dict]]):
+        """(llamadas, aviso o None) con a lo sumo MAX_ANALISIS_POR_CONSULTA análisis."""
+        if len(llamadas) <= MAX_ANALISIS_POR_CONSULTA:
+            return llamadas, None
+        aviso = f"⚠️ La pregunta pide {len(llamadas)} análisis; se ejecutan los primeros {MAX_ANALISIS_POR_CONSULTA}.\n\n"
+        return llamadas[:MAX_ANALISIS_POR_CONSULTA], aviso
+
+    def _registrar_turno(self, llamadas: List[Tuple[str, dict]], resultados: List[dict]):
+        # Guardar historial técnico: el mensaje se reconstruye con las llamadas que sí se ejecutaron
+        # (cada una debe tener su respuesta) y los resultados van compactos
+        self.messages.append(self.nucleo.mensaje_asistente(llamadas))
+        for (id_llamada, _), resultado in zip(llamadas, resultados):
+            self.messages.append({
+                "role": "tool",
+                "tool_call_id": id_llamada,
+                "name": "ejecutar_analisis",
+                "content": json_compacto(compactar_resultado(resultado))
+            })
+
+    def _tablas(self, planes: List[dict], resultados: List[dict]) -> Iterator[str]:
+        for i, (args, resultado) in enumerate(zip(planes, resultados), 1):
+            tabla_visual = resultado.get('tabla_visual', None)
+            if tabla_visual:
+                titulo = f"**{i}. {self.nucleo.etiqueta_plan(args)}**\n\n" if len(planes) > 1 else ""
+                yield f"{titulo}{tabla_visual}\n\n"
+
+    @staticmethod
+    def _datos_narrador(planes: List[dict], resultados: List[dict]) -> dict:
+        if len(planes) == 1:
+            return resultados[0]
+        return {"comparacion": [{"intencion": args.get('intencion'), "filtros": args.get('filtros', {}),
+                                 "resultado": resultado} for args, resultado in zip(planes, resultados)]}
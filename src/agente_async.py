@@ -0,0 +1,272 @@
+import time
+import asyncio
+import threading
+import contextlib
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Dict, Iterator
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from .agent import NucleoAnalitico, AgenteAnaliticoLLM
+from .config import (LLM_BASE_URL, LLM_CONCURRENCIA_MAX, LLM_COLA_MAX_POR_USUARIO, LLM_ESPERA_MAX_S,
+                     LLM_TIMEOUT_CONEXION_S, LLM_TIMEOUT_S)
+
+
+class ColaSaturada(Exception):
+    """La pregunta no consiguió turno para el LLM (demasiadas en espera o se agotó la espera)."""
+
+
+class ColaJusta:
+    """Limita las llamadas simultáneas al LLM y reparte los turnos libres entre usuarios por rondas.
+
+    Cada usuario tiene su propia fila; al liberarse un turno lo recibe la primera
+    pregunta del siguiente usuario en la ronda, así quien manda muchas preguntas no
+    deja esperando a los demás. Las filas se acotan por usuario (contrapresión) y la
+    espera por LLM_ESPERA_MAX_S. Vive en un solo bucle de asyncio: no usa locks.
+    """
+
+    def __init__(self, capacidad: int = LLM_CONCURRENCIA_MAX, max_por_usuario: int = LLM_COLA_MAX_POR_USUARIO,
+                 espera_max: float = LLM_ESPERA_MAX_S):
+        self.capacidad = capacidad
+        self.max_por_usuario = max_por_usuario
+        self.espera_max = espera_max
+        self._activas = 0
+        self._filas: "OrderedDict[str, deque]" = OrderedDict()  # usuario → turnos pedidos (orden = ronda)
+        self._en_espera = 0
+        self._esperas = deque(maxlen=2000)  # segundos esperados por las últimas preguntas
+        self.atendidas = 0
+        self.rechazadas = 0
+        self.expiradas = 0
+        self.max_en_espera = 0
+
+    @contextlib.asynccontextmanager
+    async def turno(self, usuario: str):
+        """async with cola.turno(usuario): ... — la llamada al LLM ocupa un turno mientras dura."""
+        await self._entrar(usuario)
+        try:
+            yield
+        finally:
+            self._salir()
+
+    async def _entrar(self, usuario: str):
+        inicio = time.monotonic()
+        if self._activas < self.capacidad and not self._filas:
+            self._activas += 1
+            self._registrar(inicio)
+            return
+
+        fila = self._filas.get(usuario)
+        if fila is not None and len(fila) >= self.max_por_usuario:
+            self.rechazadas += 1
+            raise ColaSaturada(f"Ya tienes {len(fila)} preguntas en espera; intenta cuando terminen.")
+
+        turno = asyncio.get_running_loop().create_future()
+        self._filas.setdefault(usuario, deque()).append(turno)
+        self._en_espera += 1
+        self.max_en_espera = max(self.max_en_espera, self._en_espera)
+        try:
+            await asyncio.wait_for(asyncio.shield(turno), self.espera_max)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if turno.done() and not turno.cancelled():
+                self._salir()  # el turno llegó justo al cancelar: se pasa al siguiente
+            else:
+                turno.cancel()
+                self._retirar(usuario, turno)
+            if isinstance(e, asyncio.TimeoutError):
+                self.expiradas += 1
+                raise ColaSaturada(f"El servicio está saturado ({self.espera_max:g} s sin turno); "
+                                   "intenta de nuevo en un momento.") from None
+            raise
+        self._registrar(inicio)
+
+    def _retirar(self, usuario: str, turno: asyncio.Future):
+        fila = self._filas.get(usuario)
+        if fila is not None and turno in fila:
+            fila.remove(turno)
+            self._en_espera -= 1
+            if not fila:
+                del self._filas[usuario]
+
+    def _salir(self):
+        # El turno pasa directo a la siguiente pregunta de la ronda (las activas no cambian)
+        while self._filas:
+            usuario, fila = next(iter(self._filas.items()))
+            turno = fila.popleft()
+            self._en_espera -= 1
+            del self._filas[usuario]
+            if fila:
+                self._filas[usuario] = fila  # al final de la ronda
+            if not turno.done():
+                turno.set_result(None)
+                return
+        self._activas -= 1
+
+    def _registrar(self, inicio: float):
+        self.atendidas += 1
+        self._esperas.append(time.monotonic() - inicio)
+
+    def metricas(self) -> Dict:
+        esperas = sorted(self._esperas)
+        percentil = lambda p: round(esperas[min(len(esperas) - 1, int(p * len(esperas)))], 3) if esperas else 0
+        return {
+            "capacidad": self.capacidad,
+            "activas": self._activas,
+            "en_espera": self._en_espera,
+            "usuarios_en_espera": len(self._filas),
+            "max_en_espera": self.max_en_espera,
+            "atendidas": self.atendidas,
+            "rechazadas": self.rechazadas,
+            "expiradas": self.expiradas,
+            "espera_p50_s": percentil(0.5),
+            "espera_p95_s": percentil(0.95)
+        }
+
+
+class BucleAsync:
+    """Bucle de asyncio en un hilo propio, compartido por las sesiones de Streamlit.
+
+    El script de Streamlit es síncrono: iterar() le entrega los fragmentos de un
+    generador asíncrono que corre en este bucle, junto con los de las demás sesiones.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _bucle(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="bucle-llm", daemon=True).start()
+            return self._loop
+
+    def ejecutar(self, corutina):
+        return asyncio.run_coroutine_threadsafe(corutina, self._bucle()).result()
+
+    def iterar(self, flujo: AsyncIterator[str]) -> Iterator[str]:
+        try:
+            while True:
+                try:
+                    yield self.ejecutar(flujo.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            # Si la sesión deja de leer (rerun, pestaña cerrada) se libera el turno del LLM
+            self.ejecutar(flujo.aclose())
+
+
+BUCLE_LLM = BucleAsync()
+
+
+class NucleoAnaliticoAsync(NucleoAnalitico):
+    """NucleoAnalitico con cliente AsyncOpenAI (un pool httpx para todo el proceso) y cola justa.
+
+    Las llamadas al LLM pasan por la cola; el motor, SQLite y el intérprete local
+    corren en hilos para no detener el bucle.
+    """
+
+    def __init__(self, df_completo, api_key, cola: ColaJusta = None, **kwargs):
+        super().__init__(df_completo, api_key, **kwargs)
+        self.cola = cola if cola is not None else ColaJusta()
+        self.client_async = AsyncOpenAI(
+            api_key=api_key, base_url=LLM_BASE_URL, max_retries=1,
+            timeout=httpx.Timeout(LLM_TIMEOUT_S, connect=LLM_TIMEOUT_CONEXION_S),
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=self.cola.capacidad, max_keepalive_connections=self.cola.capacidad))
+        )
+
+    @staticmethod
+    async def _con_plazo(espera, limite: float):
+        """Espera sin pasar del instante limite (reloj del bucle); asyncio.TimeoutError si se agota.
+
+        httpx solo acota cada lectura: el plazo de toda la llamada se lleva aquí.
+        """
+        return await asyncio.wait_for(espera, max(0.0, limite - asyncio.get_running_loop().time()))
+
+    async def interpretar_async(self, messages: list, contexto_nuevo: bool, usuario: str):
+        consulta = messages[-1]["content"]
+        previo = await asyncio.to_thread(self.interpretar_sin_llm, consulta, contexto_nuevo)
+        if previo is not None:
+            return previo
+        async with self.cola.turno(usuario):
+            limite = asyncio.get_running_loop().time() + LLM_TIMEOUT_S
+            resp = await self._con_plazo(self.client_async.chat.completions.create(**self.peticion_parser(messages)),
+                                         limite)
+        self.calibrar_tokens(messages, resp)
+        msg = resp.choices[0].message
+        return msg, await asyncio.to_thread(self.resolver_parser, consulta, contexto_nuevo, msg)
+
+    async def narrar_async(self, resultado: dict, regenerar: bool, usuario: str) -> AsyncIterator[str]:
+        clave, texto = await asyncio.to_thread(self.narrativa_cacheada, resultado, regenerar)
+        if texto is not None:
+            yield texto
+            return
+
+        partes = []
+        async with self.cola.turno(usuario):
+            # El turno de la cola se libera a más tardar a los LLM_TIMEOUT_S, aunque el stream siga llegando
+            limite = asyncio.get_running_loop().time() + LLM_TIMEOUT_S
+            stream = await self._con_plazo(self.client_async.chat.completions.create(
+                **self.peticion_narrador(resultado)), limite)
+            try:
+                while True:
+                    try:
+                        evento = await self._con_plazo(stream.__anext__(), limite)
+                    except StopAsyncIteration:
+                        break
+                    fragmento = self.fragmento(evento)
+                    if fragmento:
+                        partes.append(fragmento)
+                        yield fragmento
+            finally:
+                await stream.close()
+        if partes:
+            await asyncio.to_thread(self.cache_narrativas.guardar, clave, "".join(partes))
+
+    def estadisticas_cache(self) -> dict:
+        return dict(super().estadisticas_cache(), cola_llm=self.cola.metricas())
+
+
+class AgenteAnaliticoAsync(AgenteAnaliticoLLM):
+    """Conversación de una sesión sobre un NucleoAnaliticoAsync; usuario identifica su fila en la cola."""
+
+    def __init__(self, nucleo: NucleoAnaliticoAsync, usuario: str = "anonimo"):
+        super().__init__(nucleo=nucleo)
+        self.usuario = usuario
+
+    def procesar_stream(self, consulta: str, regenerar_narrativa: bool = False) -> Iterator[str]:
+        """Versión síncrona (Streamlit): los fragmentos se generan en el bucle compartido."""
+        return BUCLE_LLM.iterar(self.procesar_stream_async(consulta, regenerar_narrativa))
+
+    async def procesar_async(self, consulta: str, regenerar_narrativa: bool = False) -> str:
+        return "".join([f async for f in self.procesar_stream_async(consulta, regenerar_narrativa)])
+
+    async def procesar_stream_async(self, consulta: str, regenerar_narrativa: bool = False) -> AsyncIterator[str]:
+        """Mismos pasos que procesar_stream, sin bloquear: el LLM espera su turno en la cola del núcleo."""
+        contexto_nuevo = self._nuevo_turno(consulta)
+        try:
+            msg, llamadas = await self.nucleo.interpretar_async(self.messages, contexto_nuevo, self.usuario)
+
+            if llamadas:
+                llamadas, aviso = self._acotar_plan(llamadas)
+                if aviso:
+                    yield aviso
+                planes = [args for _, args in llamadas]
+                resultados = await asyncio.to_thread(self.nucleo.ejecutar_plan, planes)
+                self._registrar_turno(llamadas, resultados)
+                for tabla in self._tablas(planes, resultados):
+                    yield tabla
+                async for fragmento in self.nucleo.narrar_async(self._datos_narrador(planes, resultados),
+                                                                regenerar_narrativa, self.usuario):
+                    yield fragmento
+                return
+
+            if msg.content:
+                yield msg.content
+
+        except ColaSaturada as e:
+            yield f"⏳ {e}"
+        except (openai.APITimeoutError, asyncio.TimeoutError):
+            yield f"⏳ El modelo no respondió en {LLM_TIMEOUT_S:g} s; intenta de nuevo."
+        except Exception as e:
+            yield f"❌ Error técnico: {e}"
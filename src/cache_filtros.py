@@ -0,0 +1,90 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+
+class CacheFiltros:
+    """Caché LRU de selecciones (máscaras/bitmaps) por filtro canónico, acotada por bytes.
+
+    Es thread-safe y se comparte entre sesiones. Las entradas se guardan en la forma
+    más compacta (índices de fila si el filtro es selectivo, bitmap empaquetado si no)
+    y se devuelven como arreglos de solo lectura.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entradas: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    # --------------------------------------------------
+
+    @staticmethod
+    def _comprimir(valor: np.ndarray, empaquetado: bool):
+        if empaquetado:
+            return ("bits", valor)
+        filas = np.flatnonzero(valor)
+        if filas.size * 4 < valor.size / 8 and valor.size < 2 ** 31:
+            return ("filas", filas.astype(np.int32), valor.size)
+        return ("mascara", np.packbits(valor), valor.size)
+
+    @staticmethod
+    def _descomprimir(entrada) -> np.ndarray:
+        if entrada[0] == "bits":
+            valor = entrada[1]
+        elif entrada[0] == "filas":
+            valor = np.zeros(entrada[2], dtype=bool)
+            valor[entrada[1]] = True
+        else:
+            valor = np.unpackbits(entrada[1], count=entrada[2]).view(bool)
+        valor.flags.writeable = False
+        return valor
+
+    # --------------------------------------------------
+
+    def obtener(self, clave: Hashable, calcular: Callable[[], np.ndarray], empaquetado: bool = False) -> np.ndarray:
+        """Devuelve la selección cacheada o la calcula (fuera del lock) y la guarda."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+            else:
+                self.fallos += 1
+        if entrada is not None:
+            return self._descomprimir(entrada)
+
+        valor = calcular()
+        entrada = self._comprimir(valor, empaquetado)
+        tamano = entrada[1].nbytes
+        if tamano <= self.max_bytes:
+            with self._lock:
+                if clave not in self._entradas:
+                    self._entradas[clave] = entrada
+                    self._bytes += tamano
+                while self._bytes > self.max_bytes:
+                    _, vieja = self._entradas.popitem(last=False)
+                    self._bytes -= vieja[1].nbytes
+                    self.desalojos += 1
+        return self._descomprimir(entrada)
+
+    def invalidar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / consultas * 100, 1) if consultas else 0,
+                "desalojos": self.desalojos,
+                "entradas": len(self._entradas),
+                "bytes": self._bytes
+            }
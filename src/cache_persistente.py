@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+
+class CachePersistente:
+    """Caché clave → JSON en SQLite, compartida entre sesiones, procesos y reinicios.
+
+    Cada entrada caduca a los ttl segundos y la tabla se acota a max_entradas
+    (se desalojan las usadas hace más tiempo). Varias cachés pueden vivir en el
+    mismo archivo, una tabla por cada una. La base se crea al primer uso.
+    """
+
+    def __init__(self, ruta: str, tabla: str, ttl: float, max_entradas: int):
+        if not tabla.isidentifier():
+            raise ValueError(f"Nombre de tabla inválido: {tabla}")
+        self.ruta = ruta
+        self.tabla = tabla
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._creada = False
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    def _conectar(self) -> sqlite3.Connection:
+        # Una conexión por operación: seguro entre hilos; WAL permite lectores concurrentes
+        if not self._creada:
+            with self._lock:
+                if not self._creada:
+                    os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+                    con = sqlite3.connect(self.ruta, timeout=10)
+                    try:
+                        con.execute("PRAGMA journal_mode=WAL")
+                        con.execute(f"""CREATE TABLE IF NOT EXISTS {self.tabla} (
+                            clave TEXT PRIMARY KEY, valor TEXT NOT NULL,
+                            creado REAL NOT NULL, usado REAL NOT NULL, usos INTEGER NOT NULL DEFAULT 0)""")
+                        con.execute(f"CREATE INDEX IF NOT EXISTS {self.tabla}_usado ON {self.tabla} (usado)")
+                        con.commit()
+                    finally:
+                        con.close()
+                    self._creada = True
+        return sqlite3.connect(self.ruta, timeout=10)
+
+    # --------------------------------------------------
+
+    def obtener(self, clave: str) -> Optional[Any]:
+        """Valor guardado (deserializado) o None si no existe o ya caducó."""
+        ahora = time.time()
+        try:
+            con = self._conectar()
+            try:
+                fila = con.execute(f"SELECT valor FROM {self.tabla} WHERE clave = ? AND creado > ?",
+                                   (clave, ahora - self.ttl)).fetchone()
+                if fila is not None:
+                    con.execute(f"UPDATE {self.tabla} SET usado = ?, usos = usos + 1 WHERE clave = ?", (ahora, clave))
+                    con.commit()
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ Caché {self.tabla} no disponible ({e}).")
+            fila = None
+
+        with self._lock:
+            if fila is None:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+        return json.loads(fila[0])
+
+    def guardar(self, clave: str, valor: Any):
+        ahora = time.time()
+        try:
+            con = self._conectar()
+            try:
+                con.execute(f"INSERT OR REPLACE INTO {self.tabla} (clave, valor, creado, usado, usos) VALUES (?, ?, ?, ?, 0)",
+                            (clave, json.dumps(valor, ensure_ascii=False, default=str), ahora, ahora))
+                # Cotas: primero lo caducado, luego lo menos usado recientemente
+                con.execute(f"DELETE FROM {self.tabla} WHERE creado <= ?", (ahora - self.ttl,))
+                sobrantes = con.execute(f"""DELETE FROM {self.tabla} WHERE clave IN (
+                    SELECT clave FROM {self.tabla} ORDER BY usado DESC LIMIT -1 OFFSET ?)""",
+                                        (self.max_entradas,)).rowcount
+                con.commit()
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ No se pudo guardar en la caché {self.tabla} ({e}).")
+            return
+        if sobrantes > 0:
+            with self._lock:
+                self.desalojos += sobrantes
+
+    def invalidar(self):
+        try:
+            con = self._conectar()
+            try:
+                con.execute(f"DELETE FROM {self.tabla}")
+                con.commit()
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ No se pudo vaciar la caché {self.tabla} ({e}).")
+
+    def estadisticas(self) -> Dict:
+        """Aciertos/fallos de este proceso + tamaño y reutilización de la tabla compartida."""
+        try:
+            con = self._conectar()
+            try:
+                entradas, usos = con.execute(f"SELECT count(*), coalesce(sum(usos), 0) FROM {self.tabla}").fetchone()
+            finally:
+                con.close()
+        except sqlite3.Error:
+            entradas, usos = 0, 0
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / consultas * 100, 1) if consultas else 0,
+                "desalojos": self.desalojos,
+                "entradas": entradas,
+                "reutilizaciones_totales": usos
+            }
@@ -51,4 +51,74 @@ CONSTANTES_MAPEO = {
         "carencia_educacion": "presencia_rezago_educativo_persona",
         "carencia_seguridad": "presencia_carencia_seguridad_social_persona"
     }
-}
\ No newline at end of file
+}
+
+# CACHÉ EN DISCO (snapshots del censo unificado)
+# Subir VERSION_SNAPSHOT cada vez que cambie la limpieza o el esquema del df unificado
+DIRECTORIO_CACHE = os.getenv("PAPE_CACHE_DIR", "datos/cache")
+VERSION_SNAPSHOT = 4
+
+# Censo compartido entre procesos: el df unificado se mapea en memoria (solo lectura)
+# desde columnas .npy en DIRECTORIO_CACHE en lugar de tener una copia por réplica
+CENSO_COMPARTIDO = os.getenv("PAPE_CENSO_COMPARTIDO", "0") == "1"
+
+# sha256 esperados de los assets del release (vacío = solo se verifica la integridad de la caché)
+CHECKSUMS_RELEASE = {}
+
+# ESQUEMA COMPACTO DEL DF UNIFICADO
+# Columnas de texto de baja cardinalidad que se guardan como category
+COLUMNAS_CATEGORICAS = ["colonia", "ageb", "sexo_persona", "parentesco_persona", "recibe_apoyos_sociales"]
+# Banderas 'yes'/'no' (elegibilidad y carencias) que se guardan como bool
+COLUMNAS_BANDERA = list(CONSTANTES_MAPEO["PROGRAMAS"].values()) + list(CONSTANTES_MAPEO["CARENCIAS"].values())
+
+# ESQUEMA DE INGESTA: únicas columnas que se leen de los CSV y su tipo al parsear
+# ("category" = texto repetido, se lee ya codificado; None = tipo inferido)
+ESQUEMA_INGESTA = {
+    "id_hogar": None,
+    "id_persona": None,
+    "edad_persona": "float64",
+    **{col: "category" for col in COLUMNAS_CATEGORICAS},
+    **{col: "category" for col in COLUMNAS_BANDERA}
+}
+
+# CENSO PARTICIONADO (Parquet por alcaldía/colonia, modo="particionado" del motor)
+ALCALDIA = "Álvaro Obregón"
+DIRECTORIO_PARTICIONES = os.getenv("PAPE_PARTICIONES_DIR", "datos/particiones")
+
+# Presupuesto (MB) de la caché compartida de filtros del motor analítico
+CACHE_FILTROS_MAX_MB = int(os.getenv("PAPE_CACHE_FILTROS_MB", "64"))
+
+# CACHÉ PERSISTENTE DEL AGENTE (SQLite en DIRECTORIO_CACHE, compartida entre sesiones y procesos)
+RUTA_CACHE_LLM = os.path.join(DIRECTORIO_CACHE, "llm.sqlite")
+# Intenciones ya interpretadas por el LLM: pregunta normalizada → {intencion, filtros}
+CACHE_INTENCIONES_TTL_H = float(os.getenv("PAPE_CACHE_INTENCIONES_TTL_H", "168"))
+CACHE_INTENCIONES_MAX = int(os.getenv("PAPE_CACHE_INTENCIONES_MAX", "5000"))
+# Narrativas por huella del resultado + versión del prompt del narrador
+CACHE_NARRATIVAS_TTL_H = float(os.getenv("PAPE_CACHE_NARRATIVAS_TTL_H", "720"))
+CACHE_NARRATIVAS_MAX = int(os.getenv("PAPE_CACHE_NARRATIVAS_MAX", "2000"))
+
+# Intérprete local de preguntas: confianza mínima para no llamar al LLM (>1 lo desactiva)
+UMBRAL_INTERPRETE_LOCAL = float(os.getenv("PAPE_UMBRAL_INTERPRETE", "0.85"))
+
+# Preguntas comparativas: análisis por pregunta (uno por llamada del LLM) e hilos que los ejecutan
+MAX_ANALISIS_POR_CONSULTA = int(os.getenv("PAPE_MAX_ANALISIS", "8"))
+HILOS_ANALISIS = int(os.getenv("PAPE_HILOS_ANALISIS", "4"))
+
+# CLIENTE DEL LLM (DeepSeek, API compatible con OpenAI)
+LLM_BASE_URL = os.getenv("PAPE_LLM_BASE_URL", "https://api.deepseek.com/v1")
+# Pipeline asíncrono (AgenteAnaliticoAsync): llamadas simultáneas al LLM en todo el proceso,
+# preguntas en espera por usuario y segundos máximos de espera por un turno
+LLM_CONCURRENCIA_MAX = int(os.getenv("PAPE_LLM_CONCURRENCIA", "8"))
+LLM_COLA_MAX_POR_USUARIO = int(os.getenv("PAPE_LLM_COLA_POR_USUARIO", "3"))
+LLM_ESPERA_MAX_S = float(os.getenv("PAPE_LLM_ESPERA_MAX_S", "30"))
+# Timeouts del LLM: conexión y, en httpx, cada lectura (un stream que sigue enviando fragmentos no
+# lo agota). El pipeline asíncrono además acota la llamada completa, stream incluido, a LLM_TIMEOUT_S
+LLM_TIMEOUT_CONEXION_S = float(os.getenv("PAPE_LLM_TIMEOUT_CONEXION_S", "5"))
+LLM_TIMEOUT_S = float(os.getenv("PAPE_LLM_TIMEOUT_S", "60"))
+
+# Contexto enviado al LLM: tokens (estimados) del historial del parser antes de resumir los turnos
+# más antiguos, turnos resumidos que se conservan y tamaño de las tablas/listas en los resultados
+PRESUPUESTO_TOKENS_HISTORIAL = int(os.getenv("PAPE_TOKENS_HISTORIAL", "3000"))
+MAX_TURNOS_RESUMIDOS = int(os.getenv("PAPE_TURNOS_RESUMIDOS", "8"))
+MAX_FILAS_CRUCE_LLM = int(os.getenv("PAPE_FILAS_CRUCE_LLM", "12"))
+MAX_ZONAS_LLM = int(os.getenv("PAPE_ZONAS_LLM", "5"))
@@ -0,0 +1,112 @@
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+
+# Filtro traducido a SQL: (cláusula WHERE, parámetros)
+Seleccion = Tuple[str, tuple]
+
+SIN_APOYO_SQL = "(recibe_apoyos_sociales = 'No tiene' OR recibe_apoyos_sociales IS NULL)"
+
+
+def _columna(nombre: str) -> str:
+    return '"' + nombre.replace('"', '""') + '"'
+
+
+class ConsultasDuckDB:
+    """Backend SQL: el censo unificado registrado en una base DuckDB embebida.
+
+    Cada filtro se traduce a una cláusula WHERE parametrizada y DuckDB ejecuta
+    las agregaciones vectorizadas y en paralelo. La base se comparte y cada
+    consulta usa su propio cursor.
+    """
+
+    TABLA = "censo"
+
+    def __init__(self, df: pd.DataFrame, carencias: List[str]):
+        import duckdb  # dependencia opcional: solo se necesita con modo="duckdb"
+
+        self.carencias = list(carencias)
+        self._con = duckdb.connect(database=":memory:")
+        # Se carga una vez al almacenamiento columnar (comprimido) de DuckDB: las
+        # consultas no vuelven a convertir el df y cualquier cursor ve la tabla
+        self._con.register("censo_df", df)
+        self._con.execute(f"CREATE TABLE {self.TABLA} AS SELECT * FROM censo_df")
+        self._con.unregister("censo_df")
+        self._lock = threading.Lock()
+        self.intensidad_sql = "(" + " + ".join(f"CAST({_columna(c)} AS INTEGER)" for c in self.carencias) + ")"
+
+    def _consultar(self, sql: str, params: tuple, lector):
+        """Ejecuta en un cursor propio (seguro entre hilos) y aplica el lector al resultado."""
+        with self._lock:
+            cursor = self._con.cursor()
+        try:
+            return lector(cursor.execute(sql, list(params)))
+        finally:
+            cursor.close()
+
+    # --------------------------------------------------
+
+    @staticmethod
+    def seleccion(condiciones: List[str], params: list) -> Seleccion:
+        return (" AND ".join(condiciones) if condiciones else "TRUE", tuple(params))
+
+    @staticmethod
+    def en_valores(col: str, valores: List[str]) -> Tuple[str, list]:
+        if not valores:
+            return "FALSE", []
+        return f"{_columna(col)} IN ({', '.join('?' for _ in valores)})", list(valores)
+
+    def _predicado(self, clave) -> Tuple[str, list]:
+        """Bandera ('es_elegible_...'), 'sin_apoyo', (columna, valor) o ('intensidad', k) en SQL."""
+        if clave == 'sin_apoyo':
+            return SIN_APOYO_SQL, []
+        if isinstance(clave, tuple):
+            col, valor = clave
+            if col == 'intensidad':
+                return f"{self.intensidad_sql} = ?", [int(valor)]
+            return f"{_columna(col)} = ?", [valor]
+        return _columna(clave), []
+
+    def _donde(self, seleccion: Seleccion, *claves) -> Tuple[str, tuple]:
+        clausula, params = seleccion
+        params = list(params)
+        for clave in claves:
+            predicado, extra = self._predicado(clave)
+            clausula = f"{clausula} AND {predicado}"
+            params += extra
+        return clausula, tuple(params)
+
+    # --------------------------------------------------
+
+    def contar(self, seleccion: Seleccion, *claves) -> int:
+        donde, params = self._donde(seleccion, *claves)
+        return int(self._consultar(f"SELECT count(*) FROM {self.TABLA} WHERE {donde}", params, lambda r: r.fetchone())[0])
+
+    def promedio_edad(self, seleccion: Seleccion, *claves):
+        donde, params = self._donde(seleccion, *claves)
+        suma, n = self._consultar(f"SELECT sum(edad_persona), count(*) FROM {self.TABLA} WHERE {donde}", params,
+                                  lambda r: r.fetchone())
+        return np.float64(suma) / n if n else np.float64('nan')
+
+    def hogares_unicos(self, seleccion: Seleccion) -> int:
+        donde, params = seleccion
+        return int(self._consultar(f"SELECT count(DISTINCT id_hogar) FROM {self.TABLA} WHERE {donde}", params,
+                                   lambda r: r.fetchone())[0])
+
+    def distribucion(self, seleccion: Seleccion, col: str) -> Dict:
+        """{valor: personas} de una columna (solo valores observados, sin nulos)."""
+        donde, params = seleccion
+        return dict(self._consultar(
+            f"SELECT {_columna(col)}, count(*) FROM {self.TABLA} WHERE {donde} AND {_columna(col)} IS NOT NULL GROUP BY 1",
+            params, lambda r: r.fetchall()
+        ))
+
+    def celdas(self, seleccion: Seleccion, columnas: List[str]) -> pd.DataFrame:
+        """Combinaciones observadas de las columnas con su número de personas ('n')."""
+        donde, params = seleccion
+        lista = ", ".join(_columna(c) for c in columnas)
+        return self._consultar(
+            f"SELECT {lista}, count(*) AS n FROM {self.TABLA} WHERE {donde} GROUP BY {lista}",
+            params, lambda r: r.df()
+        )
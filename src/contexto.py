@@ -0,0 +1,137 @@
+import re
+import json
+import math
+import threading
+from typing import Dict, List
+from .config import MAX_FILAS_CRUCE_LLM, MAX_ZONAS_LLM
+
+TOTAL = "TOTAL"  # margins_name de las tablas cruzadas del motor
+_PIEZAS = re.compile(r"[^\W\d_]+|\d+|\S")
+
+
+class ContadorTokens:
+    """Estimación de tokens de mensajes del chat, sin el tokenizador del modelo.
+
+    Cuenta palabras (~4 letras por token), números (~3 dígitos por token) y
+    signos (1 token cada uno), y se recalibra con el usage.prompt_tokens que
+    devuelve la API para la misma petición.
+    """
+
+    POR_MENSAJE = 4  # rol y separadores del formato de chat
+
+    def __init__(self):
+        self.factor = 1.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bruto(texto: str) -> int:
+        n = 0
+        for pieza in _PIEZAS.findall(texto):
+            if pieza[0].isdigit():
+                n += math.ceil(len(pieza) / 3)
+            elif pieza[0].isalpha():
+                n += math.ceil(len(pieza) / 4)
+            else:
+                n += 1
+        return n
+
+    def texto(self, texto: str) -> int:
+        return round(self._bruto(texto) * self.factor)
+
+    def mensaje(self, mensaje) -> int:
+        if not isinstance(mensaje, dict):
+            mensaje = {"content": mensaje.content, "tool_calls": [c.function.arguments for c in mensaje.tool_calls or []]}
+        contenido = mensaje.get("content") or ""
+        llamadas = mensaje.get("tool_calls")
+        if llamadas:
+            contenido += json.dumps(llamadas, ensure_ascii=False, default=str)
+        return self.POR_MENSAJE + self.texto(contenido)
+
+    def mensajes(self, mensajes: list) -> int:
+        return sum(self.mensaje(m) for m in mensajes)
+
+    def calibrar(self, estimado: int, real: int):
+        """Ajusta el factor hacia real/estimado (promedio móvil: una respuesta rara no lo desvía)."""
+        if estimado > 0 and real and real > 0:
+            with self._lock:
+                self.factor = min(3.0, max(0.3, 0.8 * self.factor + 0.2 * self.factor * real / estimado))
+
+
+TOKENS = ContadorTokens()
+
+
+# --------------------------------------------------
+# Codificación compacta de resultados para el LLM
+# --------------------------------------------------
+
+def _redondear(valor):
+    if hasattr(valor, "item"):  # escalares de numpy/pandas → tipos de Python
+        valor = valor.item()
+    if isinstance(valor, float):
+        return round(valor, 1) if not valor.is_integer() else int(valor)
+    return valor
+
+
+def _compactar_cruce(datos: Dict, max_filas: int) -> Dict:
+    """{columna: {fila: n}} → filas con más casos + el resto sumado + totales, por filas."""
+    columnas = list(datos)
+    filas = list(dict.fromkeys(f for col in datos.values() for f in col))
+    valor = lambda f, c: _redondear(datos[c].get(f, 0))
+
+    total = [valor(TOTAL, c) for c in columnas] if TOTAL in filas else None
+    filas = [f for f in filas if f != TOTAL]
+    if TOTAL in columnas and len(filas) > max_filas:
+        filas = sorted(filas, key=lambda f: -valor(f, TOTAL))
+
+    compacto = {"columnas": [str(c) for c in columnas],
+                "filas": {str(f): [valor(f, c) for c in columnas] for f in filas[:max_filas]}}
+    resto = filas[max_filas:]
+    if resto:
+        compacto[f"otras_{len(resto)}_filas"] = [_redondear(sum(valor(f, c) for f in resto)) for c in columnas]
+    if total is not None:
+        compacto[TOTAL] = total
+    return compacto
+
+
+def _compactar_registros(registros: List[Dict]) -> Dict:
+    """[{col: v}, ...] → {"columnas": [...], "filas": [[...], ...]} (las claves no se repiten)."""
+    columnas = list(dict.fromkeys(k for r in registros for k in r))
+    return {"columnas": columnas, "filas": [[_redondear(r.get(c)) for c in columnas] for r in registros]}
+
+
+def compactar_resultado(resultado, max_filas: int = MAX_FILAS_CRUCE_LLM, max_zonas: int = MAX_ZONAS_LLM):
+    """Resultado del motor en la forma que se manda al LLM (historial y narrador).
+
+    Sin 'tabla_visual' (la tabla ya se mostró), números redondeados, tablas
+    cruzadas acotadas a sus filas principales + resto + totales, rankings por
+    columnas y listas de zonas coincidentes recortadas.
+    """
+    if isinstance(resultado, list):
+        return [compactar_resultado(r, max_filas, max_zonas) for r in resultado]
+    if not isinstance(resultado, dict):
+        return _redondear(resultado)
+
+    compacto = {}
+    for clave, valor in resultado.items():
+        if clave == "tabla_visual":
+            continue
+        if clave == "datos_json" and isinstance(valor, dict) and all(isinstance(v, dict) for v in valor.values()):
+            compacto[clave] = _compactar_cruce(valor, max_filas)
+        elif clave == "ranking" and isinstance(valor, list) and valor and all(isinstance(r, dict) for r in valor):
+            compacto[clave] = _compactar_registros(valor)
+        elif clave == "ubicaciones_coincidentes" and isinstance(valor, dict):
+            compacto[clave] = {k: (v[:max_zonas] + [f"… {len(v) - max_zonas} más"] if isinstance(v, list) and len(v) > max_zonas else v)
+                               for k, v in valor.items() if k != "termino"}
+        else:
+            compacto[clave] = compactar_resultado(valor, max_filas, max_zonas)
+    return compacto
+
+
+def json_compacto(datos) -> str:
+    return json.dumps(datos, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def resumen_turno(pregunta: str, llamadas: List) -> str:
+    """Una línea por turno recortado del historial: la pregunta y los análisis que pidió."""
+    analisis = "; ".join(f"{args.get('intencion')} {json_compacto(args.get('filtros', {}))}" for _, args in llamadas)
+    return f"- «{pregunta}» → {analisis or 'sin análisis'}"
@@ -1,11 +1,25 @@
 import pandas as pd
 import os
-import requests
-from io import StringIO
+import glob
+import csv
+import json
+import shutil
+import hashlib
+import threading
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from .config import (DIRECTORIO_CACHE, VERSION_SNAPSHOT, COLUMNAS_CATEGORICAS, COLUMNAS_BANDERA,
+                     CHECKSUMS_RELEASE, ESQUEMA_INGESTA, CENSO_COMPARTIDO, ALCALDIA, DIRECTORIO_PARTICIONES)
+from .descargas import GestorDescargas
+from .particiones import escribir_particiones
 
 class DataIntegrator:
 
-    def __init__(self):
+    def __init__(self, directorio_cache: str = DIRECTORIO_CACHE, conservar_tablas: bool = False,
+                 compartido: bool = CENSO_COMPARTIDO):
         # 📌 URL BASE donde están alojados los CSV en GitHub Releases
         self.URL_BASE = "https://github.com/Omartg04/PAPE-v3-agente/releases/download/v1.0/"
 
@@ -17,22 +31,297 @@ class DataIntegrator:
             "intervenciones": "IntervencionesPotencialesPAPEPersona.csv"
         }
 
+        # 📌 carpeta donde se guardan los snapshots Parquet del df unificado
+        self.directorio_cache = directorio_cache
+
+        # 📌 censo mapeado en memoria y compartido entre procesos (ver _compartir)
+        self.compartido = compartido
+
+        # 📌 descargas remotas: caché en disco compartida entre reinicios
+        self.descargas = GestorDescargas(os.path.join(directorio_cache, "descargas"), checksums=CHECKSUMS_RELEASE)
+
+        # 📌 estado de la última carga (para el refresco incremental)
+        self.origen = None
+        self.ruta_base = None
+        self.firmas: Dict[str, str] = {}
+        # Tablas fuente ya leídas: solo se retienen con conservar_tablas=True (cuestan memoria)
+        self.conservar_tablas = conservar_tablas
+        self._tablas: Dict[str, pd.DataFrame] = {}
+        self._lock_refresco = threading.Lock()
+
     # --------------------------------------------------
 
     def _leer_csv_url(self, url: str):
-        """Descargar CSV desde una URL y devolverlo como DataFrame."""
-        print(f"⬇️ Descargando desde: {url}")
-        resp = requests.get(url)
+        """Descargar CSV desde una URL (vía caché en disco) y devolverlo como DataFrame."""
+        return self._leer_csv(self.descargas.descargar(url))
+
+    @staticmethod
+    def _columnas_csv(ruta: str) -> List[str]:
+        """Columnas del encabezado del CSV que forman parte de ESQUEMA_INGESTA."""
+        with open(ruta, newline='', encoding='utf-8-sig') as f:
+            encabezado = next(csv.reader(f))
+        return [c for c in encabezado if c in ESQUEMA_INGESTA]
+
+    def _leer_csv(self, ruta: str) -> pd.DataFrame:
+        """Lee solo las columnas de ESQUEMA_INGESTA con el lector multihilo de pyarrow."""
+        columnas = self._columnas_csv(ruta)
+
+        tipos_arrow = {"float64": pa.float64(), "category": pa.dictionary(pa.int32(), pa.string())}
+        tipos = {c: tipos_arrow[ESQUEMA_INGESTA[c]] for c in columnas if ESQUEMA_INGESTA[c]}
+
+        try:
+            tabla = pacsv.read_csv(
+                ruta,
+                read_options=pacsv.ReadOptions(use_threads=True),
+                convert_options=pacsv.ConvertOptions(include_columns=columnas, column_types=tipos, strings_can_be_null=True)
+            )
+            return tabla.to_pandas()
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            # Valores que pyarrow no acepta con el tipo declarado → lector de pandas con las mismas columnas
+            print(f"⚠️ pyarrow no pudo leer {os.path.basename(ruta)} ({e}). Usando pandas.")
+            dtypes = {c: t for c, t in ESQUEMA_INGESTA.items() if t == "category" and c in columnas}
+            df = pd.read_csv(ruta, usecols=columnas, dtype=dtypes)
+            if 'edad_persona' in df.columns:
+                df['edad_persona'] = pd.to_numeric(df['edad_persona'], errors='coerce')
+            return df
+
+    def _leer_tablas(self, rutas: Dict[str, str]) -> Dict[str, pd.DataFrame]:
+        """Lee en paralelo los CSV indicados, reutilizando las tablas retenidas en memoria."""
+        pendientes = {clave: ruta for clave, ruta in rutas.items() if clave not in self._tablas}
+        tablas = {clave: self._tablas[clave] for clave in rutas if clave in self._tablas}
+
+        if pendientes:
+            with ThreadPoolExecutor(max_workers=len(pendientes)) as pool:
+                futuros = {clave: pool.submit(self._leer_csv, ruta) for clave, ruta in pendientes.items()}
+                tablas.update({clave: fut.result() for clave, fut in futuros.items()})
+
+        if self.conservar_tablas:
+            self._tablas.update(tablas)
+        return tablas
+
+    def _descargar_remotos(self) -> Dict[str, str]:
+        """Descarga en paralelo los cuatro assets del release y devuelve sus rutas locales."""
+        urls = {clave: self.URL_BASE + archivo for clave, archivo in self.FILES.items()}
+        return self.descargas.descargar_varios(urls)
+
+    # --------------------------------------------------
+
+    def _tipar_columnas(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Esquema compacto: banderas yes/no → bool, texto repetido → category, edad → uint8."""
+        df = df.copy()
+
+        for col in COLUMNAS_BANDERA:
+            if col in df.columns and df[col].dtype != bool:
+                df[col] = df[col].eq('yes')
+
+        # Categorías en orden alfabético (pyarrow las codifica por orden de aparición)
+        for col in COLUMNAS_CATEGORICAS:
+            if col in df.columns:
+                serie = df[col].astype('category')
+                df[col] = serie.cat.reorder_categories(sorted(serie.cat.categories))
+
+        # Tras la limpieza la edad queda en 0-120
+        df['edad_persona'] = df['edad_persona'].astype('uint8')
 
-        if resp.status_code != 200:
-            raise FileNotFoundError(f"❌ No se pudo descargar: {url} (status {resp.status_code})")
+        for col in ['id_hogar', 'id_persona']:
+            if pd.api.types.is_integer_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], downcast='integer')
 
-        return pd.read_csv(StringIO(resp.text))
+        return df
 
     # --------------------------------------------------
+    # SNAPSHOT PARQUET
+    # --------------------------------------------------
+
+    def _firmas_locales(self, ruta_base: str) -> Dict[str, str]:
+        """Firma de cada CSV local a partir de su tamaño y fecha de modificación."""
+        firmas = {}
+        for clave, archivo in self.FILES.items():
+            st = os.stat(os.path.join(ruta_base, archivo))
+            firmas[clave] = f"{st.st_size}|{st.st_mtime_ns}"
+        return firmas
+
+    def _firmas_remotas(self, rutas: Dict[str, str]) -> Dict[str, str]:
+        """Firma de cada asset descargado: su sha256 verificado."""
+        return {clave: self.descargas.metadatos.get(self.URL_BASE + self.FILES[clave], {}).get('sha256', '')
+                for clave in rutas}
+
+    def _huella(self, firmas: Dict[str, str]) -> str:
+        """Huella conjunta de las fuentes: identifica el snapshot."""
+        h = hashlib.sha256()
+        for clave in sorted(firmas):
+            h.update(f"{self.FILES[clave]}|{firmas[clave]}\n".encode())
+        return h.hexdigest()
+
+    def _ruta_snapshot(self, origen: str, huella: str):
+        return os.path.join(self.directorio_cache, f"df_full_v{VERSION_SNAPSHOT}_{origen}_{huella[:16]}.parquet")
+
+    def _cargar_snapshot(self, origen: str, huella: str = None):
+        """Lee el snapshot que corresponde a la huella (o el más reciente del origen si no hay huella)."""
+        if huella:
+            ruta = self._ruta_snapshot(origen, huella)
+            if not os.path.exists(ruta):
+                return None
+        else:
+            patron = os.path.join(self.directorio_cache, f"df_full_v{VERSION_SNAPSHOT}_{origen}_*.parquet")
+            candidatos = sorted(glob.glob(patron), key=os.path.getmtime)
+            if not candidatos:
+                return None
+            ruta = candidatos[-1]
+
+        if self.compartido:
+            df = self._mapear(self._ruta_mapa(ruta))
+            if df is not None:
+                return df
+
+        try:
+            df = pd.read_parquet(ruta)
+            print(f"⚡ Snapshot cargado: {ruta}")
+        except Exception as e:
+            print(f"⚠️ Snapshot ilegible ({e}). Se reconstruirá.")
+            return None
+        return self._compartir(df, ruta)
+
+    def _guardar_snapshot(self, df: pd.DataFrame, origen: str, huella: str):
+        """Escribe el snapshot de forma atómica y elimina los anteriores del mismo origen."""
+        try:
+            os.makedirs(self.directorio_cache, exist_ok=True)
+            ruta = self._ruta_snapshot(origen, huella)
+            ruta_tmp = f"{ruta}.{os.getpid()}.tmp"
+            df.to_parquet(ruta_tmp, engine="pyarrow", compression="zstd")
+            os.replace(ruta_tmp, ruta)
+
+            for viejo in glob.glob(os.path.join(self.directorio_cache, f"df_full_v*_{origen}_*.parquet")):
+                if viejo != ruta:
+                    os.remove(viejo)
+            # Los procesos que aún mapean un censo viejo lo conservan hasta cerrarlo
+            for viejo in glob.glob(os.path.join(self.directorio_cache, f"df_full_v*_{origen}_*.cols")):
+                if viejo != self._ruta_mapa(ruta):
+                    shutil.rmtree(viejo, ignore_errors=True)
+            print(f"💾 Snapshot guardado: {ruta}")
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el snapshot ({e}).")
+
+    # --------------------------------------------------
+    # CENSO COMPARTIDO (columnas .npy mapeadas en memoria)
+    # --------------------------------------------------
+
+    @staticmethod
+    def _ruta_mapa(ruta_snapshot: str) -> str:
+        return ruta_snapshot[:-len(".parquet")] + ".cols"
+
+    def _exportar_mapa(self, df: pd.DataFrame, ruta_mapa: str) -> bool:
+        """Escribe cada columna como .npy (categóricas: códigos + categorías en el manifiesto).
+
+        Se escribe en un directorio temporal y se publica con un rename atómico:
+        si otra réplica lo publicó primero, se descarta la copia propia.
+        """
+        if os.path.isdir(ruta_mapa):
+            return True
+        columnas = []
+        for i, col in enumerate(df.columns):
+            serie = df[col]
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                columnas.append({"nombre": col, "archivo": f"{i:03d}.npy", "categorias": serie.cat.categories.tolist()})
+            elif serie.dtype.kind in "biuf":
+                columnas.append({"nombre": col, "archivo": f"{i:03d}.npy"})
+            else:
+                print(f"⚠️ La columna {col} ({serie.dtype}) no se puede mapear; el censo no se compartirá.")
+                return False
+
+        tmp = f"{ruta_mapa}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(tmp, exist_ok=True)
+            for info in columnas:
+                serie = df[info["nombre"]]
+                valores = serie.cat.codes.to_numpy() if "categorias" in info else serie.to_numpy()
+                np.save(os.path.join(tmp, info["archivo"]), valores)
+            manifiesto = {"filas": len(df), "columnas": columnas}
+            if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+                np.save(os.path.join(tmp, "indice.npy"), df.index.to_numpy())
+                manifiesto["indice"] = "indice.npy"
+            with open(os.path.join(tmp, "manifiesto.json"), "w", encoding="utf-8") as f:
+                json.dump(manifiesto, f, ensure_ascii=False)
+            os.rename(tmp, ruta_mapa)
+            print(f"🧩 Censo compartido exportado: {ruta_mapa}")
+        except OSError:
+            if not os.path.isdir(ruta_mapa):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return True
 
-    def cargar_y_unir_datasets(self, ruta_base: str = None):
-        """Carga inteligente: primero local, luego remoto vía GitHub Releases."""
+    @staticmethod
+    def _mapear(ruta_mapa: str):
+        """df cuyas columnas apuntan (sin copiar, solo lectura) a los .npy mapeados."""
+        try:
+            with open(os.path.join(ruta_mapa, "manifiesto.json"), encoding="utf-8") as f:
+                manifiesto = json.load(f)
+            columnas = {}
+            for info in manifiesto["columnas"]:
+                # Vista ndarray (no np.memmap) sobre el mapeo: pandas la trata como cualquier arreglo
+                valores = np.asarray(np.load(os.path.join(ruta_mapa, info["archivo"]), mmap_mode="r"))
+                if "categorias" in info:
+                    valores = pd.Categorical.from_codes(valores, categories=info["categorias"], validate=False)
+                columnas[info["nombre"]] = valores
+            indice = None
+            if "indice" in manifiesto:
+                indice = np.asarray(np.load(os.path.join(ruta_mapa, manifiesto["indice"]), mmap_mode="r"))
+            df = pd.DataFrame(columnas, index=indice, copy=False)
+        except (OSError, ValueError, KeyError):
+            return None
+        print(f"⚡ Censo compartido mapeado: {ruta_mapa}")
+        return df
+
+    def _compartir(self, df: pd.DataFrame, ruta_snapshot: str) -> pd.DataFrame:
+        """En modo compartido devuelve la versión mapeada del df (la exporta si falta)."""
+        if not self.compartido:
+            return df
+        try:
+            ruta_mapa = self._ruta_mapa(ruta_snapshot)
+            if self._exportar_mapa(df, ruta_mapa):
+                mapeado = self._mapear(ruta_mapa)
+                if mapeado is not None:
+                    return mapeado
+        except Exception as e:
+            print(f"⚠️ No se pudo compartir el censo ({e}). Se usa la copia del proceso.")
+        return df
+
+    def exportar_particiones(self, df: pd.DataFrame, directorio: str = DIRECTORIO_PARTICIONES,
+                             alcaldia: str = ALCALDIA):
+        """Escribe el censo unificado como Parquet particionado (alcaldía/colonia) para el modo out-of-core."""
+        escribir_particiones(df, directorio, alcaldia)
+        print(f"🗂️ Censo particionado escrito en: {directorio} ({alcaldia})")
+
+    # --------------------------------------------------
+
+    def _unir_personas(self, df_per: pd.DataFrame, df_car: pd.DataFrame, df_int: pd.DataFrame) -> pd.DataFrame:
+        """Joins a nivel persona + limpieza de edad (no dependen de la tabla de hogares)."""
+        df = df_per.merge(df_car, on=['id_hogar', 'id_persona'], how='inner')
+        df = df.merge(df_int, on=['id_hogar', 'id_persona'], how='inner')
+
+        # Limpieza básica
+        return df[(df['edad_persona'] >= 0) & (df['edad_persona'] <= 120)]
+
+    def _unir_hogar(self, df_personas: pd.DataFrame, df_hog: pd.DataFrame) -> pd.DataFrame:
+        """Left join con las características del hogar + tipado compacto."""
+        df_full = df_personas.merge(df_hog, on='id_hogar', how='left')
+
+        # Tipado compacto (el df vive una vez por proceso y domina la memoria)
+        df_full = self._tipar_columnas(df_full)
+
+        # Personas de un mismo hogar contiguas: el motor reduce por hogar con desplazamientos (CSR)
+        return df_full.sort_values('id_hogar', kind='stable', ignore_index=True)
+
+    def _rutas_fuentes(self) -> Dict[str, str]:
+        if self.origen == "local":
+            return {clave: os.path.join(self.ruta_base, archivo) for clave, archivo in self.FILES.items()}
+        return self._descargar_remotos()
+
+    # --------------------------------------------------
+
+    def cargar_y_unir_datasets(self, ruta_base: str = None, usar_snapshot: bool = True):
+        """Carga inteligente: snapshot Parquet, luego CSV local, luego remoto vía GitHub Releases."""
 
         rutas_posibles = [
             "data/01_data/",
@@ -49,47 +338,117 @@ class DataIntegrator:
                     ruta_base = r
                     break
 
+        tablas = None
         if ruta_base:
             try:
                 print(f"📂 Cargando datos desde carpeta local: {ruta_base}")
+                firmas = self._firmas_locales(ruta_base)
+                self.origen, self.ruta_base, self.firmas = "local", ruta_base, firmas
+
+                # 0️⃣ Snapshot ya unificado (si las fuentes no cambiaron)
+                if usar_snapshot:
+                    df_snap = self._cargar_snapshot("local", self._huella(firmas))
+                    if df_snap is not None:
+                        return df_snap
 
-                df_hog = pd.read_csv(os.path.join(ruta_base, self.FILES["hogar"]))
-                df_per = pd.read_csv(os.path.join(ruta_base, self.FILES["persona"]))
-                df_car = pd.read_csv(os.path.join(ruta_base, self.FILES["carencias"]))
-                df_int = pd.read_csv(os.path.join(ruta_base, self.FILES["intervenciones"]))
+                tablas = self._leer_tablas(self._rutas_fuentes())
 
             except Exception as e:
                 print(f"⚠️ Error cargando localmente ({e}). Intentando remoto…")
-                ruta_base = None  # Forzar cambio a URL
+                tablas = None  # Forzar cambio a URL
 
         # -------------------------
-        # 2️⃣ Si falla local → cargar desde GitHub Releases
+        # 2️⃣ Si falla local → descargar desde GitHub Releases
         # -------------------------
-        if not ruta_base:
+        if tablas is None:
             print("🌐 Cargando datos desde GitHub Releases (modo nube)…")
+            self.origen, self.ruta_base = "remoto", None
 
             try:
-                df_hog = self._leer_csv_url(self.URL_BASE + self.FILES["hogar"])
-                df_per = self._leer_csv_url(self.URL_BASE + self.FILES["persona"])
-                df_car = self._leer_csv_url(self.URL_BASE + self.FILES["carencias"])
-                df_int = self._leer_csv_url(self.URL_BASE + self.FILES["intervenciones"])
+                rutas = self._descargar_remotos()
+                self.firmas = self._firmas_remotas(rutas)
 
             except Exception as e:
+                # Sin red ni copia descargada: se reutiliza el último snapshot disponible
+                df_snap = self._cargar_snapshot("remoto") if usar_snapshot else None
+                if df_snap is not None:
+                    print(f"⚠️ Descarga fallida ({e}). Usando el último snapshot.")
+                    return df_snap
                 raise FileNotFoundError(
                     f"❌ Falló la carga remota desde GitHub Releases.\n"
                     f"Verifica que los archivos existen en:\n{self.URL_BASE}\n\n"
                     f"Error original:\n{e}"
                 )
 
+            if usar_snapshot:
+                df_snap = self._cargar_snapshot("remoto", self._huella(self.firmas))
+                if df_snap is not None:
+                    return df_snap
+
+            tablas = self._leer_tablas(rutas)
+
         # -------------------------
         # 3️⃣ Unificación de datasets
         # -------------------------
-        df_full = df_per.merge(df_car, on=['id_hogar', 'id_persona'], how='inner')
-        df_full = df_full.merge(df_int, on=['id_hogar', 'id_persona'], how='inner')
-        df_full = df_full.merge(df_hog, on='id_hogar', how='left')
-
-        # Limpieza básica
-        df_full = df_full[(df_full['edad_persona'] >= 0) & (df_full['edad_persona'] <= 120)]
+        df_personas = self._unir_personas(tablas["persona"], tablas["carencias"], tablas["intervenciones"])
+        df_full = self._unir_hogar(df_personas, tablas["hogar"])
 
         print("✅ Datos cargados y unificados correctamente.")
+
+        # -------------------------
+        # 4️⃣ Persistir snapshot para los siguientes arranques
+        # -------------------------
+        if usar_snapshot:
+            huella = self._huella(self.firmas)
+            self._guardar_snapshot(df_full, self.origen, huella)
+            df_full = self._compartir(df_full, self._ruta_snapshot(self.origen, huella))
+
         return df_full
+
+    # --------------------------------------------------
+    # REFRESCO INCREMENTAL
+    # --------------------------------------------------
+
+    def refrescar(self, df_actual: pd.DataFrame, usar_snapshot: bool = True) -> Tuple[pd.DataFrame, List[str]]:
+        """Recarga solo las fuentes que cambiaron y rehace solo los joins afectados.
+
+        Devuelve (df_nuevo, fuentes_cambiadas). Si nada cambió regresa el mismo df.
+        """
+        with self._lock_refresco:
+            return self._refrescar(df_actual, usar_snapshot)
+
+    def _refrescar(self, df_actual: pd.DataFrame, usar_snapshot: bool) -> Tuple[pd.DataFrame, List[str]]:
+        if self.origen is None:
+            return self.cargar_y_unir_datasets(usar_snapshot=usar_snapshot), list(self.FILES)
+
+        rutas = self._rutas_fuentes()
+        firmas = self._firmas_locales(self.ruta_base) if self.origen == "local" else self._firmas_remotas(rutas)
+        cambiadas = [clave for clave in self.FILES if firmas.get(clave) != self.firmas.get(clave)]
+        if not cambiadas:
+            print("✔️ Sin cambios en las fuentes.")
+            return df_actual, []
+
+        print(f"🔄 Fuentes modificadas: {', '.join(cambiadas)}")
+        for clave in cambiadas:
+            self._tablas.pop(clave, None)
+
+        if cambiadas == ["hogar"]:
+            # Solo cambia el lado del hogar: se conserva el lado persona ya unido y limpio
+            claves_persona = ("persona", "carencias", "intervenciones")
+            cols_persona = {c for clave in claves_persona for c in self._columnas_csv(rutas[clave])}
+            df_personas = df_actual[[c for c in df_actual.columns if c in cols_persona]]
+            df_hog = self._leer_tablas({"hogar": rutas["hogar"]})["hogar"]
+            df_nuevo = self._unir_hogar(df_personas, df_hog)
+        else:
+            tablas = self._leer_tablas(rutas)
+            df_personas = self._unir_personas(tablas["persona"], tablas["carencias"], tablas["intervenciones"])
+            df_nuevo = self._unir_hogar(df_personas, tablas["hogar"])
+
+        self.firmas = firmas
+        if usar_snapshot:
+            huella = self._huella(firmas)
+            self._guardar_snapshot(df_nuevo, self.origen, huella)
+            df_nuevo = self._compartir(df_nuevo, self._ruta_snapshot(self.origen, huella))
+
+        print("✅ Datos refrescados.")
+        return df_nuevo, cambiadas
@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from typing import Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class GestorDescargas:
+    """Descarga assets remotos a una caché en disco: streaming, en paralelo,
+    condicional (ETag / If-Modified-Since) y reanudable (Range)."""
+
+    TAMANO_BLOQUE = 1 << 16  # 64 KiB por lectura del stream (lo ya escrito se conserva al reanudar)
+
+    def __init__(self, directorio: str, max_hilos: int = 4, timeout=(10, 120),
+                 checksums: Optional[Dict[str, str]] = None):
+        self.directorio = directorio
+        self.max_hilos = max_hilos
+        self.timeout = timeout
+        # sha256 esperados por nombre de archivo (opcional)
+        self.checksums = checksums or {}
+
+        # Sesión compartida: un pool de conexiones para todos los hilos
+        self.session = requests.Session()
+        reintentos = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504],
+                           allowed_methods=["GET", "HEAD"])
+        adaptador = HTTPAdapter(pool_connections=max_hilos, pool_maxsize=max_hilos, max_retries=reintentos)
+        self.session.mount("https://", adaptador)
+        self.session.mount("http://", adaptador)
+
+        self._lock = threading.Lock()
+        self.metadatos: Dict[str, Dict] = {}
+
+    # --------------------------------------------------
+
+    def _rutas(self, url: str):
+        nombre = os.path.basename(url.split("?")[0])
+        final = os.path.join(self.directorio, nombre)
+        return final, final + ".part", final + ".meta.json"
+
+    @staticmethod
+    def _leer_meta(ruta_meta: str) -> Dict:
+        try:
+            with open(ruta_meta, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _escribir_meta(ruta_meta: str, meta: Dict):
+        tmp = f"{ruta_meta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, ruta_meta)
+
+    def _sha256_archivo(self, ruta: str, h=None):
+        h = h or hashlib.sha256()
+        with open(ruta, "rb") as f:
+            for bloque in iter(lambda: f.read(self.TAMANO_BLOQUE), b""):
+                h.update(bloque)
+        return h
+
+    def _archivo_valido(self, ruta: str, meta: Dict) -> bool:
+        """El archivo en caché existe y su sha256 coincide con el registrado."""
+        if not os.path.exists(ruta) or not meta.get("sha256"):
+            return False
+        return self._sha256_archivo(ruta).hexdigest() == meta["sha256"]
+
+    # --------------------------------------------------
+
+    def descargar(self, url: str) -> str:
+        """Devuelve la ruta local del asset, descargándolo solo si cambió."""
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta, ruta_part, ruta_meta = self._rutas(url)
+        nombre = os.path.basename(ruta)
+        meta = self._leer_meta(ruta_meta)
+        en_cache = meta.get("url") == url and self._archivo_valido(ruta, meta)
+
+        # Encabezados condicionales: si no cambió el servidor responde 304
+        headers = {}
+        if en_cache:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+            elif not meta.get("etag"):
+                headers["If-Modified-Since"] = formatdate(os.path.getmtime(ruta), usegmt=True)
+
+        # Reanudación: continuar un .part de la misma versión del asset
+        meta_part = meta.get("parcial", {})
+        inicio = 0
+        if not en_cache and os.path.exists(ruta_part) and meta_part.get("url") == url:
+            inicio = os.path.getsize(ruta_part)
+            if inicio > 0:
+                headers["Range"] = f"bytes={inicio}-"
+                validador = meta_part.get("etag") or meta_part.get("last_modified")
+                if validador:
+                    headers["If-Range"] = validador
+
+        try:
+            resp = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+        except requests.RequestException as e:
+            if en_cache:
+                print(f"⚠️ Sin conexión para {nombre} ({e}). Usando copia en caché.")
+                self._registrar(url, meta)
+                return ruta
+            raise
+
+        with resp:
+            if resp.status_code == 304 and en_cache:
+                print(f"✔️ Sin cambios: {nombre}")
+                self._registrar(url, meta)
+                return ruta
+
+            if resp.status_code not in (200, 206):
+                if en_cache:
+                    print(f"⚠️ {nombre} respondió {resp.status_code}. Usando copia en caché.")
+                    self._registrar(url, meta)
+                    return ruta
+                raise FileNotFoundError(f"❌ No se pudo descargar: {url} (status {resp.status_code})")
+
+            etag = resp.headers.get("ETag")
+            modificado = resp.headers.get("Last-Modified")
+
+            # 206 → se agrega al .part; 200 → el servidor ignoró el Range y empezamos de cero
+            h = hashlib.sha256()
+            if resp.status_code == 206:
+                self._sha256_archivo(ruta_part, h)
+                modo = "ab"
+                print(f"⏯️ Reanudando {nombre} desde el byte {inicio}")
+            else:
+                inicio = 0
+                modo = "wb"
+                print(f"⬇️ Descargando desde: {url}")
+
+            meta_nueva = {"url": url, "etag": etag, "last_modified": modificado}
+            self._escribir_meta(ruta_meta, dict(meta, parcial=meta_nueva))
+
+            with open(ruta_part, modo) as f:
+                for bloque in resp.iter_content(chunk_size=self.TAMANO_BLOQUE):
+                    if bloque:
+                        f.write(bloque)
+                        h.update(bloque)
+
+            # Con Content-Encoding el Content-Length no corresponde a los bytes decodificados
+            total_esperado = resp.headers.get("Content-Length")
+            comprimido = resp.headers.get("Content-Encoding") not in (None, "identity")
+            tamano = os.path.getsize(ruta_part)
+            if total_esperado is not None and not comprimido and tamano != inicio + int(total_esperado):
+                raise IOError(f"❌ Descarga incompleta de {nombre}: {tamano} bytes (se reanudará en el próximo intento)")
+
+        sha = h.hexdigest()
+        esperado = self.checksums.get(nombre)
+        if esperado and esperado.lower() != sha:
+            os.remove(ruta_part)
+            raise IOError(f"❌ Checksum inválido para {nombre}: {sha} (esperado {esperado})")
+
+        os.replace(ruta_part, ruta)
+        meta_final = dict(meta_nueva, sha256=sha, tamano=os.path.getsize(ruta))
+        self._escribir_meta(ruta_meta, meta_final)
+        self._registrar(url, meta_final)
+        return ruta
+
+    def _registrar(self, url: str, meta: Dict):
+        with self._lock:
+            self.metadatos[url] = meta
+
+    # --------------------------------------------------
+
+    def descargar_varios(self, urls: Dict[str, str]) -> Dict[str, str]:
+        """Descarga en paralelo {clave: url} y devuelve {clave: ruta_local}."""
+        with ThreadPoolExecutor(max_workers=self.max_hilos) as pool:
+            futuros = {clave: pool.submit(self.descargar, url) for clave, url in urls.items()}
+            return {clave: fut.result() for clave, fut in futuros.items()}
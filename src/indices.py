@@ -0,0 +1,444 @@
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+
+def normalizar_texto(texto) -> str:
+    """Minúsculas, sin acentos y con espacios colapsados ('San  Ángel' → 'san angel')."""
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', texto.casefold()).strip()
+
+def normalizar_ubicacion(ubicacion: str) -> str:
+    """Quita los prefijos 'colonia', 'pueblo', 'barrio', 'ageb' para dejar solo el nombre/número."""
+    limpio = normalizar_texto(ubicacion)
+    for prefijo in ('colonia', 'pueblo', 'barrio', 'ageb'):
+        limpio = limpio.replace(prefijo, '')
+    limpio = re.sub(r'\s+', ' ', limpio).strip()
+    return limpio if limpio else normalizar_texto(ubicacion)
+
+def normalizar_consulta(consulta: str) -> str:
+    """Forma canónica de una pregunta: sin mayúsculas, acentos, signos ni espacios repetidos."""
+    return re.sub(r'\s+', ' ', re.sub(r'[^\w\s]', ' ', normalizar_texto(consulta))).strip()
+
+def _trigramas(texto: str, relleno: bool = False) -> set:
+    if relleno:
+        texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceUbicacion:
+    """Índice de colonias y AGEBs construido una vez por carga.
+
+    Cada nombre distinto (normalizado) apunta a sus filas (postings en formato CSR)
+    y un índice de trigramas resuelve búsquedas por subcadena o aproximadas
+    tocando solo los nombres distintos, no las filas de personas.
+    """
+
+    COLUMNAS = {"colonia": "colonia", "ageb": "ageb"}
+    UMBRAL_SIMILITUD = 0.4
+
+    def __init__(self, df: pd.DataFrame):
+        self.n_filas = len(df)
+        self.entradas: List[Dict] = []          # {tipo, nombre, normalizado, codigo}
+        self._trigramas: Dict[str, set] = {}   # trigrama → ids de entrada
+        self._orden: Dict[str, np.ndarray] = {}
+        self._inicios: Dict[str, np.ndarray] = {}
+
+        for tipo, col in self.COLUMNAS.items():
+            serie = df[col]
+            if not isinstance(serie.dtype, pd.CategoricalDtype):
+                serie = serie.astype('category')
+            codigos = serie.cat.codes.to_numpy()
+            categorias = serie.cat.categories
+
+            # Postings: filas ordenadas por código + desplazamiento de inicio de cada código
+            orden = np.argsort(codigos, kind='stable')
+            conteos = np.bincount(codigos[codigos >= 0], minlength=len(categorias))
+            n_nulos = int((codigos < 0).sum())
+            self._orden[tipo] = orden[n_nulos:]
+            self._inicios[tipo] = np.concatenate([[0], np.cumsum(conteos)])
+
+            for codigo, nombre in enumerate(categorias):
+                if conteos[codigo] == 0:
+                    continue
+                id_entrada = len(self.entradas)
+                normalizado = normalizar_texto(nombre)
+                self.entradas.append({"tipo": tipo, "nombre": str(nombre), "normalizado": normalizado, "codigo": codigo})
+                for tri in _trigramas(normalizado) | _trigramas(normalizado, relleno=True):
+                    self._trigramas.setdefault(tri, set()).add(id_entrada)
+
+    # --------------------------------------------------
+
+    def _buscar(self, termino: str):
+        """(ids de entrada, tipo de coincidencia) para un término ya normalizado."""
+        subcadena = [i for i in self._candidatos(termino) if termino in self.entradas[i]["normalizado"]]
+        if subcadena:
+            exacta = all(self.entradas[i]["normalizado"] == termino for i in subcadena)
+            return subcadena, ("exacta" if exacta else "subcadena")
+
+        # Aproximada: similitud de Dice entre trigramas; se quedan los mejores puntajes
+        tri_termino = _trigramas(termino, relleno=True)
+        puntajes = {}
+        for tri in tri_termino:
+            for i in self._trigramas.get(tri, ()):
+                puntajes[i] = puntajes.get(i, 0) + 1
+        mejores, mejor = [], self.UMBRAL_SIMILITUD
+        for i, comunes in puntajes.items():
+            tri_nombre = _trigramas(self.entradas[i]["normalizado"], relleno=True)
+            similitud = 2 * comunes / (len(tri_termino) + len(tri_nombre))
+            if similitud > mejor + 1e-9:
+                mejores, mejor = [i], similitud
+            elif abs(similitud - mejor) <= 1e-9:
+                mejores.append(i)
+        return sorted(mejores), ("aproximada" if mejores else "ninguna")
+
+    def _candidatos(self, termino: str):
+        """Entradas que contienen todos los trigramas del término (todas si es muy corto)."""
+        tris = _trigramas(termino)
+        if not tris:
+            return range(len(self.entradas))
+        conjuntos = sorted((self._trigramas.get(t, set()) for t in tris), key=len)
+        return sorted(set.intersection(*conjuntos))
+
+    # --------------------------------------------------
+
+    def resolver(self, ubicacion: str, limite: int = None) -> Dict:
+        """Explica qué colonias/AGEBs coinciden con la ubicación pedida."""
+        termino = normalizar_ubicacion(ubicacion)
+        ids, tipo = self._buscar(termino)
+        colonias = [self.entradas[i]["nombre"] for i in ids if self.entradas[i]["tipo"] == "colonia"]
+        agebs = [self.entradas[i]["nombre"] for i in ids if self.entradas[i]["tipo"] == "ageb"]
+        resultado = {
+            "termino": termino,
+            "coincidencia": tipo,
+            "colonias": colonias[:limite],
+            "agebs": agebs[:limite]
+        }
+        if limite is not None and (len(colonias) > limite or len(agebs) > limite):
+            resultado["total_coincidencias"] = len(colonias) + len(agebs)
+        return resultado
+
+    def _postings(self, ubicacion: str) -> List[np.ndarray]:
+        ids, _ = self._buscar(normalizar_ubicacion(ubicacion))
+        partes = []
+        for i in ids:
+            e = self.entradas[i]
+            inicios = self._inicios[e["tipo"]]
+            partes.append(self._orden[e["tipo"]][inicios[e["codigo"]]:inicios[e["codigo"] + 1]])
+        return partes
+
+    def codigos(self, ubicacion: str) -> Dict[str, np.ndarray]:
+        """Códigos de categoría coincidentes por tipo: {'colonia': [...], 'ageb': [...]}."""
+        ids, _ = self._buscar(normalizar_ubicacion(ubicacion))
+        return {tipo: np.array([self.entradas[i]["codigo"] for i in ids if self.entradas[i]["tipo"] == tipo], dtype=np.int64)
+                for tipo in self.COLUMNAS}
+
+    def filas(self, ubicacion: str) -> np.ndarray:
+        """Ids de fila (ordenados) de las personas en las colonias/AGEBs que coinciden."""
+        partes = self._postings(ubicacion)
+        if not partes:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(partes))
+
+    def mascara(self, ubicacion: str) -> np.ndarray:
+        mascara = np.zeros(self.n_filas, dtype=bool)
+        for filas in self._postings(ubicacion):
+            mascara[filas] = True
+        return mascara
+
+
+# Bits encendidos por cada valor de byte (popcount por tabla)
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class IndiceBitmap:
+    """Bitmaps empaquetados (1 bit por persona) para los filtros de baja cardinalidad.
+
+    Un filtro es un AND de bitmaps y los conteos (población objetivo, personas sin
+    apoyo, distribución por sexo, intensidad de carencias) son popcounts.
+    """
+
+    EDAD_MAXIMA = 120
+
+    def __init__(self, df: pd.DataFrame, banderas: List[str], categoricas: List[str], carencias: List[str]):
+        self.n = len(df)
+        self._bits: Dict = {}
+
+        self.todos = np.packbits(np.ones(self.n, dtype=bool))
+
+        for col in banderas:
+            self._bits[col] = np.packbits(df[col].to_numpy(dtype=bool))
+
+        for col in categoricas:
+            serie = df[col]
+            for valor in serie.cat.categories if isinstance(serie.dtype, pd.CategoricalDtype) else serie.dropna().unique():
+                self._bits[(col, valor)] = np.packbits((serie == valor).to_numpy())
+
+        apoyos = df['recibe_apoyos_sociales']
+        self._bits['sin_apoyo'] = np.packbits(((apoyos == 'No tiene') | apoyos.isna()).to_numpy())
+
+        intensidad = sum(df[c].to_numpy(dtype=np.uint8) for c in carencias)
+        for k in range(len(carencias) + 1):
+            self._bits[('intensidad', k)] = np.packbits(intensidad == k)
+
+        # Bitmaps acumulados "edad <= k": cualquier rango [a, b] son dos operaciones
+        edades = df['edad_persona'].to_numpy()
+        self._edad_hasta = np.stack([np.packbits(edades <= k) for k in range(self.EDAD_MAXIMA + 1)])
+
+    # --------------------------------------------------
+
+    @staticmethod
+    def empaquetar(mascara: np.ndarray) -> np.ndarray:
+        return np.packbits(mascara)
+
+    def desempaquetar(self, bits: np.ndarray) -> np.ndarray:
+        return np.unpackbits(bits, count=self.n).view(bool)
+
+    @staticmethod
+    def contar(bits: np.ndarray) -> int:
+        return int(_POPCOUNT[bits].sum(dtype=np.int64))
+
+    def vacio(self) -> np.ndarray:
+        return np.zeros_like(self.todos)
+
+    def bitmap(self, clave) -> np.ndarray:
+        """Bitmap de una bandera ('es_elegible_...', 'sin_apoyo') o de un valor (col, valor)."""
+        bits = self._bits.get(clave)
+        return bits if bits is not None else self.vacio()
+
+    def rango_edad(self, minimo, maximo) -> np.ndarray:
+        a, b = int(np.ceil(minimo)), int(np.floor(maximo))
+        if b < 0 or a > self.EDAD_MAXIMA or a > b:
+            return self.vacio()
+        bits = self._edad_hasta[min(b, self.EDAD_MAXIMA)]
+        if a > 0:
+            bits = bits & ~self._edad_hasta[a - 1]
+        return bits
+
+
+class IndiceHogares:
+    """Hogares en formato CSR: las personas de cada hogar son filas contiguas.
+
+    El censo unificado viene ordenado por id_hogar, así que basta el arreglo de
+    inicios de cada hogar para reducir por hogar (algún miembro, todos, cuántos)
+    con un reduceat, en O(n) y sin hashing. Si el df no viene ordenado se
+    guarda además la permutación que lo ordena.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        serie = df['id_hogar']
+        ids = serie.to_numpy()
+        self.orden = None
+        if not serie.is_monotonic_increasing:
+            self.orden = np.argsort(ids, kind='stable')  # los nulos quedan al final
+            ids = ids[self.orden]
+        self.n_filas = int(serie.notna().sum())
+        ids = ids[:self.n_filas]
+        self.inicios = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if self.n_filas else np.empty(0, dtype=np.int64)
+        self.n_hogares = len(self.inicios)
+        self.tamano = np.diff(np.r_[self.inicios, self.n_filas])
+
+    # --------------------------------------------------
+
+    def _por_hogar(self, valores: np.ndarray) -> np.ndarray:
+        if self.orden is not None:
+            valores = valores[self.orden]
+        return valores[:self.n_filas]
+
+    def miembros(self, mascara: np.ndarray) -> np.ndarray:
+        """Cuántos miembros de cada hogar cumplen la máscara de personas."""
+        if not self.n_hogares:
+            return np.zeros(0, dtype=np.int64)
+        return np.add.reduceat(self._por_hogar(mascara), self.inicios, dtype=np.int64)
+
+    def algun(self, mascara: np.ndarray) -> np.ndarray:
+        """Hogares con al menos un miembro que cumple."""
+        if not self.n_hogares:
+            return np.zeros(0, dtype=bool)
+        return np.logical_or.reduceat(self._por_hogar(mascara), self.inicios)
+
+    def todos(self, mascara: np.ndarray) -> np.ndarray:
+        """Hogares en los que todos los miembros cumplen."""
+        if not self.n_hogares:
+            return np.zeros(0, dtype=bool)
+        return np.logical_and.reduceat(self._por_hogar(mascara), self.inicios)
+
+    def contar(self, mascara: np.ndarray) -> int:
+        """Hogares distintos entre las personas de la máscara."""
+        return int(np.count_nonzero(self.algun(mascara)))
+
+
+class CaracteristicasDerivadas:
+    """Columnas derivadas calculadas una vez por carga, como arreglos enteros compactos.
+
+    Rango de edad (código), intensidad de carencias (0-3), número de programas
+    para los que la persona es elegible, "sin apoyo" y "elegible sin apoyo" por
+    programa. Los análisis las leen directamente en lugar de recalcularlas sobre
+    las filas filtradas en cada consulta.
+    """
+
+    # Mismos cortes que pd.cut (intervalos (a, b]; edad 0 queda fuera, código -1)
+    CORTES_EDAD = np.array([0, 12, 18, 30, 60, 120])
+    ETIQUETAS_EDAD = ['0-12', '13-18', '19-30', '31-60', '60+']
+
+    def __init__(self, df: pd.DataFrame, carencias: List[str], programas: List[str]):
+        self.edad_cat = self.codigos_edad(df['edad_persona'].to_numpy())
+        self.intensidad = sum(df[c].to_numpy(dtype=np.uint8) for c in carencias).astype(np.uint8)
+        self.n_programas = sum(df[c].to_numpy(dtype=np.uint8) for c in programas).astype(np.uint8)
+
+        apoyos = df['recibe_apoyos_sociales']
+        self.sin_apoyo = ((apoyos == 'No tiene') | apoyos.isna()).to_numpy()
+        self.elegible_sin_apoyo = {c: df[c].to_numpy(dtype=bool) & self.sin_apoyo for c in programas}
+
+    @classmethod
+    def codigos_edad(cls, edades: np.ndarray) -> np.ndarray:
+        codigos = np.searchsorted(cls.CORTES_EDAD, edades, side='left') - 1
+        codigos[(edades > cls.CORTES_EDAD[-1]) | np.isnan(edades.astype(np.float64))] = -1
+        return codigos.astype(np.int8)
+
+    @classmethod
+    def rango_edad(cls, codigos: np.ndarray, indice=None) -> pd.Series:
+        """Serie categórica 'edad_cat' equivalente a pd.cut sobre la edad."""
+        categorias = pd.Categorical.from_codes(codigos, categories=cls.ETIQUETAS_EDAD, ordered=True)
+        return pd.Series(categorias, index=indice, name='edad_cat')
+
+
+class CuboAgregado:
+    """Cubo materializado: conteos de personas por celda de dimensiones.
+
+    Dimensiones: colonia, AGEB, sexo, parentesco, edad (años) y las carencias;
+    medidas aditivas por celda: personas, elegibles por programa, personas sin
+    apoyo y elegibles sin apoyo. Filtrar es una máscara sobre las celdas y
+    contar/agrupar es sumar medidas, sin recorrer las filas de personas.
+    """
+
+    CATEGORICAS = ['colonia', 'ageb', 'sexo_persona', 'parentesco_persona']
+
+    def __init__(self, df: pd.DataFrame, carencias: List[str], programas: List[str]):
+        categorias = {col: (df[col].cat.categories if isinstance(df[col].dtype, pd.CategoricalDtype)
+                            else df[col].astype('category').cat.categories) for col in self.CATEGORICAS}
+        self._publicar(self.agrupar(df, carencias, programas, categorias), categorias, carencias)
+
+    @classmethod
+    def dimensiones(cls, carencias: List[str]) -> List[str]:
+        return cls.CATEGORICAS + ['edad_persona'] + list(carencias)
+
+    @classmethod
+    def agrupar(cls, df: pd.DataFrame, carencias: List[str], programas: List[str],
+                categorias: Dict[str, pd.Index]) -> pd.DataFrame:
+        """Celdas (dimensiones como códigos de `categorias`) con sus medidas sumadas."""
+        dims = {}
+        for col in cls.CATEGORICAS:
+            dims[col] = pd.Categorical(df[col], categories=categorias[col]).codes
+        dims['edad_persona'] = df['edad_persona'].to_numpy()
+        for col in carencias:
+            dims[col] = df[col].to_numpy(dtype=bool)
+
+        apoyos = df['recibe_apoyos_sociales']
+        sin_apoyo = ((apoyos == 'No tiene') | apoyos.isna()).to_numpy()
+        medidas = {'n': np.ones(len(df), dtype=np.int32), 'sin_apoyo': sin_apoyo.astype(np.int32)}
+        for col in programas:
+            elegible = df[col].to_numpy(dtype=bool)
+            medidas[col] = elegible.astype(np.int32)
+            medidas[f'{col}|sin_apoyo'] = (elegible & sin_apoyo).astype(np.int32)
+
+        return pd.DataFrame({**dims, **medidas}).groupby(list(dims), sort=False).sum().reset_index()
+
+    @classmethod
+    def combinar(cls, partes: List[pd.DataFrame], carencias: List[str]) -> pd.DataFrame:
+        """Suma celdas de agregaciones parciales (p. ej. lotes de un escaneo)."""
+        if len(partes) == 1:
+            return partes[0]
+        return pd.concat(partes, ignore_index=True).groupby(cls.dimensiones(carencias), sort=False).sum().reset_index()
+
+    @classmethod
+    def desde_celdas(cls, celdas: pd.DataFrame, categorias: Dict[str, pd.Index], carencias: List[str]) -> "CuboAgregado":
+        cubo = cls.__new__(cls)
+        cubo._publicar(celdas, categorias, carencias)
+        return cubo
+
+    def _publicar(self, celdas: pd.DataFrame, categorias: Dict[str, pd.Index], carencias: List[str]):
+        self.carencias = list(carencias)
+        self.categorias = {col: pd.Index(categorias[col]) for col in self.CATEGORICAS}
+        dims = self.dimensiones(self.carencias)
+
+        self.n_celdas = len(celdas)
+        self.dims = {col: celdas[col].to_numpy() for col in dims}
+        self.intensidad = sum(self.dims[c].astype(np.uint8) for c in self.carencias)
+        self._medidas = {}
+        for nombre in celdas.columns.difference(dims, sort=False):
+            valores = celdas[nombre].to_numpy()
+            clave = tuple(nombre.split('|')) if '|' in nombre else nombre
+            self._medidas[clave] = valores.astype(np.min_scalar_type(valores.max() if len(valores) else 0))
+
+    # --------------------------------------------------
+
+    def todos(self) -> np.ndarray:
+        return np.ones(self.n_celdas, dtype=bool)
+
+    def igual(self, col: str, valor) -> np.ndarray:
+        categorias = self.categorias[col]
+        if valor not in categorias:
+            return np.zeros(self.n_celdas, dtype=bool)
+        return self.dims[col] == categorias.get_loc(valor)
+
+    def en_codigos(self, col: str, codigos: np.ndarray) -> np.ndarray:
+        return np.isin(self.dims[col], codigos)
+
+    def rango_edad(self, minimo, maximo) -> np.ndarray:
+        edades = self.dims['edad_persona']
+        return (edades >= minimo) & (edades <= maximo)
+
+    def bandera(self, col: str) -> np.ndarray:
+        return self.dims[col]
+
+    def predicado(self, clave) -> np.ndarray:
+        """Dimensión como máscara de celdas: (col, valor) o ('intensidad', k)."""
+        col, valor = clave
+        if col == 'intensidad':
+            return self.intensidad == valor
+        return self.igual(col, valor)
+
+    def medida(self, *claves) -> np.ndarray:
+        """'n' (personas), 'sin_apoyo', columna de programa o (programa, 'sin_apoyo')."""
+        if not claves:
+            return self._medidas['n']
+        if len(claves) == 1:
+            return self._medidas[claves[0]]
+        return self._medidas[tuple(sorted(claves, key=lambda c: c == 'sin_apoyo'))]
+
+    # --------------------------------------------------
+
+    def contar(self, seleccion: np.ndarray, *claves) -> int:
+        for clave in claves:
+            if isinstance(clave, tuple):
+                seleccion = seleccion & self.predicado(clave)
+        medida = self.medida(*(c for c in claves if not isinstance(c, tuple)))
+        return int(medida.sum(where=seleccion, dtype=np.int64))
+
+    def promedio_edad(self, seleccion: np.ndarray, *medidas) -> float:
+        pesos = self.medida(*medidas)
+        total = pesos.sum(where=seleccion, dtype=np.int64)
+        if total == 0:
+            return np.float64('nan')
+        return (self.dims['edad_persona'] * pesos.astype(np.float64)).sum(where=seleccion) / total
+
+    def distribucion(self, seleccion: np.ndarray, col: str) -> pd.Series:
+        """Personas por categoría de la dimensión (todas las categorías, en su orden)."""
+        codigos = self.dims[col]
+        validas = seleccion & (codigos >= 0)
+        conteo = np.bincount(codigos[validas], weights=self._medidas['n'][validas], minlength=len(self.categorias[col]))
+        return pd.Series(conteo.astype(np.int64), index=self.categorias[col], name='count')
+
+    def celdas(self, seleccion: np.ndarray, columnas: List[str]) -> pd.DataFrame:
+        """Celdas seleccionadas con sus dimensiones decodificadas y la columna de pesos 'n'."""
+        datos = {}
+        for col in columnas:
+            valores = self.dims[col][seleccion]
+            if col in self.categorias:
+                valores = pd.Categorical.from_codes(valores, categories=self.categorias[col])
+            datos[col] = valores
+        datos['n'] = self._medidas['n'][seleccion]
+        return pd.DataFrame(datos)
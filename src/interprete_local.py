@@ -0,0 +1,341 @@
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+from .config import CONSTANTES_MAPEO, UMBRAL_INTERPRETE_LOCAL
+from .indices import IndiceUbicacion, normalizar_consulta
+
+# Palabras que no cambian el análisis pedido ("¿cuántas personas hay en...?", "dame el perfil de...")
+PALABRAS_VACIAS = set("""
+a al algun alguna algunas algunos ante cada como con cual cuales de del dame dime donde e el en entre es esa ese
+esta estan este existe existen hay la las le les lo los me mi mis muestra muestrame muestranos necesito o para por
+porfa porfavor favor que quienes quiero saber se segun ser si sobre son su sus te tiene tienen toda todas todo todos
+tu un una uno unos unas ver y ya analiza analizar analisis calcula calcular dato datos informacion info obten obtener
+genera generar haz hacer reporte puedes podrias personas persona gente individuos numero cantidad total totales
+alcaldia alvaro obregon cdmx ciudad mexico colonia pueblo barrio zona programa programas viven vive residen habitan
+actualmente actual hoy mas mayor nivel cuenta cuentan
+""".split())
+
+# Alias de programas además de su clave ('pension_adultos_mayores' → "pension adultos mayores")
+ALIAS_PROGRAMAS = {
+    "benito juarez": "beca_benito_juarez",
+    "rita cetina": "beca_rita_cetina",
+    "mujeres bienestar": "pension_mujeres_bienestar",
+    "jovenes construyendo": "jovenes_construyendo_futuro",
+    "jovenes escribiendo": "jovenes_escribiendo_el_futuro",
+    "mi beca": "mi_beca_para_empezar",
+    "imss": "imss_bienestar",
+    "seguro de desempleo": "seguro_desempleo_cdmx",
+    "ingreso ciudadano": "ingreso_ciudadano_universal",
+    "leche": "leche_bienestar",
+    "liconsa": "leche_bienestar",
+}
+
+# Sinónimos de las variables de VARIABLES_CRUCE (el orden de aparición define fila y columna)
+SINONIMOS_CRUCE = {
+    "sexo": r"sexo|genero",
+    "edad": r"(?:rangos? de |grupos? de )?edad(?:es)?",
+    "parentesco": r"parentesco",
+    "colonia": r"colonias?",
+    "ageb": r"agebs?",
+    "carencia_salud": r"(?:carencia (?:de |en )?)?salud",
+    "carencia_educacion": r"rezago educativo|(?:carencia (?:de |en )?)?educa\w*",
+    "carencia_seguridad": r"(?:carencia (?:de |en )?)?seguridad social",
+}
+
+CARENCIAS = {
+    "salud": r"carencias? (?:de |en )?(?:acceso a (?:los )?(?:servicios de )?)?salud|sin (?:acceso a )?(?:servicios de )?salud",
+    "educacion": r"rezago educativo|carencias? (?:de |en )?educa\w*",
+    "seguridad_social": r"carencias? (?:de |en )?seguridad social|sin (?:acceso a (?:la )?)?seguridad social",
+}
+
+PARENTESCOS = {
+    "jefe": r"jef[ea]s? (?:de )?(?:hogar|familia)|jef[ea]s?",
+    "esposa": r"espos[oa]s?|parejas?|conyuges?",
+    "hijo": r"hij[oa]s?",
+    "nieto": r"niet[oa]s?",
+}
+
+INTENCIONES = {
+    "cruce": r"cruza\w*|cruce|tabla|relacion",
+    "ranking": r"ranking|prioriz\w*|prioridad\w*|top|peores|mas afectad\w*",
+    "hogares": r"hogar(?:es)?|familias|viviendas?",
+    "brechas": r"brechas?|cobertura|desatendid\w*|excluid\w*"
+               r"|no (?:reciben?|tienen?|cuentan con) (?:ningun |el |la )?(?:apoyos?|programas?|beneficios?)"
+               r"|sin (?:ningun )?(?:apoyos?|beneficios?)|no reciben?",
+    "vulnerabilidad": r"vulnerab\w*|intensidad|(?:multiples |tres |3 |las tres )?carencias",
+    "elegibilidad": r"elegib\w*|poblacion objetivo|beneficiari\w*|derecho|califica\w*|potencial\w*|candidat\w*",
+    "conteo": r"cuant[oa]s|perfil|demograf\w*|caracteriz\w*|resumen|panorama|poblacion|habitantes",
+}
+
+# Preguntas que se apoyan en el turno anterior ("¿y en Tizapán?", "¿y de esos cuántos...?")
+SEGUIMIENTO = (r"^ *(?:y|e|ahora|tambien|igual|lo mismo|pero|en cambio|que tal)\b"
+               r"|\b(?:ellos|ellas|esos|esas|estos|estas|mismos?|mismas?|anterior|ahi|alli)\b")
+
+EDAD_MAXIMA = 120  # tope de los rangos abiertos ('65 y más')
+
+NUMEROS = {"un": 1, "una": 1, "uno": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5}
+
+
+def _frase(texto: str) -> str:
+    """Regex de una frase que admite artículos/preposiciones entre sus palabras."""
+    conectores = r"(?:\s+(?:de|del|la|las|el|los|para|a|al))*\s+"
+    return conectores.join(re.escape(p) for p in texto.split())
+
+
+class _Texto:
+    """Pregunta normalizada de la que se van 'consumiendo' las partes ya interpretadas."""
+
+    def __init__(self, texto: str):
+        self.texto = f" {texto} "
+
+    def hay(self, patron: str) -> bool:
+        return re.search(rf"\b(?:{patron})\b", self.texto) is not None
+
+    def tomar(self, patron: str) -> List[re.Match]:
+        """Todas las coincidencias (se borran del texto, conservando las posiciones)."""
+        coincidencias = list(re.finditer(rf"\b(?:{patron})\b", self.texto))
+        for m in coincidencias:
+            self.texto = self.texto[:m.start()] + " " * (m.end() - m.start()) + self.texto[m.end():]
+        return coincidencias
+
+    def restantes(self) -> List[str]:
+        return [p for p in self.texto.split() if p not in PALABRAS_VACIAS]
+
+
+class _Gazetteer:
+    """Frases que nombran colonias (nombre completo, sin prefijo/artículo o sus primeras palabras) y AGEBs."""
+
+    PREFIJOS = {"colonia", "col", "pueblo", "barrio", "unidad", "la", "las", "el", "los"}
+
+    def __init__(self, indice: IndiceUbicacion):
+        frases: Dict[str, set] = {}
+        agebs: Dict[str, str] = {}
+        for e in indice.entradas:
+            normalizado = normalizar_consulta(e["nombre"])
+            if e["tipo"] == "ageb":
+                agebs[normalizado] = e["nombre"]
+                continue
+            palabras = normalizado.split()
+            while len(palabras) > 1 and palabras[0] in self.PREFIJOS:
+                frases.setdefault(" ".join(palabras), set()).add(e["nombre"])
+                palabras = palabras[1:]
+            for k in range(1, len(palabras) + 1):
+                frase = " ".join(palabras[:k])
+                if palabras[k - 1] in PALABRAS_VACIAS or len(frase) < 4:
+                    continue
+                frases.setdefault(frase, set()).add(e["nombre"])
+
+        # Nombre único → el nombre oficial; frase compartida ('olivar') → la frase (el motor la resuelve a todas)
+        self.valores = {f: (next(iter(n)) if len(n) == 1 else f) for f, n in frases.items()}
+        self.agebs = agebs
+        ordenar = lambda claves: "|".join(re.escape(c) for c in sorted(claves, key=len, reverse=True))
+        self.patron_colonia = rf"(?:(?:colonia|col|pueblo|barrio) )?({ordenar(self.valores)})" if self.valores else None
+        self.patron_ageb = rf"agebs? ({ordenar(self.agebs)})" if self.agebs else None
+
+    def buscar(self, texto: _Texto) -> List[str]:
+        encontradas = []
+        if self.patron_ageb:
+            encontradas += [self.agebs[m.group(1)] for m in texto.tomar(self.patron_ageb)]
+        if self.patron_colonia:
+            encontradas += [self.valores[m.group(1)] for m in texto.tomar(self.patron_colonia)]
+        return list(dict.fromkeys(encontradas))
+
+
+class InterpreteLocal:
+    """Intérprete determinista de preguntas de fórmula: produce el mismo {intencion, filtros}
+    que la herramienta del LLM, con una confianza de 0 a 1.
+
+    Cada palabra de la pregunta debe quedar explicada por un vocabulario cerrado
+    (programas, carencias, parentescos, variables de cruce, palabras clave de cada
+    intención), una expresión de edad o el nomenclátor de colonias/AGEBs del motor.
+    Cualquier palabra sin explicar, ambigüedad o pregunta de seguimiento baja la
+    confianza para que la pregunta la interprete el LLM.
+    """
+
+    UMBRAL = UMBRAL_INTERPRETE_LOCAL
+
+    def __init__(self, motor):
+        self.motor = motor
+        self._indice = None
+        self._gazetteer = None
+        self._lock = threading.Lock()  # compartido entre sesiones
+        self.resueltas = 0
+        self.derivadas = 0
+
+        # Programas: frase de la clave y alias, de la más larga a la más corta
+        programas = {clave.replace("_", " "): clave for clave in CONSTANTES_MAPEO["PROGRAMAS"]}
+        programas.update(ALIAS_PROGRAMAS)
+        prefijo = r"(?:(?:programa|beca|pension)(?: de| del| para)? )?"
+        self._programas = [(prefijo + _frase(f), clave) for f, clave in sorted(programas.items(), key=lambda x: -len(x[0]))]
+
+    def _nomenclator(self) -> _Gazetteer:
+        indice = self.motor.ubicacion
+        with self._lock:
+            if indice is not self._indice:  # el censo se actualizó: se reconstruye
+                self._gazetteer, self._indice = _Gazetteer(indice), indice
+            return self._gazetteer
+
+    # --------------------------------------------------
+
+    @staticmethod
+    def _edades(texto: _Texto) -> Tuple[List[Tuple[int, int]], bool, int]:
+        """(rangos de edad mencionados, si alguno salió de una palabra y no de números,
+        cuántos eran imposibles: invertidos o fuera de EDAD_MAXIMA)."""
+        rangos, por_palabra, invalidos = [], False, 0
+        for patron, rango in [
+            (r"entre (?:los )?(\d{1,3}) y (?:los )?(\d{1,3})(?: anos)?", lambda a, b: (a, b)),
+            (r"de (\d{1,3}) a (\d{1,3})(?: anos)?|(\d{1,3}) a (\d{1,3}) anos", lambda a, b: (a, b)),
+            (r"(?:de )?(\d{1,3}) (?:anos )?(?:o|y) mas(?: anos)?", lambda a: (a, EDAD_MAXIMA)),
+            (r"(?:mayores|mas) de (\d{1,3})(?: anos)?", lambda a: (a, EDAD_MAXIMA)),
+            (r"menores de (\d{1,3})(?: anos)?", lambda a: (0, max(a - 1, 0))),
+            (r"de (\d{1,3}) anos", lambda a: (a, a)),
+            (r"adult[oa]s? mayor(?:es)?|personas? mayor(?:es)?|tercera edad|ancian[oa]s?", lambda: (65, EDAD_MAXIMA)),
+            (r"menores de edad|menores", lambda: (0, 17)),
+            (r"ninos|infancia|infantes", lambda: (0, 12)),
+        ]:
+            for m in texto.tomar(patron):
+                numeros = [int(g) for g in m.groups() if g is not None]
+                minimo, maximo = rango(*numeros)
+                invalidos += minimo > maximo or any(n > EDAD_MAXIMA for n in numeros)
+                rangos.append((min(minimo, EDAD_MAXIMA), min(maximo, EDAD_MAXIMA)))
+                por_palabra |= not numeros
+        return list(dict.fromkeys(rangos)), por_palabra, invalidos
+
+    def interpretar(self, consulta: str, contexto_nuevo: bool = True) -> Tuple[Optional[Dict], float]:
+        """({intencion, filtros} o None, confianza)."""
+        texto = _Texto(normalizar_consulta(consulta))
+        if not contexto_nuevo and re.search(SEGUIMIENTO, texto.texto):
+            return None, 0.0
+
+        filtros, dudas = {}, 0
+
+        programas = {clave for patron, clave in self._programas for _ in texto.tomar(patron)}
+        if len(programas) == 1:
+            filtros["programa_social"] = programas.pop()
+        dudas += len(programas) > 1
+
+        ubicaciones = self._nomenclator().buscar(texto)
+        if len(ubicaciones) == 1:
+            filtros["ubicacion"] = ubicaciones[0]
+        dudas += len(ubicaciones) > 1
+
+        edades, edad_por_palabra, edades_invalidas = self._edades(texto)
+        if len(edades) == 1:
+            filtros["rango_edad"] = list(edades[0])
+        # 'entre 15 y 5', 'mayores de 200': se deja al LLM en lugar de devolver un resultado vacío
+        dudas += (len(edades) > 1) + edades_invalidas
+
+        # Tabla cruzada: las variables se toman antes que los filtros que comparten palabras
+        intencion = None
+        if texto.hay(INTENCIONES["cruce"]):
+            texto.tomar(INTENCIONES["cruce"])
+            variables = sorted((m.start(), var) for var, patron in SINONIMOS_CRUCE.items() for m in texto.tomar(patron))
+            if len(variables) != 2:
+                return None, 0.0
+            filtros["variable_fila"], filtros["variable_columna"] = variables[0][1], variables[1][1]
+            intencion = "tabla_cruzada"
+
+        if texto.tomar(r"jefas(?: (?:de )?(?:hogar|familia))?"):
+            filtros["grupo_especial"] = "jefas_familia"
+        for clave, patron in PARENTESCOS.items():
+            if texto.tomar(patron):
+                dudas += "parentesco" in filtros or "grupo_especial" in filtros
+                filtros["parentesco"] = clave
+        mujeres, hombres = texto.tomar(r"mujer(?:es)?|femenin\w*"), texto.tomar(r"hombres?|varones|masculin\w*")
+        if bool(mujeres) != bool(hombres):
+            filtros["sexo"] = "Mujer" if mujeres else "Hombre"
+        dudas += bool(mujeres) and bool(hombres)  # comparación por sexo: es un plan, no un filtro
+        carencias = [clave for clave, patron in CARENCIAS.items() if texto.tomar(patron)]
+        if len(carencias) == 1:
+            filtros["carencia_tipo"] = carencias[0]
+        dudas += len(carencias) > 1
+
+        # Intención por palabras clave
+        if intencion is None:
+            intencion, dudas = self._intencion(texto, filtros, dudas)
+            if intencion is None:
+                return None, 0.0
+
+        restantes = texto.restantes()
+        # Rangos por convención ('adultos mayores' = 65+) restan poco; palabras sin explicar, mucho
+        confianza = max(0.0, 1.0 - 0.5 * dudas - 0.25 * len(restantes) - 0.05 * edad_por_palabra)
+        return {"intencion": intencion, "filtros": filtros}, round(confianza, 2)
+
+    def _intencion(self, texto: _Texto, filtros: Dict, dudas: int) -> Tuple[Optional[str], int]:
+        hay = {nombre: texto.hay(patron) for nombre, patron in INTENCIONES.items() if nombre != "cruce"}
+        ranking = hay["ranking"] or texto.hay(r"(?:que|cuales|en que) (?:colonias|agebs|zonas)|(?:colonias|agebs|zonas) (?:con|mas|donde)")
+        programa = "programa_social" in filtros
+        if programa:
+            texto.tomar(INTENCIONES["elegibilidad"])
+        texto.tomar(INTENCIONES["conteo"])
+
+        if hay["hogares"]:
+            texto.tomar(INTENCIONES["hogares"])
+            if texto.tomar(r"todos (?:sus |los )?(?:miembros|integrantes)|donde todos|todos"):
+                filtros["cuantificador"] = "todos"
+            for m in texto.tomar(r"al menos (\d+|un|una|uno|dos|tres|cuatro|cinco)(?: (?:miembros?|integrantes?|personas?))?"):
+                filtros["min_miembros"] = int(m.group(1)) if m.group(1).isdigit() else NUMEROS[m.group(1)]
+            if texto.tomar(r"sin (?:ningun )?(?:apoyos?|beneficios?)|no (?:reciben?|tienen?) (?:ningun )?(?:apoyos?|beneficios?)"):
+                filtros["sin_apoyo"] = True
+            elegible = bool(texto.tomar(INTENCIONES["elegibilidad"]))
+            dudas += elegible and not programa
+            if hay["vulnerabilidad"] and not programa:
+                texto.tomar(INTENCIONES["vulnerabilidad"])
+                return "vulnerabilidad_hogares", dudas
+            return "hogares", dudas
+
+        if ranking:
+            texto.tomar(INTENCIONES["ranking"] + r"|mas|mayor(?:es)?")
+            filtros["nivel_territorial"] = "ageb" if texto.hay(r"agebs?") else "colonia"
+            k = texto.tomar(r"top (\d+)|(\d+) (?:colonias|agebs|zonas)|primer[oa]s (\d+)")
+            if k:
+                filtros["top_k"] = int(next(g for g in k[0].groups() if g))
+            texto.tomar(r"colonias?|agebs?|zonas?")
+            if hay["vulnerabilidad"] and not hay["brechas"] and not programa:
+                texto.tomar(INTENCIONES["vulnerabilidad"])
+                if texto.tomar(r"(?:mas |numero de |cantidad de )?personas con carencias"):
+                    filtros["ordenar_por"] = "personas_con_carencias"
+                elif texto.tomar(r"intensidad promedio|promedio"):
+                    filtros["ordenar_por"] = "intensidad_promedio"
+                return "ranking_vulnerabilidad", dudas
+            if programa and not hay["vulnerabilidad"]:
+                texto.tomar(INTENCIONES["brechas"])
+                if texto.tomar(r"porcentaje|proporcion|tasa|relativ\w*"):
+                    filtros["ordenar_por"] = "porcentaje_brecha"
+                elif texto.tomar(r"absolut\w*|numero de personas"):
+                    filtros["ordenar_por"] = "personas_sin_apoyo"
+                return "ranking_brechas", dudas
+            return None, dudas
+
+        if hay["brechas"] and not hay["vulnerabilidad"]:
+            texto.tomar(INTENCIONES["brechas"])
+            return ("brechas" if programa else None), dudas
+        if hay["vulnerabilidad"] and not hay["brechas"] and not programa:
+            texto.tomar(INTENCIONES["vulnerabilidad"])
+            return "vulnerabilidad", dudas
+        if hay["brechas"] or hay["vulnerabilidad"]:
+            return None, dudas
+        if programa:
+            return "elegibilidad", dudas
+        # Solo filtros ('mujeres de 65 y más en Tizapán') → conteo de esa población
+        if hay["conteo"] or filtros:
+            return "conteo_general", dudas
+        return None, dudas
+
+    # --------------------------------------------------
+
+    def registrar(self, resuelta: bool):
+        with self._lock:
+            if resuelta:
+                self.resueltas += 1
+            else:
+                self.derivadas += 1
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            consultas = self.resueltas + self.derivadas
+            return {
+                "resueltas_localmente": self.resueltas,
+                "derivadas_al_llm": self.derivadas,
+                "tasa_local": round(self.resueltas / consultas * 100, 1) if consultas else 0
+            }
@@ -1,147 +1,602 @@
+import functools
+import itertools
+import numpy as np
 import pandas as pd
-from .config import CONSTANTES_MAPEO
-from typing import Dict
+import pyarrow as pa
+import pyarrow.dataset as ds
+from .config import CONSTANTES_MAPEO, COLUMNAS_BANDERA, CACHE_FILTROS_MAX_MB, DIRECTORIO_PARTICIONES
+from .indices import (IndiceUbicacion, IndiceBitmap, IndiceHogares, CaracteristicasDerivadas, CuboAgregado,
+                      normalizar_ubicacion)
+from .cache_filtros import CacheFiltros
+from .consultas_sql import ConsultasDuckDB
+from .particiones import CensoParticionado
+from typing import Dict, List, Iterable
 
-class AnalizadorProgramasSociales:
-    def __init__(self, df: pd.DataFrame):
+# Caché de selecciones compartida por todas las sesiones del proceso
+CACHE_FILTROS = CacheFiltros(CACHE_FILTROS_MAX_MB * 2 ** 20)
+
+# Cada carga/actualización del censo recibe una generación nueva (parte de la clave de caché)
+_GENERACIONES = itertools.count()
+
+def expandir_grupo_especial(filtros: Dict) -> Dict:
+    """'jefas_familia' equivale a sexo='Mujer' + parentesco='jefe'."""
+    if filtros.get('grupo_especial') == 'jefas_familia':
+        filtros = dict(filtros, sexo='Mujer', parentesco='jefe')
+    return filtros
+
+def clave_filtros(filtros: Dict) -> tuple:
+    """Forma canónica de los filtros que determinan la selección de filas."""
+    filtros = expandir_grupo_especial(filtros)
+    clave = {}
+    if filtros.get('ubicacion'):
+        clave['ubicacion'] = normalizar_ubicacion(filtros['ubicacion'])
+    edad = filtros.get('rango_edad')
+    if edad and len(edad) == 2:
+        clave['rango_edad'] = (float(edad[0]), float(edad[1]))
+    if filtros.get('sexo'):
+        clave['sexo'] = filtros['sexo']
+    if filtros.get('parentesco'):
+        clave['parentesco'] = CONSTANTES_MAPEO['PARENTESCOS'].get(filtros['parentesco'].lower(), filtros['parentesco'])
+    col_carencia = CONSTANTES_MAPEO['CARENCIAS'].get(filtros.get('carencia_tipo'))
+    if col_carencia:
+        clave['carencia'] = col_carencia
+    return tuple(sorted(clave.items()))
+
+def producto_filtros(base: Dict = None, **ejes: Iterable) -> List[Dict]:
+    """Producto cartesiano de filtros para analizar_lote.
+
+    producto_filtros({'sexo': 'Mujer'}, programa_social=[...], ubicacion=[...])
+    → un dict por combinación, cada uno con los filtros base.
+    """
+    nombres = list(ejes)
+    return [dict(base or {}, **dict(zip(nombres, valores))) for valores in itertools.product(*ejes.values())]
+
+def _top_k(valores: np.ndarray, validos: np.ndarray, k: int) -> np.ndarray:
+    """Posiciones de los k mayores valores válidos, de mayor a menor (empates por posición).
+
+    Usa una partición parcial (O(n)) y solo ordena los k elegidos.
+    """
+    candidatos = np.flatnonzero(validos)
+    negativos = -valores[candidatos]
+    if len(candidatos) > k:
+        umbral = np.partition(negativos, k - 1)[k - 1]
+        dentro = negativos < umbral
+        empates = np.flatnonzero(negativos == umbral)[:k - int(dentro.sum())]
+        elegidos = np.concatenate([np.flatnonzero(dentro), empates])
+        candidatos, negativos = candidatos[elegidos], negativos[elegidos]
+    return candidatos[np.lexsort((candidatos, negativos))]
+
+def _conteo_observado(serie: pd.Series) -> pd.Series:
+    """value_counts sin las categorías que no aparecen en el subconjunto filtrado."""
+    conteo = serie.value_counts()
+    return conteo[conteo > 0]
+
+def _etiquetas_cruce(serie: pd.Series) -> pd.Series:
+    """Las banderas bool se muestran como 'yes'/'no' en las tablas cruzadas."""
+    if serie.dtype == bool:
+        return serie.map({True: 'yes', False: 'no'}).rename(serie.name)
+    return serie
+
+class _DatosIndexados:
+    """Censo + índices derivados. Se reemplaza completo en cada actualización."""
+    def __init__(self, df: pd.DataFrame, modo: str, ruta_particiones: str = None):
+        self.generacion = next(_GENERACIONES)
+        self.bitmap = None
+        self.cubo = None
+        self.sql = None
+        self.particiones = None
+        self.hogares = None
+        self.derivadas = None
+        if modo == "particionado":
+            # Out-of-core: no se retiene el df; el catálogo basta para resolver ubicaciones
+            self.df = None
+            self.particiones = CensoParticionado(ruta_particiones)
+            self.ubicacion = self.particiones.ubicacion
+            return
         self.df = df
+        self.ubicacion = IndiceUbicacion(df)
+        self.hogares = IndiceHogares(df)
+        self.derivadas = CaracteristicasDerivadas(df, list(CONSTANTES_MAPEO['CARENCIAS'].values()),
+                                                  list(CONSTANTES_MAPEO['PROGRAMAS'].values()))
+        if modo == "bitmap":
+            self.bitmap = IndiceBitmap(df, COLUMNAS_BANDERA, ['sexo_persona', 'parentesco_persona'],
+                                       list(CONSTANTES_MAPEO['CARENCIAS'].values()))
+        elif modo == "cubo":
+            self.cubo = CuboAgregado(df, list(CONSTANTES_MAPEO['CARENCIAS'].values()),
+                                     list(CONSTANTES_MAPEO['PROGRAMAS'].values()))
+        elif modo == "duckdb":
+            self.sql = ConsultasDuckDB(df, list(CONSTANTES_MAPEO['CARENCIAS'].values()))
+
+class _DatosConsulta:
+    """Modo particionado: cubo de las filas que pasaron los filtros de una consulta."""
+    def __init__(self, ubicacion: IndiceUbicacion, cubo: CuboAgregado, hogares_unicos: int):
+        self.generacion = None
+        self.df = None
+        self.ubicacion = ubicacion
+        self.bitmap = None
+        self.cubo = cubo
+        self.sql = None
+        self.particiones = None
+        self.hogares = None
+        self.derivadas = None
+        self.hogares_unicos = hogares_unicos
+
+class AnalizadorProgramasSociales:
+    MODOS = ("pandas", "bitmap", "cubo", "duckdb", "particionado")
+
+    def __init__(self, df: pd.DataFrame, modo: str = "pandas", cache: CacheFiltros = None,
+                 ruta_particiones: str = DIRECTORIO_PARTICIONES):
+        if modo not in self.MODOS:
+            raise ValueError(f"Modo de ejecución no soportado: {modo}")
+        self.modo = modo
+        self.ruta_particiones = ruta_particiones
+        self.cache = cache if cache is not None else CACHE_FILTROS
+        self._datos = _DatosIndexados(df, modo, ruta_particiones)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        return self._datos.df
+
+    @property
+    def ubicacion(self) -> IndiceUbicacion:
+        return self._datos.ubicacion
+
+    def actualizar_datos(self, df: pd.DataFrame):
+        """Reemplaza el censo en caliente: los índices se construyen antes de publicarse,
+        la asignación es atómica y cada consulta en curso conserva los datos con los que empezó."""
+        self._datos = _DatosIndexados(df, self.modo, self.ruta_particiones)
+        self.cache.invalidar()
+
+    def estadisticas_cache(self) -> Dict:
+        return self.cache.estadisticas()
+
+    @property
+    def filas_disponibles(self) -> bool:
+        """False en modo particionado: cada consulta agrega un cubo y no hay filas de personas,
+        así que los análisis por hogar y los rankings por zona no están disponibles."""
+        return self.modo != "particionado"
+
+    def _no_disponible(self, analisis: str) -> Dict:
+        return {"error": f"El análisis de {analisis} no está disponible con el censo en modo {self.modo}; "
+                         "usa conteo, elegibilidad, brechas, vulnerabilidad o tabla cruzada."}
+
+    def resolver_ubicacion(self, ubicacion: str, limite: int = None) -> Dict:
+        """Colonias/AGEBs que coinciden con una ubicación (para explicar el filtro al usuario)."""
+        return self._datos.ubicacion.resolver(ubicacion, limite)
+
+    # --------------------------------------------------
+    # SELECCIÓN: máscara bool (modo pandas), bitmap empaquetado (modo bitmap)
+    # máscara sobre las celdas del cubo (modo cubo), cláusula WHERE (modo duckdb)
+    # o expresión de escaneo de pyarrow (modo particionado)
+    # --------------------------------------------------
+
+    def _mascara_filtros(self, datos: _DatosIndexados, filtros: Dict) -> np.ndarray:
+        """Compone todos los filtros en una sola máscara booleana (sin copiar el df)."""
+        df = datos.df
+        mascara = np.ones(len(df), dtype=bool)
+
+        # 1. Geográfico: índice de colonias/AGEBs (sin acentos, por subcadena o aproximado)
+        ub = filtros.get('ubicacion')
+        if ub:
+            mascara &= datos.ubicacion.mascara(ub)
+
+        edad = filtros.get('rango_edad')
+        if edad and len(edad) == 2:
+            edades = df['edad_persona'].to_numpy()
+            mascara &= (edades >= edad[0]) & (edades <= edad[1])
+
+        sexo = filtros.get('sexo')
+        if sexo:
+            mascara &= (df['sexo_persona'] == sexo).to_numpy()
+
+        parentesco = filtros.get('parentesco')
+        if parentesco:
+            val_real = CONSTANTES_MAPEO['PARENTESCOS'].get(parentesco.lower(), parentesco)
+            mascara &= (df['parentesco_persona'] == val_real).to_numpy()
+
+        carencia = filtros.get('carencia_tipo')
+        if carencia:
+            col = CONSTANTES_MAPEO['CARENCIAS'].get(carencia)
+            if col:
+                mascara &= df[col].to_numpy(dtype=bool)
+
+        return mascara
+
+    def _bitmap_filtros(self, datos: _DatosIndexados, filtros: Dict) -> np.ndarray:
+        """Mismos filtros que _mascara_filtros como AND de bitmaps precalculados."""
+        bm = datos.bitmap
+        bits = bm.todos
+
+        ub = filtros.get('ubicacion')
+        if ub:
+            bits = bits & bm.empaquetar(datos.ubicacion.mascara(ub))
+
+        edad = filtros.get('rango_edad')
+        if edad and len(edad) == 2:
+            bits = bits & bm.rango_edad(edad[0], edad[1])
+
+        sexo = filtros.get('sexo')
+        if sexo:
+            bits = bits & bm.bitmap(('sexo_persona', sexo))
+
+        parentesco = filtros.get('parentesco')
+        if parentesco:
+            val_real = CONSTANTES_MAPEO['PARENTESCOS'].get(parentesco.lower(), parentesco)
+            bits = bits & bm.bitmap(('parentesco_persona', val_real))
+
+        carencia = filtros.get('carencia_tipo')
+        if carencia:
+            col = CONSTANTES_MAPEO['CARENCIAS'].get(carencia)
+            if col:
+                bits = bits & bm.bitmap(col)
+
+        return bits
 
-    def _aplicar_filtros(self, filtros: Dict) -> pd.DataFrame:
-            df_f = self.df.copy()
-
-            # 1. Geográfico (CORREGIDO PARA AGEBs)
-            ub = filtros.get('ubicacion')
-            if ub:
-                # Limpieza: quitamos "ageb", "colonia", etc. para dejar solo el nombre/número
-                ub_clean = ub.lower()\
-                    .replace('colonia', '')\
-                    .replace('pueblo', '')\
-                    .replace('barrio', '')\
-                    .replace('ageb', '')\
-                    .strip() # <--- ¡AGREGADO .replace('ageb', '')!
-                
-                term = ub_clean if len(ub_clean) > 0 else ub
-                
-                # Buscamos en ambas columnas convirtiendo a string
-                mascara = (
-                    df_f['colonia'].astype(str).str.contains(term, case=False, na=False) |
-                    df_f['ageb'].astype(str).str.contains(term, case=False, na=False)
-                )
-                df_f = df_f[mascara]
-
-            # ... resto de filtros (edad, sexo, etc.) igual ...
-            edad = filtros.get('rango_edad')
-            if edad and len(edad) == 2:
-                df_f = df_f[(df_f['edad_persona'] >= edad[0]) & (df_f['edad_persona'] <= edad[1])]
-
-            sexo = filtros.get('sexo')
-            if sexo:
-                df_f = df_f[df_f['sexo_persona'] == sexo]
-
-            parentesco = filtros.get('parentesco')
-            if parentesco:
-                val_real = CONSTANTES_MAPEO['PARENTESCOS'].get(parentesco.lower(), parentesco)
-                df_f = df_f[df_f['parentesco_persona'] == val_real]
-
-            carencia = filtros.get('carencia_tipo')
-            if carencia:
-                col = CONSTANTES_MAPEO['CARENCIAS'].get(carencia)
-                if col:
-                    df_f = df_f[df_f[col] == 'yes']
-
-            return df_f
+    def _cubo_filtros(self, datos: _DatosIndexados, filtros: Dict) -> np.ndarray:
+        """Mismos filtros que _mascara_filtros sobre las celdas del cubo."""
+        cubo = datos.cubo
+        seleccion = cubo.todos()
+
+        ub = filtros.get('ubicacion')
+        if ub:
+            codigos = datos.ubicacion.codigos(ub)
+            seleccion &= cubo.en_codigos('colonia', codigos['colonia']) | cubo.en_codigos('ageb', codigos['ageb'])
+
+        edad = filtros.get('rango_edad')
+        if edad and len(edad) == 2:
+            seleccion &= cubo.rango_edad(edad[0], edad[1])
+
+        sexo = filtros.get('sexo')
+        if sexo:
+            seleccion &= cubo.igual('sexo_persona', sexo)
+
+        parentesco = filtros.get('parentesco')
+        if parentesco:
+            val_real = CONSTANTES_MAPEO['PARENTESCOS'].get(parentesco.lower(), parentesco)
+            seleccion &= cubo.igual('parentesco_persona', val_real)
+
+        carencia = filtros.get('carencia_tipo')
+        if carencia:
+            col = CONSTANTES_MAPEO['CARENCIAS'].get(carencia)
+            if col:
+                seleccion &= cubo.bandera(col)
+
+        return seleccion
+
+    def _sql_filtros(self, datos: _DatosIndexados, filtros: Dict):
+        """Mismos filtros que _mascara_filtros como cláusula WHERE parametrizada."""
+        condiciones, params = [], []
+
+        ub = filtros.get('ubicacion')
+        if ub:
+            # El índice resuelve la ubicación; SQL solo compara nombres exactos
+            codigos = datos.ubicacion.codigos(ub)
+            partes = [ConsultasDuckDB.en_valores(col, list(datos.df[col].cat.categories[codigos[col]]))
+                      for col in ('colonia', 'ageb')]
+            condiciones.append(f"({partes[0][0]} OR {partes[1][0]})")
+            params += partes[0][1] + partes[1][1]
+
+        edad = filtros.get('rango_edad')
+        if edad and len(edad) == 2:
+            condiciones.append("edad_persona BETWEEN ? AND ?")
+            params += [float(edad[0]), float(edad[1])]
+
+        sexo = filtros.get('sexo')
+        if sexo:
+            condiciones.append("sexo_persona = ?")
+            params.append(sexo)
+
+        parentesco = filtros.get('parentesco')
+        if parentesco:
+            val_real = CONSTANTES_MAPEO['PARENTESCOS'].get(parentesco.lower(), parentesco)
+            condiciones.append("parentesco_persona = ?")
+            params.append(val_real)
+
+        carencia = filtros.get('carencia_tipo')
+        if carencia:
+            col = CONSTANTES_MAPEO['CARENCIAS'].get(carencia)
+            if col:
+                condiciones.append(f'"{col}"')
+
+        return ConsultasDuckDB.seleccion(condiciones, params)
+
+    def _particion_filtros(self, datos: _DatosIndexados, filtros: Dict):
+        """Mismos filtros que _mascara_filtros como expresión de pyarrow.dataset.
+
+        colonia es clave de partición y edad/sexo vienen ordenados dentro de cada
+        colonia: el escáner descarta directorios y row groups completos.
+        """
+        particiones = datos.particiones
+        condiciones = []
+
+        ub = filtros.get('ubicacion')
+        if ub:
+            codigos = datos.ubicacion.codigos(ub)
+            colonias = list(particiones.categorias['colonia'][codigos['colonia']])
+            agebs = list(particiones.categorias['ageb'][codigos['ageb']])
+            coincide = ds.field('colonia').isin(pa.array(colonias, pa.string())) | \
+                       ds.field('ageb').isin(pa.array(agebs, pa.string()))
+            # Las colonias que contienen esas AGEBs acotan las particiones a leer; la partición
+            # sin colonia (null) se lee siempre que haya AGEBs, pues sus filas también pueden coincidir
+            alcance = sorted(set(colonias) | set(particiones.colonias_con_agebs(agebs)))
+            particion = ds.field('colonia').isin(pa.array(alcance, pa.string()))
+            if agebs:
+                particion = particion | ds.field('colonia').is_null()
+            condiciones.append(particion & coincide)
+
+        edad = filtros.get('rango_edad')
+        if edad and len(edad) == 2:
+            # edad es entera (uint8): [a, b] equivale a [ceil(a), floor(b)] acotado a 0-255
+            minimo, maximo = max(int(np.ceil(edad[0])), 0), min(int(np.floor(edad[1])), 255)
+            if minimo > maximo:
+                condiciones.append(ds.scalar(False))
+            else:
+                condiciones.append((ds.field('edad_persona') >= pa.scalar(minimo, pa.uint8())) &
+                                   (ds.field('edad_persona') <= pa.scalar(maximo, pa.uint8())))
+
+        sexo = filtros.get('sexo')
+        if sexo:
+            condiciones.append(ds.field('sexo_persona') == sexo)
+
+        parentesco = filtros.get('parentesco')
+        if parentesco:
+            val_real = CONSTANTES_MAPEO['PARENTESCOS'].get(parentesco.lower(), parentesco)
+            condiciones.append(ds.field('parentesco_persona') == val_real)
+
+        carencia = filtros.get('carencia_tipo')
+        if carencia:
+            col = CONSTANTES_MAPEO['CARENCIAS'].get(carencia)
+            if col:
+                condiciones.append(ds.field(col) == True)
+
+        return functools.reduce(lambda a, b: a & b, condiciones) if condiciones else None
+
+    def _datos_consulta(self, filtros: Dict):
+        """Datos sobre los que corre un análisis: el censo indexado, o en modo
+        particionado el cubo de las filas que pasan los filtros (escaneo con pushdown)."""
+        datos = self._datos
+        if datos.particiones is None:
+            return datos
+        filtros = expandir_grupo_especial(filtros)
+        col_prog = CONSTANTES_MAPEO['PROGRAMAS'].get(filtros.get('programa_social'))
+        cubo, hogares = datos.particiones.agregar(self._particion_filtros(datos, filtros),
+                                                  list(CONSTANTES_MAPEO['CARENCIAS'].values()),
+                                                  [col_prog] if col_prog else [])
+        return _DatosConsulta(datos.ubicacion, cubo, hogares)
+
+    def _seleccion(self, datos: _DatosIndexados, filtros: Dict) -> np.ndarray:
+        """Selección de los filtros, compartida vía caché entre análisis y sesiones."""
+        if isinstance(datos, _DatosConsulta):
+            return datos.cubo.todos()  # el escaneo ya aplicó los filtros
+        filtros = expandir_grupo_especial(filtros)
+        if datos.sql is not None:
+            return self._sql_filtros(datos, filtros)
+        clave = (datos.generacion, self.modo, clave_filtros(filtros))
+        if datos.bitmap is not None:
+            return self.cache.obtener(clave, lambda: self._bitmap_filtros(datos, filtros), empaquetado=True)
+        if datos.cubo is not None:
+            return self.cache.obtener(clave, lambda: self._cubo_filtros(datos, filtros))
+        return self.cache.obtener(clave, lambda: self._mascara_filtros(datos, filtros))
+
+    def _filas(self, datos: _DatosIndexados, filtros: Dict) -> np.ndarray:
+        """Máscara de filas de personas (para lo que el cubo no agrega, como hogares distintos)."""
+        if datos.df is None:
+            raise ValueError(f"Análisis no disponible en modo {self.modo}")
+        filtros = expandir_grupo_especial(filtros)
+        clave = (datos.generacion, "filas", clave_filtros(filtros))
+        return self.cache.obtener(clave, lambda: self._mascara_filtros(datos, filtros))
+
+    def _predicado(self, datos: _DatosIndexados, clave) -> np.ndarray:
+        """Bandera ('es_elegible_...'), 'sin_apoyo' o (columna, valor) en la representación del modo."""
+        if datos.bitmap is not None:
+            return datos.bitmap.bitmap(clave)
+        return self._predicado_filas(datos, clave)
+
+    @staticmethod
+    def _predicado_filas(datos: _DatosIndexados, clave) -> np.ndarray:
+        """Máscara de personas de una bandera, 'sin_apoyo' o (columna, valor)."""
+        df = datos.df
+        if clave == 'sin_apoyo':
+            return datos.derivadas.sin_apoyo
+        if isinstance(clave, tuple):
+            col, valor = clave
+            return (df[col] == valor).to_numpy()
+        return df[clave].to_numpy(dtype=bool)
+
+    def _y(self, datos: _DatosIndexados, seleccion: np.ndarray, *claves) -> np.ndarray:
+        for clave in claves:
+            seleccion = seleccion & self._predicado(datos, clave)
+        return seleccion
+
+    def _contar(self, datos: _DatosIndexados, seleccion: np.ndarray, *claves) -> int:
+        if datos.cubo is not None:
+            return datos.cubo.contar(seleccion, *claves)
+        if datos.sql is not None:
+            return datos.sql.contar(seleccion, *claves)
+        seleccion = self._y(datos, seleccion, *claves)
+        if datos.bitmap is not None:
+            return datos.bitmap.contar(seleccion)
+        return int(np.count_nonzero(seleccion))
+
+    def _mascara(self, datos: _DatosIndexados, seleccion: np.ndarray, *claves) -> np.ndarray:
+        seleccion = self._y(datos, seleccion, *claves)
+        if datos.bitmap is not None:
+            return datos.bitmap.desempaquetar(seleccion)
+        return seleccion
+
+    def _distribucion(self, datos: _DatosIndexados, seleccion: np.ndarray, col: str, df_base: pd.DataFrame) -> pd.Series:
+        """value_counts de una categórica; en modo bitmap cada valor es un popcount
+        y en modo cubo una suma de celdas."""
+        if datos.cubo is not None:
+            conteo = datos.cubo.distribucion(seleccion, col)
+        elif datos.sql is not None:
+            categorias = datos.df[col].cat.categories
+            conteo = pd.Series(datos.sql.distribucion(seleccion, col), dtype=np.int64).reindex(categorias, fill_value=0).rename('count')
+        elif datos.bitmap is not None:
+            categorias = datos.df[col].cat.categories
+            conteo = pd.Series([self._contar(datos, seleccion, (col, v)) for v in categorias], index=categorias, name='count')
+        else:
+            return _conteo_observado(df_base[col])
+        conteo = conteo.sort_values(ascending=False)
+        return conteo[conteo > 0]
+
+    # --------------------------------------------------
 
     def analisis_general(self, filtros: Dict) -> Dict:
-        df_base = self._aplicar_filtros(filtros)
-        if df_base.empty: return {"aviso": "Sin datos para estos filtros."}
-        
-        top_geo = df_base['colonia'].value_counts().head(5).to_dict()
-        
+        datos = self._datos_consulta(filtros)
+        seleccion = self._seleccion(datos, filtros)
+        total = self._contar(datos, seleccion)
+        if total == 0: return {"aviso": "Sin datos para estos filtros."}
+
+        if datos.cubo is not None or datos.sql is not None:
+            if datos.sql is not None:
+                hogares, edad_promedio = datos.sql.hogares_unicos(seleccion), datos.sql.promedio_edad(seleccion)
+            elif isinstance(datos, _DatosConsulta):
+                hogares, edad_promedio = datos.hogares_unicos, datos.cubo.promedio_edad(seleccion)
+            else:
+                hogares = datos.hogares.contar(self._filas(datos, filtros))
+                edad_promedio = datos.cubo.promedio_edad(seleccion)
+            return {
+                "total_personas": total,
+                "hogares_unicos": hogares,
+                "edad_promedio": round(edad_promedio, 1),
+                "distribucion_sexo": self._distribucion(datos, seleccion, 'sexo_persona', None).to_dict(),
+                "top_5_colonias": self._distribucion(datos, seleccion, 'colonia', None).head(5).to_dict()
+            }
+
+        mascara = self._mascara(datos, seleccion)
+        df_base = datos.df.loc[mascara, ['colonia', 'edad_persona', 'sexo_persona']]
+        top_geo = _conteo_observado(df_base['colonia']).head(5).to_dict()
+
         return {
-            "total_personas": len(df_base),
-            "hogares_unicos": df_base['id_hogar'].nunique(),
+            "total_personas": total,
+            "hogares_unicos": datos.hogares.contar(mascara),
             "edad_promedio": round(df_base['edad_persona'].mean(), 1),
-            "distribucion_sexo": df_base['sexo_persona'].value_counts().to_dict(),
+            "distribucion_sexo": self._distribucion(datos, seleccion, 'sexo_persona', df_base).to_dict(),
             "top_5_colonias": top_geo
         }
 
     def analizar_elegibilidad(self, filtros: Dict) -> Dict:
         prog_key = filtros.get('programa_social')
         col_prog = CONSTANTES_MAPEO['PROGRAMAS'].get(prog_key)
-        
+
         if not col_prog: return {"error": f"Programa no encontrado: {prog_key}"}
 
-        df_base = self._aplicar_filtros(filtros)
-        df_elegibles = df_base[df_base[col_prog] == 'yes']
-        
+        datos = self._datos_consulta(filtros)
+        seleccion = self._seleccion(datos, filtros)
+        total = self._contar(datos, seleccion)
+        n_elegibles = self._contar(datos, seleccion, col_prog)
+        if not n_elegibles:
+            edad_promedio = 0
+        elif datos.cubo is not None:
+            edad_promedio = datos.cubo.promedio_edad(seleccion, col_prog)
+        elif datos.sql is not None:
+            edad_promedio = datos.sql.promedio_edad(seleccion, col_prog)
+        else:
+            edad_promedio = datos.df['edad_persona'].to_numpy()[self._mascara(datos, seleccion, col_prog)].mean()
+
+        return self._resultado_elegibilidad(prog_key, total, n_elegibles, edad_promedio,
+                                            self._contar(datos, seleccion, col_prog, ('sexo_persona', 'Mujer')))
+
+    @staticmethod
+    def _resultado_elegibilidad(prog_key: str, total: int, n_elegibles: int, edad_promedio: float, mujeres: int) -> Dict:
         return {
             "programa": prog_key,
-            "poblacion_objetivo": len(df_elegibles),
-            "tasa_elegibilidad": round((len(df_elegibles)/len(df_base)*100), 1) if len(df_base)>0 else 0,
+            "poblacion_objetivo": n_elegibles,
+            "tasa_elegibilidad": round((n_elegibles/total*100), 1) if total>0 else 0,
             "perfil_demografico": {
-                "edad_promedio": round(df_elegibles['edad_persona'].mean(), 1) if not df_elegibles.empty else 0,
-                "mujeres": int(df_elegibles[df_elegibles['sexo_persona'] == 'Mujer'].shape[0])
+                "edad_promedio": round(edad_promedio, 1) if n_elegibles else 0,
+                "mujeres": mujeres
             }
         }
 
     def analizar_brechas(self, filtros: Dict) -> Dict:
         prog_key = filtros.get('programa_social')
         col_prog = CONSTANTES_MAPEO['PROGRAMAS'].get(prog_key)
-        
-        df_base = self._aplicar_filtros(filtros)
-        df_elegibles = df_base[df_base[col_prog] == 'yes']
-        
+
+        if not col_prog: return {"error": f"Programa no encontrado: {prog_key}"}
+
+        datos = self._datos_consulta(filtros)
+        seleccion = self._seleccion(datos, filtros)
+
         # Brecha: Elegible + "No tiene" apoyo
-        df_brecha = df_elegibles[
-            (df_elegibles['recibe_apoyos_sociales'] == 'No tiene') | 
-            (df_elegibles['recibe_apoyos_sociales'].isna())
-        ]
-        
+        n_elegibles = self._contar(datos, seleccion, col_prog)
+        n_brecha = self._contar(datos, seleccion, col_prog, 'sin_apoyo')
+
+        return self._resultado_brechas(prog_key, n_elegibles, n_brecha)
+
+    @staticmethod
+    def _resultado_brechas(prog_key: str, n_elegibles: int, n_brecha: int) -> Dict:
         return {
             "analisis": "Brechas de Cobertura",
             "programa": prog_key,
-            "total_elegibles": len(df_elegibles),
-            "personas_sin_apoyo": len(df_brecha),
-            "porcentaje_brecha": round((len(df_brecha)/len(df_elegibles)*100), 1) if not df_elegibles.empty else 0
+            "total_elegibles": n_elegibles,
+            "personas_sin_apoyo": n_brecha,
+            "porcentaje_brecha": round((n_brecha/n_elegibles*100), 1) if n_elegibles else 0
         }
 
     def analizar_vulnerabilidad(self, filtros: Dict) -> Dict:
-        df_base = self._aplicar_filtros(filtros)
+        datos = self._datos_consulta(filtros)
+        seleccion = self._seleccion(datos, filtros)
         cols_carencias = list(CONSTANTES_MAPEO['CARENCIAS'].values())
-        
-        df_base['intensidad'] = (df_base[cols_carencias] == 'yes').sum(axis=1)
-        conteo = df_base['intensidad'].value_counts().sort_index().to_dict()
-        
+
+        if datos.bitmap is not None or datos.cubo is not None or datos.sql is not None:
+            frecuencias = [self._contar(datos, seleccion, ('intensidad', k)) for k in range(len(cols_carencias) + 1)]
+        else:
+            # Intensidad (0-3) precalculada en la carga: solo se cuentan las filas seleccionadas
+            frecuencias = np.bincount(datos.derivadas.intensidad[seleccion], minlength=len(cols_carencias) + 1)
+        conteo = {i: int(n) for i, n in enumerate(frecuencias) if n > 0}
+
         return {
             "analisis": "Intensidad de Vulnerabilidad",
             "distribucion_carencias (0 a 3)": conteo,
-            "total_personas": len(df_base)
+            "total_personas": self._contar(datos, seleccion)
         }
 
     def tabla_cruzada(self, filtros: Dict) -> Dict:
             var_fil = filtros.get('variable_fila')
             var_col = filtros.get('variable_columna')
-            
+
             col_real_fil = CONSTANTES_MAPEO['VARIABLES_CRUCE'].get(var_fil)
             col_real_col = CONSTANTES_MAPEO['VARIABLES_CRUCE'].get(var_col)
-            
+
             if not col_real_fil or not col_real_col:
                 return {"error": "Variables inválidas para cruce."}
-                
-            df_base = self._aplicar_filtros(filtros)
-            
-            # Agrupación segura para edad
-            if col_real_fil == 'edad_persona':
-                df_base['edad_cat'] = pd.cut(df_base['edad_persona'], bins=[0,12,18,30,60,120], labels=['0-12','13-18','19-30','31-60','60+'])
-                col_real_fil = 'edad_cat'
-            if col_real_col == 'edad_persona':
-                df_base['edad_cat'] = pd.cut(df_base['edad_persona'], bins=[0,12,18,30,60,120], labels=['0-12','13-18','19-30','31-60','60+'])
-                col_real_col = 'edad_cat'
+
+            columnas = list(dict.fromkeys([col_real_fil, col_real_col]))
+            datos = self._datos_consulta(filtros)
+            if datos.cubo is not None:
+                # Celdas con su peso: el cruce suma personas en vez de contar filas
+                df_base = datos.cubo.celdas(self._seleccion(datos, filtros), columnas)
+                pesos = {"values": df_base['n'], "aggfunc": "sum"}
+            elif datos.sql is not None:
+                # GROUP BY en DuckDB; se restauran los tipos del df para ordenar igual que pandas
+                df_base = datos.sql.celdas(self._seleccion(datos, filtros), columnas)
+                df_base = df_base.astype({c: datos.df[c].dtype for c in columnas})
+                pesos = {"values": df_base['n'], "aggfunc": "sum"}
+            else:
+                mascara = self._mascara(datos, self._seleccion(datos, filtros))
+                df_base = datos.df.loc[mascara, columnas]
+                pesos = {}
+
+            # Rango de edad: códigos precalculados por persona, o de la edad de cada celda
+            def _serie_cruce(col):
+                if col == 'edad_persona':
+                    if pesos:
+                        codigos = CaracteristicasDerivadas.codigos_edad(df_base['edad_persona'].to_numpy())
+                    else:
+                        codigos = datos.derivadas.edad_cat[mascara]
+                    return CaracteristicasDerivadas.rango_edad(codigos, df_base.index)
+                return df_base[col]
 
             try:
                 # 1. CALCULAMOS con los nombres reales (Seguridad ante todo)
-                crosstab = pd.crosstab(df_base[col_real_fil], df_base[col_real_col], margins=True, margins_name="TOTAL")
-                
+                crosstab = pd.crosstab(_etiquetas_cruce(_serie_cruce(col_real_fil)), _etiquetas_cruce(_serie_cruce(col_real_col)), margins=True, margins_name="TOTAL", **pesos)
+                if pesos and not crosstab.empty:
+                    # Como en el conteo por filas: solo las categorías observadas
+                    crosstab = crosstab.fillna(0).astype(int)
+                    crosstab = crosstab.loc[crosstab["TOTAL"] > 0, crosstab.loc["TOTAL"] > 0]
+
                 # 2. EMBELLECEMOS los nombres solo para la visualización
                 mapa_visual = {
                     'presencia_carencia_salud_persona': 'Salud',
@@ -152,21 +607,302 @@ class AnalizadorProgramasSociales:
                     'parentesco_persona': 'Parentesco',
                     'edad_cat': 'Rango Edad'
                 }
-                
+
                 # Renombrar índice y columnas del resultado si existen en el mapa
                 if crosstab.index.name in mapa_visual:
                     crosstab.index.name = mapa_visual[crosstab.index.name]
-                
+
                 if crosstab.columns.name in mapa_visual:
                     crosstab.columns.name = mapa_visual[crosstab.columns.name]
 
                 # 3. RENDERIZADO
                 tabla_md = crosstab.to_markdown(tablefmt="pipe")
-                
+
                 return {
                     "analisis": f"Cruce {var_fil} vs {var_col}",
                     "tabla_visual": tabla_md,
                     "datos_json": crosstab.to_dict()
                 }
             except Exception as e:
-                return {"error": f"Error generando tabla: {str(e)}"}
\ No newline at end of file
+                return {"error": f"Error generando tabla: {str(e)}"}
+
+    # --------------------------------------------------
+    # HOGARES: reducciones por hogar sobre los desplazamientos CSR
+    # --------------------------------------------------
+
+    CUANTIFICADORES_HOGAR = ("al_menos", "todos")
+
+    def analizar_hogares(self, filtros: Dict) -> Dict:
+        """Hogares cuyos miembros cumplen los filtros (p. ej. al menos un adulto mayor elegible sin apoyo).
+
+        Un miembro cumple si pasa los filtros de persona y, si se piden, es elegible
+        a programa_social y no recibe apoyo (sin_apoyo). El hogar cumple si lo hacen
+        al menos min_miembros de sus miembros, o todos con cuantificador='todos'.
+        """
+        if not self.filas_disponibles: return self._no_disponible("hogares")
+        cuantificador = filtros.get('cuantificador') or 'al_menos'
+        if cuantificador not in self.CUANTIFICADORES_HOGAR: return {"error": f"Cuantificador inválido: {cuantificador}"}
+
+        prog_key = filtros.get('programa_social')
+        col_prog = CONSTANTES_MAPEO['PROGRAMAS'].get(prog_key)
+        if prog_key and not col_prog: return {"error": f"Programa no encontrado: {prog_key}"}
+        try:
+            minimo = max(int(filtros.get('min_miembros') or 1), 1)
+        except (TypeError, ValueError):
+            minimo = 1
+
+        datos = self._datos
+        miembros = self._filas(datos, filtros)
+        if col_prog and filtros.get('sin_apoyo'):
+            miembros = miembros & datos.derivadas.elegible_sin_apoyo[col_prog]
+        elif col_prog or filtros.get('sin_apoyo'):
+            miembros = miembros & self._predicado_filas(datos, col_prog or 'sin_apoyo')
+
+        hogares = datos.hogares
+        if filtros.get('ubicacion'):
+            universo = hogares.algun(self._filas(datos, {'ubicacion': filtros['ubicacion']}))
+        else:
+            universo = np.ones(hogares.n_hogares, dtype=bool)
+        total = int(np.count_nonzero(universo))
+        if total == 0: return {"aviso": "Sin datos para estos filtros."}
+
+        cuenta = hogares.miembros(miembros)
+        cumplen = hogares.todos(miembros) if cuantificador == 'todos' else cuenta >= minimo
+        n = int(np.count_nonzero(cumplen))
+        por_miembros = np.bincount(np.minimum(cuenta[cumplen], 3), minlength=4)
+
+        return {
+            "analisis": "Hogares",
+            "criterio": "todos los miembros cumplen" if cuantificador == 'todos' else f"al menos {minimo} miembro(s) cumplen",
+            "hogares_total": total,
+            "hogares_que_cumplen": n,
+            "porcentaje_hogares": round(n / total * 100, 1),
+            "personas_en_esos_hogares": int(hogares.tamano[cumplen].sum()),
+            "miembros_que_cumplen": int(cuenta[cumplen].sum()),
+            "tamano_promedio_hogar": round(float(hogares.tamano[cumplen].mean()), 1) if n else 0,
+            "hogares_por_miembros_que_cumplen": {"1": int(por_miembros[1]), "2": int(por_miembros[2]), "3+": int(por_miembros[3])}
+        }
+
+    def analizar_vulnerabilidad_hogares(self, filtros: Dict) -> Dict:
+        """Carencias acumuladas por hogar (un hogar tiene la carencia si algún miembro la tiene),
+        sobre los hogares con al menos un miembro que pasa los filtros."""
+        if not self.filas_disponibles: return self._no_disponible("vulnerabilidad por hogar")
+        datos = self._datos
+        seleccion = self._filas(datos, filtros)
+        hogares = datos.hogares
+        en_alcance = hogares.algun(seleccion)
+        total = int(np.count_nonzero(en_alcance))
+        if total == 0: return {"aviso": "Sin datos para estos filtros."}
+
+        cols_carencias = list(CONSTANTES_MAPEO['CARENCIAS'].values())
+        carencias = sum(hogares.algun(datos.df[c].to_numpy(dtype=bool)).astype(np.uint8) for c in cols_carencias)[en_alcance]
+        frecuencias = np.bincount(carencias, minlength=len(cols_carencias) + 1)
+        sin_apoyo = hogares.todos(datos.derivadas.sin_apoyo)[en_alcance]
+        sin_programa = ~hogares.algun(datos.derivadas.n_programas > 0)[en_alcance]
+
+        return {
+            "analisis": "Vulnerabilidad por Hogar",
+            "distribucion_hogares_por_carencias (0 a 3)": {i: int(n) for i, n in enumerate(frecuencias) if n > 0},
+            "hogares_con_todas_las_carencias": int(frecuencias[-1]),
+            "hogares_sin_ningun_apoyo": int(np.count_nonzero(sin_apoyo)),
+            "hogares_con_carencias_sin_apoyo": int(np.count_nonzero(sin_apoyo & (carencias > 0))),
+            "hogares_con_carencias_sin_programa_elegible": int(np.count_nonzero(sin_programa & (carencias > 0))),
+            "total_hogares": total,
+            "personas_en_esos_hogares": int(hogares.tamano[en_alcance].sum())
+        }
+
+    # --------------------------------------------------
+    # RANKINGS TERRITORIALES: todas las colonias/AGEBs en una pasada + top-k
+    # --------------------------------------------------
+
+    NIVELES_TERRITORIALES = ("colonia", "ageb")
+    TOP_K_DEFECTO = 10
+    TOP_K_MAXIMO = 50
+
+    def _parametros_ranking(self, filtros: Dict):
+        nivel = filtros.get('nivel_territorial') or 'colonia'
+        try:
+            k = int(filtros.get('top_k') or self.TOP_K_DEFECTO)
+        except (TypeError, ValueError):
+            k = self.TOP_K_DEFECTO
+        return nivel, min(max(k, 1), self.TOP_K_MAXIMO)
+
+    @staticmethod
+    def _tabla_ranking(filas: List[Dict]) -> str:
+        return pd.DataFrame(filas).to_markdown(index=False, tablefmt="pipe") if filas else ""
+
+    def ranking_brechas(self, filtros: Dict) -> Dict:
+        if not self.filas_disponibles: return self._no_disponible("ranking de brechas")
+        prog_key = filtros.get('programa_social')
+        col_prog = CONSTANTES_MAPEO['PROGRAMAS'].get(prog_key)
+
+        if not col_prog: return {"error": f"Programa no encontrado: {prog_key}"}
+
+        nivel, k = self._parametros_ranking(filtros)
+        if nivel not in self.NIVELES_TERRITORIALES: return {"error": f"Nivel territorial inválido: {nivel}"}
+
+        datos = self._datos
+        tabla = self._agregados_por_zona(datos, self._filas(datos, filtros), nivel, [col_prog], "brechas")
+        elegibles, sin_apoyo = tabla[col_prog], tabla[(col_prog, 'sin_apoyo')]
+        porcentaje = np.divide(sin_apoyo * 100, elegibles, out=np.zeros(len(elegibles)), where=elegibles > 0)
+
+        criterio = filtros.get('ordenar_por')
+        if criterio not in ('personas_sin_apoyo', 'porcentaje_brecha'):
+            criterio = 'personas_sin_apoyo'
+        validos = elegibles > 0
+        validos[0] = False  # filas sin colonia/AGEB
+        orden = _top_k(sin_apoyo if criterio == 'personas_sin_apoyo' else porcentaje, validos, k)
+
+        nombres = datos.df[nivel].cat.categories
+        ranking = [{
+            nivel: str(nombres[z - 1]),
+            "total_elegibles": int(elegibles[z]),
+            "personas_sin_apoyo": int(sin_apoyo[z]),
+            "porcentaje_brecha": round(float(porcentaje[z]), 1)
+        } for z in orden]
+
+        return {
+            "analisis": f"Ranking de Brechas por {nivel}",
+            "programa": prog_key,
+            "criterio": criterio,
+            "zonas_evaluadas": int(validos.sum()),
+            "ranking": ranking,
+            "tabla_visual": self._tabla_ranking(ranking)
+        }
+
+    def ranking_vulnerabilidad(self, filtros: Dict) -> Dict:
+        if not self.filas_disponibles: return self._no_disponible("ranking de vulnerabilidad")
+        nivel, k = self._parametros_ranking(filtros)
+        if nivel not in self.NIVELES_TERRITORIALES: return {"error": f"Nivel territorial inválido: {nivel}"}
+
+        datos = self._datos
+        df = datos.df
+        mascara = self._filas(datos, filtros)
+        cols_carencias = list(CONSTANTES_MAPEO['CARENCIAS'].values())
+
+        # Intensidad (0-3) por persona seleccionada, agregada por zona con bincount
+        zona = df[nivel].cat.codes.to_numpy()[mascara] + 1
+        n_zonas = len(df[nivel].cat.categories) + 1
+        intensidad = datos.derivadas.intensidad[mascara]
+        personas = np.bincount(zona, minlength=n_zonas)
+        suma = np.bincount(zona, weights=intensidad, minlength=n_zonas)
+        con_carencias = np.bincount(zona, weights=intensidad > 0, minlength=n_zonas)
+        carencia_maxima = np.bincount(zona, weights=intensidad == len(cols_carencias), minlength=n_zonas)
+        promedio = np.divide(suma, personas, out=np.zeros(n_zonas), where=personas > 0)
+
+        criterio = filtros.get('ordenar_por')
+        if criterio not in ('intensidad_promedio', 'personas_con_carencias'):
+            criterio = 'intensidad_promedio'
+        validos = personas > 0
+        validos[0] = False
+        orden = _top_k(promedio if criterio == 'intensidad_promedio' else con_carencias, validos, k)
+
+        nombres = df[nivel].cat.categories
+        ranking = [{
+            nivel: str(nombres[z - 1]),
+            "total_personas": int(personas[z]),
+            "intensidad_promedio (0 a 3)": round(float(promedio[z]), 2),
+            "personas_con_carencias": int(con_carencias[z]),
+            "personas_con_3_carencias": int(carencia_maxima[z])
+        } for z in orden]
+
+        return {
+            "analisis": f"Ranking de Vulnerabilidad por {nivel}",
+            "criterio": criterio,
+            "zonas_evaluadas": int(validos.sum()),
+            "ranking": ranking,
+            "tabla_visual": self._tabla_ranking(ranking)
+        }
+
+    # --------------------------------------------------
+    # LOTES: muchas consultas de elegibilidad/brechas en una sola pasada
+    # --------------------------------------------------
+
+    INTENCIONES_LOTE = ("elegibilidad", "brechas")
+    # Modos en que cada análisis paga su propia selección (cubo, SQL): ahí el lote compensa
+    # desde pocas consultas; con máscaras en caché (pandas, bitmap) cada análisis es más barato
+    MODOS_LOTE = ("cubo", "duckdb")
+
+    def analizar_lote(self, consultas: List[Dict], intencion: str = "elegibilidad") -> List[Dict]:
+        """Resultados de analizar_elegibilidad/analizar_brechas para muchas consultas a la vez.
+
+        Las consultas que solo difieren en programa_social y ubicacion comparten una
+        pasada: se seleccionan los demás filtros una vez y se agregan todas las
+        medidas por colonia (o AGEB) con bincount; cada consulta suma las zonas
+        que coinciden con su ubicación. Devuelve los dicts en el orden de entrada.
+        """
+        if intencion not in self.INTENCIONES_LOTE:
+            raise ValueError(f"Intención no soportada en lote: {intencion}")
+        analisis = self.analizar_elegibilidad if intencion == "elegibilidad" else self.analizar_brechas
+        if not self.filas_disponibles:
+            # Sin filas no hay agregados por zona: cada consulta hace su propio escaneo con pushdown
+            return [analisis(filtros) for filtros in consultas]
+        datos = self._datos
+        resultados: List[Dict] = [None] * len(consultas)
+
+        grupos = {}
+        for i, filtros in enumerate(consultas):
+            filtros = expandir_grupo_especial(filtros)
+            prog_key = filtros.get('programa_social')
+            col_prog = CONSTANTES_MAPEO['PROGRAMAS'].get(prog_key)
+            if not col_prog:
+                resultados[i] = {"error": f"Programa no encontrado: {prog_key}"}
+                continue
+            resto = {k: v for k, v in filtros.items() if k != 'ubicacion'}
+            grupos.setdefault(clave_filtros(resto), (resto, []))[1].append((i, filtros, col_prog))
+
+        for resto, items in grupos.values():
+            programas = list(dict.fromkeys(col_prog for _, _, col_prog in items))
+            tablas, zonas_por_ubicacion = {}, {}
+            for i, filtros, col_prog in items:
+                if filtros.get('ubicacion'):
+                    ub = filtros['ubicacion']
+                    if ub not in zonas_por_ubicacion:
+                        zonas_por_ubicacion[ub] = datos.ubicacion.codigos(ub)
+                    codigos = zonas_por_ubicacion[ub]
+                    if len(codigos['colonia']) and len(codigos['ageb']):
+                        # Coincide por colonia y por AGEB: sumar zonas contaría doble
+                        resultados[i] = analisis(filtros)
+                        continue
+                    tipo = 'ageb' if len(codigos['ageb']) else 'colonia'
+                    zonas = codigos[tipo] + 1
+                else:
+                    tipo, zonas = 'colonia', slice(None)
+
+                if tipo not in tablas:
+                    tablas[tipo] = self._agregados_por_zona(datos, self._filas(datos, resto), tipo, programas, intencion)
+                tabla = tablas[tipo]
+                suma = lambda medida: int(tabla[medida][zonas].sum())
+
+                if intencion == "elegibilidad":
+                    n_elegibles = suma(col_prog)
+                    edad_promedio = np.float64(suma((col_prog, 'edad'))) / n_elegibles if n_elegibles else 0
+                    resultados[i] = self._resultado_elegibilidad(filtros['programa_social'], suma('n'), n_elegibles,
+                                                                 edad_promedio, suma((col_prog, 'mujeres')))
+                else:
+                    resultados[i] = self._resultado_brechas(filtros['programa_social'], suma(col_prog),
+                                                            suma((col_prog, 'sin_apoyo')))
+        return resultados
+
+    @staticmethod
+    def _agregados_por_zona(datos: _DatosIndexados, mascara: np.ndarray, tipo: str, programas: List[str],
+                            intencion: str) -> Dict:
+        """Medidas por código de zona (+1; la posición 0 son las filas sin zona)."""
+        df = datos.df
+        zona = df[tipo].cat.codes.to_numpy()[mascara] + 1
+        n_zonas = len(df[tipo].cat.categories) + 1
+        if intencion != "brechas":
+            mujer = (df['sexo_persona'] == 'Mujer').to_numpy()[mascara]
+            edad = df['edad_persona'].to_numpy()[mascara]
+
+        tabla = {'n': np.bincount(zona, minlength=n_zonas)}
+        for col in programas:
+            elegible = df[col].to_numpy(dtype=bool)[mascara]
+            tabla[col] = np.bincount(zona, weights=elegible, minlength=n_zonas)
+            if intencion == "brechas":
+                tabla[(col, 'sin_apoyo')] = np.bincount(zona, weights=datos.derivadas.elegible_sin_apoyo[col][mascara],
+                                                        minlength=n_zonas)
+            else:
+                tabla[(col, 'mujeres')] = np.bincount(zona, weights=elegible & mujer, minlength=n_zonas)
+                tabla[(col, 'edad')] = np.bincount(zona, weights=np.where(elegible, edad, 0), minlength=n_zonas)
+        return tabla
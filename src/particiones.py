@@ -0,0 +1,134 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from typing import Dict, List
+from .indices import IndiceUbicacion, CuboAgregado
+
+# Directorios hive: <raíz>/alcaldia=<nombre>/colonia=<nombre>/parte-N.parquet
+PARTICIONADO = ds.partitioning(pa.schema([("alcaldia", pa.string()), ("colonia", pa.string())]), flavor="hive")
+CATALOGO = "_catalogo.json"  # el prefijo '_' lo excluye del dataset
+COLUMNAS_CATALOGO = ["colonia", "ageb", "sexo_persona", "parentesco_persona", "recibe_apoyos_sociales"]
+
+
+def _leer_catalogo(directorio: str) -> Dict:
+    try:
+        with open(os.path.join(directorio, CATALOGO), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"zonas": [], "categorias": {}}
+
+
+def escribir_particiones(df: pd.DataFrame, directorio: str, alcaldia: str, filas_por_grupo: int = 1 << 16):
+    """Escribe el censo de una alcaldía como Parquet particionado por alcaldía y colonia.
+
+    Dentro de cada colonia las filas van ordenadas por sexo y edad, así las
+    estadísticas min/max de cada row group permiten descartarlo sin leerlo.
+    Reemplaza solo los archivos de esa alcaldía y actualiza el catálogo
+    (zonas y categorías) que comparten todas.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    if os.listdir(directorio):
+        previo = ds.dataset(directorio, format="parquet", partitioning=PARTICIONADO)
+        for fragmento in previo.get_fragments(filter=ds.field("alcaldia") == alcaldia):
+            os.remove(fragmento.path)
+
+    ordenado = df.sort_values(["colonia", "sexo_persona", "edad_persona"], kind="stable")
+    tabla = pa.Table.from_pandas(ordenado.assign(alcaldia=alcaldia), preserve_index=False)
+    # Texto plano en disco: cada lector lo recodifica con las categorías del catálogo
+    tabla = tabla.cast(pa.schema([pa.field(f.name, f.type.value_type) if pa.types.is_dictionary(f.type) else f
+                                  for f in tabla.schema]))
+
+    ds.write_dataset(
+        tabla, directorio, format="parquet", partitioning=PARTICIONADO,
+        basename_template="parte-{i}.parquet", existing_data_behavior="overwrite_or_ignore",
+        max_rows_per_group=filas_por_grupo, min_rows_per_group=min(filas_por_grupo, 1 << 14),
+        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd")
+    )
+
+    catalogo = _leer_catalogo(directorio)
+    # Las zonas sin colonia se conservan (colonia null): sus AGEBs también se filtran por ubicación
+    zonas = df[["colonia", "ageb"]].drop_duplicates().astype(object)
+    zonas = zonas.where(zonas.notna(), None)
+    catalogo["zonas"] = [z for z in catalogo["zonas"] if z[0] != alcaldia] + \
+                        [[alcaldia, c, a] for c, a in zonas.itertuples(index=False) if c is not None or a is not None]
+    for col in COLUMNAS_CATALOGO:
+        valores = set(catalogo["categorias"].get(col, [])) | set(df[col].dropna().astype(str))
+        catalogo["categorias"][col] = sorted(valores)
+
+    tmp = os.path.join(directorio, f"{CATALOGO}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(catalogo, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(directorio, CATALOGO))
+
+
+class CensoParticionado:
+    """Censo en Parquet particionado, consultado sin cargarlo en memoria.
+
+    Los filtros se pasan como expresión al escáner de pyarrow: las particiones
+    (alcaldía/colonia) y los row groups cuyas estadísticas no pueden cumplirla
+    no se leen. Los lotes que sí pasan se agregan uno a uno en celdas de un
+    CuboAgregado, de modo que la memoria depende del resultado y no del censo.
+    """
+
+    FILAS_POR_LOTE = 1 << 16
+    MAX_CELDAS_PENDIENTES = 1 << 18  # compactar las agregaciones parciales al pasar este tamaño
+
+    def __init__(self, directorio: str):
+        catalogo = _leer_catalogo(directorio)
+        if not catalogo["zonas"]:
+            raise FileNotFoundError(f"❌ No hay censo particionado en {directorio}")
+        self.directorio = directorio
+        self.dataset = ds.dataset(directorio, format="parquet", partitioning=PARTICIONADO)
+        self.categorias = {col: pd.Index(valores) for col, valores in catalogo["categorias"].items()}
+
+        # Índice de ubicación sobre las zonas del catálogo (una fila por colonia/AGEB)
+        zonas = pd.DataFrame(catalogo["zonas"], columns=["alcaldia", "colonia", "ageb"])
+        self.zonas = zonas
+        self.ubicacion = IndiceUbicacion(pd.DataFrame({
+            col: pd.Categorical(zonas[col], categories=self.categorias[col]) for col in IndiceUbicacion.COLUMNAS
+        }))
+        self.ultimo_escaneo: Dict[str, int] = {}
+
+    def colonias_con_agebs(self, agebs: List[str]) -> List[str]:
+        return sorted(self.zonas.loc[self.zonas["ageb"].isin(agebs), "colonia"].dropna().unique())
+
+    def _a_pandas(self, lote) -> pd.DataFrame:
+        df = lote.to_pandas()
+        for col in df.columns.intersection(list(self.categorias)):
+            df[col] = pd.Categorical(df[col], categories=self.categorias[col])
+        return df
+
+    def agregar(self, filtro, carencias: List[str], programas: List[str]):
+        """(CuboAgregado de las filas que cumplen el filtro, hogares distintos)."""
+        columnas = ["id_hogar", *CuboAgregado.CATEGORICAS, "edad_persona", *carencias, "recibe_apoyos_sociales", *programas]
+        escaner = self.dataset.scanner(columns=columnas, filter=filtro, batch_size=self.FILAS_POR_LOTE)
+
+        partes, hogares, pendientes = [], [], 0
+        limite = self.MAX_CELDAS_PENDIENTES
+        filas = lotes = 0
+        for lote in escaner.to_batches():
+            if lote.num_rows == 0:
+                continue
+            df = self._a_pandas(lote)
+            partes.append(CuboAgregado.agrupar(df, carencias, programas, self.categorias))
+            hogares.append(np.unique(df["id_hogar"].to_numpy()))
+            pendientes += len(partes[-1])
+            filas += lote.num_rows
+            lotes += 1
+            if pendientes > limite:
+                partes = [CuboAgregado.combinar(partes, carencias)]
+                hogares = [np.unique(np.concatenate(hogares))]
+                pendientes = len(partes[0])
+                # Si el resultado compactado ya es grande, se espera a duplicarlo (costo amortizado)
+                limite = max(self.MAX_CELDAS_PENDIENTES, 2 * pendientes)
+
+        if not partes:
+            vacio = self._a_pandas(self.dataset.schema.empty_table().select(columnas))
+            partes = [CuboAgregado.agrupar(vacio, carencias, programas, self.categorias)]
+        n_hogares = len(np.unique(np.concatenate(hogares))) if hogares else 0
+
+        self.ultimo_escaneo = {"filas": filas, "lotes": lotes}
+        return CuboAgregado.desde_celdas(CuboAgregado.combinar(partes, carencias), self.categorias, carencias), n_hogares
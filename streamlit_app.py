@@ -5,12 +5,13 @@ Diseñado para desplegar hoy mismo a personal de la alcaldía
 
 import streamlit as st
 import pandas as pd
+import itertools
 from datetime import datetime, timedelta
 import hashlib
 import json
 import os
 from pathlib import Path
-from src.agent import AgenteAnaliticoLLM
+from src.agente_async import AgenteAnaliticoAsync, NucleoAnaliticoAsync
 from src.data_loader import DataIntegrator
 
 
@@ -356,26 +357,57 @@ def main():
                     f"⚠️ **Límite alcanzado**\n\n"
                     f"Próximas consultas disponibles mañana a las 00:00"
                 )
+
+            # Las narrativas se reutilizan si el resultado es idéntico a uno ya narrado
+            regenerar = st.checkbox("🔁 Regenerar narrativa (ignorar caché)", value=False)
             
             st.markdown("---")
             if st.button("🚪 Cerrar Sesión", use_container_width=True):
                 st.session_state.autenticado = False
                 st.session_state.email_usuario = None
+                st.session_state.pop("agente", None)  # la conversación y la fila son del usuario que sale
                 st.rerun()
-        
+
         # CONTENIDO PRINCIPAL
         st.title("🏛️ PAPE V3 - Análisis AI de datos del Censo")
         st.markdown(f"*Alcaldía Álvaro Obregón | Usuario: {st.session_state.nombre_usuario}*")
         
         # Cargar agente
         @st.cache_resource
-        def cargar_agente():
-            integrador = DataIntegrator()
-            df = integrador.cargar_y_unir_datasets()          
+        def cargar_integrador():
+            return DataIntegrator()
+
+        @st.cache_resource
+        def cargar_nucleo():
+            """Motor, cliente del LLM, cachés y cola de turnos: uno por proceso, compartido por todos los usuarios"""
+            df = cargar_integrador().cargar_y_unir_datasets()
             api_key = st.secrets["DEEPSEEK_API_KEY"]
-            return AgenteAnaliticoLLM(df, api_key)
+            return NucleoAnaliticoAsync(df, api_key)
         
-        agente = cargar_agente()
+        # Cada usuario conversa con su propio historial sobre el núcleo compartido; su correo es su fila en la cola
+        if "agente" not in st.session_state:
+            st.session_state.agente = AgenteAnaliticoAsync(cargar_nucleo(), usuario=st.session_state.email_usuario)
+        agente = st.session_state.agente
+
+        # Refresco incremental del censo (solo admin): sin reiniciar la app
+        if st.session_state.rol_usuario == "administrador":
+            with st.sidebar:
+                if st.button("🔄 Actualizar datos del censo", use_container_width=True):
+                    with st.spinner("Buscando correcciones en las fuentes..."):
+                        df_nuevo, cambiadas = cargar_integrador().refrescar(agente.motor.df)
+                    if cambiadas:
+                        agente.motor.actualizar_datos(df_nuevo)
+                        st.success(f"✅ Datos actualizados: {', '.join(cambiadas)}")
+                    else:
+                        st.info("Sin cambios en las fuentes.")
+                stats = agente.estadisticas_cache()
+                st.caption(f"🧠 Caché de intenciones: {stats['intenciones']['entradas']} preguntas, "
+                           f"{stats['intenciones']['tasa_aciertos']}% de aciertos en este proceso")
+                st.caption(f"⚡ Intérprete local: {stats['interprete_local']['tasa_local']}% de las preguntas sin LLM")
+                cola = stats['cola_llm']
+                st.caption(f"🚦 LLM: {cola['activas']}/{cola['capacidad']} llamadas activas, {cola['en_espera']} en espera "
+                           f"(máx. {cola['max_en_espera']}), espera p95 {cola['espera_p95_s']} s, "
+                           f"{cola['rechazadas'] + cola['expiradas']} rechazadas")
         
         # Si no puede consultar
         if not uso['puede_consultar']:
@@ -400,10 +432,13 @@ def main():
             with st.chat_message("user"):
                 st.markdown(consulta)
             
-            # Procesar
-            with st.spinner("🔍 Analizando..."):
+            # Procesar y mostrar respuesta: la tabla sale al terminar el motor y la narrativa se transmite
+            with st.chat_message("assistant"):
                 try:
-                    respuesta = agente.procesar(consulta)
+                    flujo = agente.procesar_stream(consulta, regenerar_narrativa=regenerar)
+                    with st.spinner("🔍 Analizando..."):
+                        primero = next(flujo, "")
+                    respuesta = st.write_stream(itertools.chain([primero], flujo))
                     
                     # Registrar en rate limiting
                     gestor_limites.registrar_consulta(
@@ -421,10 +456,7 @@ def main():
                 
                 except Exception as e:
                     respuesta = f"❌ Error: {str(e)}"
-            
-            # Mostrar respuesta
-            with st.chat_message("assistant"):
-                st.markdown(respuesta)
+                    st.markdown(respuesta)
             
             # Actualizar contador en tiempo real
             st.rerun()
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Cachés en disco fuera del repo (config las lee al importarse)
+os.environ.setdefault("PAPE_CACHE_DIR", tempfile.mkdtemp(prefix="pape-cache-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import COLUMNAS_BANDERA, CONSTANTES_MAPEO  # noqa: E402
+
+COLONIAS = ["Olivar del Conde 1a Sección", "San Ángel", "Santa Fe", "Tizapán"]
+AGEB_SIN_COLONIA = "0102-3"  # la mitad de sus personas no trae colonia
+
+
+@pytest.fixture(scope="session")
+def censo() -> pd.DataFrame:
+    """Censo sintético con el esquema del df unificado (DataIntegrator)."""
+    rng = np.random.default_rng(7)
+    n = 1200
+    zona = rng.integers(0, len(COLONIAS) * 3, n)
+    colonia = np.array(COLONIAS, dtype=object)[zona // 3]
+    ageb = np.array([f"01{z // 3:02d}-{z % 3}" for z in zona], dtype=object)
+    ageb[:40] = AGEB_SIN_COLONIA
+    colonia[:40:2] = None
+
+    df = pd.DataFrame({
+        "id_hogar": (np.arange(n) // 3).astype(np.int16),
+        "id_persona": (np.arange(n) % 3 + 1).astype(np.int16),
+        "edad_persona": rng.integers(0, 95, n).astype(np.uint8),
+        "sexo_persona": rng.choice(["Hombre", "Mujer"], n),
+        "parentesco_persona": rng.choice(list(CONSTANTES_MAPEO["PARENTESCOS"].values()), n),
+        "recibe_apoyos_sociales": rng.choice(["Sí", "No"], n),
+        **{col: rng.random(n) < 0.35 for col in COLUMNAS_BANDERA},
+        "colonia": colonia,
+        "ageb": ageb,
+    })
+    for col in ["sexo_persona", "parentesco_persona", "recibe_apoyos_sociales", "colonia", "ageb"]:
+        df[col] = df[col].astype("category")
+    return df
@@ -0,0 +1,74 @@
+import json
+import types
+
+import pytest
+
+from src.agent import AgenteAnaliticoLLM, NucleoAnalitico
+from src.cache_persistente import CachePersistente
+from src.logic import AnalizadorProgramasSociales
+from src.particiones import escribir_particiones
+
+PLAN_TIZAPAN = {"intencion": "brechas", "filtros": {"programa_social": "inea", "ubicacion": "Tizapán"}}
+
+
+class ParserFalso:
+    """chat.completions del cliente OpenAI: el parser siempre pide PLAN_TIZAPAN."""
+
+    def __init__(self):
+        self.llamadas = 0
+
+    def create(self, **peticion):
+        self.llamadas += 1
+        llamada = types.SimpleNamespace(id=f"call_{self.llamadas}", type="function", function=types.SimpleNamespace(
+            name="ejecutar_analisis", arguments=json.dumps(PLAN_TIZAPAN)))
+        mensaje = types.SimpleNamespace(role="assistant", content=None, tool_calls=[llamada])
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=mensaje)], usage=None)
+
+
+@pytest.fixture
+def nucleo(censo, tmp_path):
+    ruta = str(tmp_path / "llm.sqlite")
+    nucleo = NucleoAnalitico(censo, "sin-clave", motor=AnalizadorProgramasSociales(censo),
+                             cache_intenciones=CachePersistente(ruta, "intenciones", 3600, 100),
+                             cache_narrativas=CachePersistente(ruta, "narrativas", 3600, 100))
+    nucleo.parser = ParserFalso()
+    nucleo.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=nucleo.parser))
+    return nucleo
+
+
+def test_seguimiento_no_usa_cache_de_intenciones(nucleo):
+    consulta = "¿y en Tizapán?"
+    # La misma frase ya se interpretó al inicio de otra conversación
+    nucleo.cache_intenciones.guardar(nucleo._clave_intencion(consulta), [PLAN_TIZAPAN])
+
+    agente = AgenteAnaliticoLLM(nucleo=nucleo)
+    agente.messages += [{"role": "user", "content": "brechas de la beca benito juárez"},
+                        nucleo.mensaje_asistente([("call_0", {"intencion": "brechas", "filtros": {}})]),
+                        {"role": "tool", "tool_call_id": "call_0", "name": "ejecutar_analisis", "content": "{}"}]
+    contexto_nuevo = agente._nuevo_turno(consulta)
+
+    msg, llamadas = nucleo.interpretar(agente.messages, contexto_nuevo)
+    assert not contexto_nuevo
+    assert nucleo.parser.llamadas == 1
+    assert [id_llamada for id_llamada, _ in llamadas] == ["call_1"]
+
+
+def test_pregunta_nueva_usa_cache_de_intenciones(nucleo):
+    consulta = "necesito revisar lo de la gente de tizapan"
+    nucleo.cache_intenciones.guardar(nucleo._clave_intencion(consulta), [PLAN_TIZAPAN])
+
+    _, llamadas = nucleo.interpretar([{"role": "user", "content": consulta}], contexto_nuevo=True)
+    assert nucleo.parser.llamadas == 0
+    assert llamadas == [("call_cache_0", PLAN_TIZAPAN)]
+
+
+def test_particionado_no_ofrece_intenciones_por_persona(censo, tmp_path):
+    escribir_particiones(censo, str(tmp_path), "Álvaro Obregón")
+    motor = AnalizadorProgramasSociales(censo, modo="particionado", ruta_particiones=str(tmp_path))
+    nucleo = NucleoAnalitico(censo, "sin-clave", motor=motor)
+
+    ofrecidas = nucleo.herramientas[0]["function"]["parameters"]["properties"]["intencion"]["enum"]
+    assert not set(ofrecidas) & set(NucleoAnalitico.INTENCIONES_POR_PERSONA)
+    assert "ranking_brechas" not in nucleo.system_prompt
+    # El intérprete local tampoco las resuelve: van al LLM, que ya no las ofrece
+    assert nucleo.interpretar_sin_llm("top 5 colonias con más brechas de inea", True) is None
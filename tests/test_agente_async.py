@@ -0,0 +1,74 @@
+import asyncio
+import json
+import types
+
+import pytest
+
+import src.agente_async as agente_async
+from src.agente_async import AgenteAnaliticoAsync, ColaJusta, NucleoAnaliticoAsync
+from src.cache_persistente import CachePersistente
+from src.logic import AnalizadorProgramasSociales
+
+PLAN = {"intencion": "brechas", "filtros": {"programa_social": "inea"}}
+
+
+class StreamSinFin:
+    """AsyncStream de OpenAI que manda un fragmento cada 10 ms y nunca termina."""
+
+    def __init__(self):
+        self.cerrado = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0.01)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content="bla "))])
+
+    async def close(self):
+        self.cerrado = True
+
+
+class LLMFalso:
+    def __init__(self):
+        self.stream = StreamSinFin()
+
+    async def create(self, stream=False, **peticion):
+        if stream:
+            return self.stream
+        llamada = types.SimpleNamespace(id="call_1", type="function", function=types.SimpleNamespace(
+            name="ejecutar_analisis", arguments=json.dumps(PLAN)))
+        mensaje = types.SimpleNamespace(role="assistant", content=None, tool_calls=[llamada])
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=mensaje)], usage=None)
+
+
+@pytest.fixture
+def nucleo(censo, tmp_path):
+    ruta = str(tmp_path / "llm.sqlite")
+    nucleo = NucleoAnaliticoAsync(censo, "sin-clave", cola=ColaJusta(capacidad=1),
+                                  motor=AnalizadorProgramasSociales(censo),
+                                  cache_intenciones=CachePersistente(ruta, "intenciones", 3600, 100),
+                                  cache_narrativas=CachePersistente(ruta, "narrativas", 3600, 100))
+    nucleo.llm = LLMFalso()
+    nucleo.client_async = types.SimpleNamespace(chat=types.SimpleNamespace(completions=nucleo.llm))
+    return nucleo
+
+
+def test_no_construye_el_cliente_sincrono(nucleo):
+    assert "client" not in vars(nucleo)
+
+
+def test_stream_sin_fin_respeta_el_timeout_total(nucleo, monkeypatch):
+    monkeypatch.setattr(agente_async, "LLM_TIMEOUT_S", 0.2)
+    agente = AgenteAnaliticoAsync(nucleo, usuario="ana")
+
+    async def preguntar():
+        inicio = asyncio.get_running_loop().time()
+        respuesta = await agente.procesar_async("zq consulta que el intérprete local no entiende")
+        return respuesta, asyncio.get_running_loop().time() - inicio
+
+    respuesta, segundos = asyncio.run(preguntar())
+    assert "⏳ El modelo no respondió en 0.2 s" in respuesta
+    assert segundos < 1.0
+    assert nucleo.llm.stream.cerrado
+    assert nucleo.cola.metricas()["activas"] == 0
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.descargas import GestorDescargas
+
+CONTENIDO = bytes(range(256)) * 1024  # 256 KiB: varios bloques de GestorDescargas.TAMANO_BLOQUE
+
+
+class Servidor(ThreadingHTTPServer):
+    """Asset único con ETag y Range; registra los encabezados de cada petición."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Manejador)
+        self.contenido = CONTENIDO
+        self.etag = '"v1"'
+        self.acepta_range = True
+        self.peticiones = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/censo.csv"
+
+
+class Manejador(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        servidor = self.server
+        servidor.peticiones.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == servidor.etag:
+            self.send_response(304)
+            self.send_header("ETag", servidor.etag)
+            self.end_headers()
+            return
+
+        cuerpo, estado = servidor.contenido, 200
+        rango = self.headers.get("Range")
+        if rango and servidor.acepta_range and self.headers.get("If-Range", servidor.etag) == servidor.etag:
+            inicio = int(rango.split("=")[1].rstrip("-"))
+            cuerpo, estado = cuerpo[inicio:], 206
+        self.send_response(estado)
+        self.send_header("ETag", servidor.etag)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+
+@pytest.fixture
+def servidor():
+    servidor = Servidor()
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def _leer(ruta: str) -> bytes:
+    with open(ruta, "rb") as f:
+        return f.read()
+
+
+def _simular_corte(gestor: GestorDescargas, servidor: Servidor, n_bytes: int):
+    """Deja un .part con los primeros n_bytes, como una descarga interrumpida."""
+    os.makedirs(gestor.directorio, exist_ok=True)
+    ruta, ruta_part, ruta_meta = gestor._rutas(servidor.url)
+    with open(ruta_part, "wb") as f:
+        f.write(servidor.contenido[:n_bytes])
+    with open(ruta_meta, "w") as f:
+        json.dump({"parcial": {"url": servidor.url, "etag": servidor.etag, "last_modified": None}}, f)
+    return ruta, ruta_part
+
+
+def test_descarga_y_sin_cambios_responde_304(servidor, tmp_path):
+    gestor = GestorDescargas(str(tmp_path))
+    ruta = gestor.descargar(servidor.url)
+    assert _leer(ruta) == CONTENIDO
+
+    assert gestor.descargar(servidor.url) == ruta
+    assert servidor.peticiones[-1]["If-None-Match"] == servidor.etag
+    assert _leer(ruta) == CONTENIDO
+
+
+def test_asset_cambiado_se_descarga_de_nuevo(servidor, tmp_path):
+    gestor = GestorDescargas(str(tmp_path))
+    gestor.descargar(servidor.url)
+    servidor.contenido, servidor.etag = b"nueva version", '"v2"'
+    assert _leer(gestor.descargar(servidor.url)) == b"nueva version"
+
+
+def test_reanuda_con_range(servidor, tmp_path):
+    gestor = GestorDescargas(str(tmp_path))
+    _, ruta_part = _simular_corte(gestor, servidor, 100_000)
+
+    ruta = gestor.descargar(servidor.url)
+    assert servidor.peticiones[-1]["Range"] == "bytes=100000-"
+    assert servidor.peticiones[-1]["If-Range"] == servidor.etag
+    assert _leer(ruta) == CONTENIDO
+    assert not os.path.exists(ruta_part)
+    assert gestor.metadatos[servidor.url]["sha256"] == hashlib.sha256(CONTENIDO).hexdigest()
+
+
+def test_servidor_que_ignora_range_reinicia_la_descarga(servidor, tmp_path):
+    servidor.acepta_range = False
+    gestor = GestorDescargas(str(tmp_path))
+    _simular_corte(gestor, servidor, 100_000)
+
+    ruta = gestor.descargar(servidor.url)
+    assert "Range" in servidor.peticiones[-1]
+    assert _leer(ruta) == CONTENIDO  # 200 reemplaza el .part, no se agrega
+
+
+def test_checksum_invalido(servidor, tmp_path):
+    gestor = GestorDescargas(str(tmp_path), checksums={"censo.csv": "0" * 64})
+    with pytest.raises(IOError, match="Checksum inválido"):
+        gestor.descargar(servidor.url)
+    ruta, ruta_part, _ = gestor._rutas(servidor.url)
+    assert not os.path.exists(ruta) and not os.path.exists(ruta_part)
+
+
+def test_checksum_valido(servidor, tmp_path):
+    gestor = GestorDescargas(str(tmp_path), checksums={"censo.csv": hashlib.sha256(CONTENIDO).hexdigest()})
+    assert _leer(gestor.descargar(servidor.url)) == CONTENIDO
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from src.logic import AnalizadorProgramasSociales, producto_filtros
+from tests.conftest import AGEB_SIN_COLONIA
+
+pytest.importorskip("duckdb")
+
+ANALISIS = {
+    "conteo_general": "analisis_general",
+    "elegibilidad": "analizar_elegibilidad",
+    "brechas": "analizar_brechas",
+    "vulnerabilidad": "analizar_vulnerabilidad",
+}
+
+# Conjunto de referencia: cada filtro solo y combinado con ubicación y sexo
+FILTROS = [{}, {"rango_edad": [18, 64]}, {"rango_edad": [65.5, 200]}, {"rango_edad": [30, 20]},
+           {"parentesco": "jefe"}, {"carencia_tipo": "salud"}, {"grupo_especial": "jefas_familia"},
+           {"ubicacion": "inexistente"}]
+CONSULTAS = [dict(f, **extra) for f in FILTROS for extra in producto_filtros(
+    {"programa_social": "pension_adultos_mayores"}, ubicacion=[None, "San Ángel", AGEB_SIN_COLONIA], sexo=[None, "Mujer"])]
+
+
+@pytest.fixture(scope="module")
+def motores(censo):
+    return AnalizadorProgramasSociales(censo, modo="pandas"), AnalizadorProgramasSociales(censo, modo="duckdb")
+
+
+def _json(resultado) -> str:
+    return json.dumps(resultado, sort_keys=True, default=str)
+
+
+@pytest.mark.parametrize("intencion", list(ANALISIS))
+def test_duckdb_coincide_con_pandas(motores, intencion):
+    pandas, duckdb = motores
+    for filtros in CONSULTAS:
+        filtros = {k: v for k, v in filtros.items() if v is not None}
+        esperado = getattr(pandas, ANALISIS[intencion])(filtros)
+        assert _json(getattr(duckdb, ANALISIS[intencion])(filtros)) == _json(esperado), filtros
+
+
+@pytest.mark.parametrize("fila, columna", [("sexo", "edad"), ("colonia", "parentesco"), ("ageb", "carencia_salud")])
+def test_duckdb_tabla_cruzada_coincide_con_pandas(motores, fila, columna):
+    pandas, duckdb = motores
+    filtros = {"variable_fila": fila, "variable_columna": columna, "sexo": "Mujer"}
+    assert _json(duckdb.tabla_cruzada(filtros)) == _json(pandas.tabla_cruzada(filtros))
@@ -0,0 +1,65 @@
+import pytest
+
+from src.interprete_local import InterpreteLocal
+from src.logic import AnalizadorProgramasSociales
+
+
+@pytest.fixture(scope="module")
+def interprete(censo):
+    return InterpreteLocal(AnalizadorProgramasSociales(censo))
+
+
+def test_confiado_en_pregunta_simple(interprete):
+    args, confianza = interprete.interpretar("elegibles a la pensión adultos mayores en mujeres")
+    assert confianza >= interprete.UMBRAL
+    assert args == {"intencion": "elegibilidad",
+                    "filtros": {"programa_social": "pension_adultos_mayores", "sexo": "Mujer"}}
+
+
+@pytest.mark.parametrize("consulta, carencia", [
+    ("personas sin seguridad social", "seguridad_social"),
+    ("cuántas personas sin acceso a servicios de salud", "salud"),
+])
+def test_negacion_es_carencia(interprete, consulta, carencia):
+    args, confianza = interprete.interpretar(consulta)
+    assert args["filtros"].get("carencia_tipo") == carencia
+    assert confianza >= interprete.UMBRAL
+
+
+@pytest.mark.parametrize("consulta", [
+    "¿Cuántas personas con seguridad social hay en Santa Fe?",
+    "mujeres que sí tienen seguridad social en Tizapán",
+])
+def test_con_seguridad_social_no_es_carencia(interprete, consulta):
+    args, confianza = interprete.interpretar(consulta)
+    assert args is None or "carencia_tipo" not in args["filtros"]
+    assert confianza < interprete.UMBRAL
+
+
+@pytest.mark.parametrize("consulta", [
+    "cuántas personas hay entre 15 y 5 años",
+    "cuántas personas mayores de 200 hay",
+])
+def test_rango_de_edad_imposible_va_al_llm(interprete, consulta):
+    args, confianza = interprete.interpretar(consulta)
+    assert confianza < interprete.UMBRAL
+    if args is not None:
+        minimo, maximo = args["filtros"]["rango_edad"]
+        assert 0 <= minimo and maximo <= 120
+
+
+def test_rango_de_edad_valido(interprete):
+    args, confianza = interprete.interpretar("cuántas personas hay entre 5 y 15 años")
+    assert args["filtros"]["rango_edad"] == [5, 15]
+    assert confianza >= interprete.UMBRAL
+
+
+def test_ambos_sexos_va_al_llm(interprete):
+    # "mujeres y hombres" pide comparar (plan de varios análisis), no quitar el filtro de sexo
+    args, confianza = interprete.interpretar("pensión adultos mayores en mujeres y hombres")
+    assert args is None or "sexo" not in args["filtros"]
+    assert confianza < interprete.UMBRAL
+
+
+def test_seguimiento_sin_contexto_nuevo_va_al_llm(interprete):
+    assert interprete.interpretar("¿y en Tizapán?", contexto_nuevo=False) == (None, 0.0)
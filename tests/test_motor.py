@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from src.logic import AnalizadorProgramasSociales
+from src.particiones import escribir_particiones
+from tests.conftest import AGEB_SIN_COLONIA
+
+ANALISIS = {
+    "conteo_general": "analisis_general",
+    "elegibilidad": "analizar_elegibilidad",
+    "brechas": "analizar_brechas",
+    "vulnerabilidad": "analizar_vulnerabilidad",
+    "tabla_cruzada": "tabla_cruzada",
+}
+
+
+@pytest.fixture(scope="module")
+def motores(censo, tmp_path_factory):
+    ruta = str(tmp_path_factory.mktemp("particiones"))
+    escribir_particiones(censo, ruta, "Álvaro Obregón")
+    # La paridad de duckdb (dependencia opcional) vive en test_duckdb.py
+    modos = [m for m in AnalizadorProgramasSociales.MODOS if m != "duckdb"]
+    return {m: AnalizadorProgramasSociales(censo, modo=m, ruta_particiones=ruta) for m in modos}
+
+
+@pytest.mark.parametrize("ubicacion", [AGEB_SIN_COLONIA, "San Ángel", "0101"])
+@pytest.mark.parametrize("intencion", list(ANALISIS))
+def test_modos_coinciden_con_pandas(motores, intencion, ubicacion):
+    filtros = {"ubicacion": ubicacion, "programa_social": "inea",
+               "variable_fila": "sexo", "variable_columna": "edad"}
+    esperado = json.dumps(getattr(motores["pandas"], ANALISIS[intencion])(filtros), sort_keys=True, default=str)
+    for modo, motor in motores.items():
+        obtenido = json.dumps(getattr(motor, ANALISIS[intencion])(filtros), sort_keys=True, default=str)
+        assert obtenido == esperado, modo
+
+
+def test_particionado_incluye_personas_sin_colonia(censo, motores):
+    total = int((censo["ageb"] == AGEB_SIN_COLONIA).sum())
+    assert censo.loc[censo["ageb"] == AGEB_SIN_COLONIA, "colonia"].isna().any()
+    resultado = motores["particionado"].analisis_general({"ubicacion": AGEB_SIN_COLONIA})
+    assert resultado["total_personas"] == total
+
+
+@pytest.mark.parametrize("analisis", ["ranking_brechas", "ranking_vulnerabilidad",
+                                      "analizar_hogares", "analizar_vulnerabilidad_hogares"])
+def test_particionado_avisa_analisis_por_persona(motores, analisis):
+    resultado = getattr(motores["particionado"], analisis)({"programa_social": "inea"})
+    assert "no está disponible" in resultado["error"]
+
+
+@pytest.mark.parametrize("intencion", ["elegibilidad", "brechas"])
+def test_lote_particionado_coincide_con_pandas(motores, intencion):
+    consultas = [{"programa_social": "inea", "ubicacion": AGEB_SIN_COLONIA},
+                 {"programa_social": "inea", "ubicacion": "San Ángel"},
+                 {"programa_social": "beca_benito_juarez"}]
+    esperado = motores["pandas"].analizar_lote(consultas, intencion)
+    assert motores["particionado"].analizar_lote(consultas, intencion) == esperado